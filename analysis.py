@@ -1,24 +1,54 @@
-import matplotlib.pyplot as plt
-from scipy import signal
 from scipy.io import wavfile
 import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+from functools import lru_cache
+
+# scipy.signal and matplotlib take a second or more to import, they are imported
+# by the functions using them so that processes which do not need them start fast
+
+win_len = 256
+# scipy's default overlap is an eighth of the window
+win_step = win_len - win_len // 8
+
+def normalize_samples(samples):
+	'convert samples to float32 in [-1, 1], whatever the pcm format we read'
+	if np.issubdtype(samples.dtype, np.integer):
+		return samples.astype(np.float32) / np.iinfo(samples.dtype).max
+	return samples.astype(np.float32, copy=False)
+
+def mono_samples(samples):
+	'normalized samples, (frames, channels) arrays are downmixed as spectrograms are computed on one channel'
+	samples = normalize_samples(samples)
+	return samples.mean(axis=1, dtype=np.float32) if samples.ndim > 1 else samples
+
+def read_samples(filename):
+	'read a wav file as float samples, one column per channel, returns None if it could not be read'
+	try:
+		sample_rate, samples = wavfile.read(filename)
+	except:
+		return None, None
+	return sample_rate, normalize_samples(samples)
 
 def spectrogram_from_file(filename, save_path=None):
-	win_len = 256
 	sample_rate, samples = None, None
 	try:
 		sample_rate, samples = wavfile.read(filename)
 	except:
 		print('failed to read audio file:', filename)
 		return None, None, None
+	return spectrogram_from_samples(samples, sample_rate, save_path)
+
+def spectrogram_from_samples(samples, sample_rate, save_path=None):
 	# in some cases sound generation may have failed or produced an unusable tiny file
-	if len(samples) < win_len:
+	if samples is None or len(samples) < win_len:
 		return None, None, None
+	from scipy import signal
 	# https://docs.scipy.org/doc/scipy/reference/generated/scipy.signal.spectrogram.html
 	frequencies, times, spectrogram = signal.spectrogram(
-		samples, sample_rate, nperseg=win_len, nfft=win_len, scaling='spectrum')\
+		mono_samples(samples), sample_rate, nperseg=win_len, nfft=win_len, scaling='spectrum')
 	# save spectrogram figure
 	if save_path is not None:
+		import matplotlib.pyplot as plt
 		plt.imshow(spectrogram)
 		plt.ylabel('Frequency')
 		plt.xlabel('Time')
@@ -36,3 +66,278 @@ def sound_similarity(spec1, spec2):
 	dist = np.sum(np.square(spec1[:,:l] - spec2[:,:l]))
 	#norm_dist = dist / spec2.size
 	return spec2.size / dist
+
+def frame_count(num_samples):
+	'number of spectrogram frames computed for a sound of num_samples'
+	return 0 if num_samples < win_len else (num_samples - win_len) // win_step + 1
+
+def spectrograms_from_buffers(buffers, sample_rate, length=0):
+	'''
+	spectrograms of many sounds with a single stft call, buffers are zero padded
+	to the same length (at least length samples), returns a (N, F, T) float32 stack
+	and the valid frame count per sound
+	'''
+	lengths = [0 if b is None else len(b) for b in buffers]
+	counts = np.array([frame_count(l) for l in lengths], dtype=np.int64)
+	stack = np.zeros((len(buffers), max(max(lengths), win_len, length)), dtype=np.float32)
+	for i, b in enumerate(buffers):
+		if counts[i] > 0:
+			stack[i, :lengths[i]] = mono_samples(b)
+	from scipy import signal
+	_, _, spectrograms = signal.spectrogram(
+		stack, sample_rate, nperseg=win_len, nfft=win_len, scaling='spectrum', axis=-1)
+	return spectrograms, counts
+
+class Reference:
+	'the target spectrogram, with the terms batch similarity needs precomputed once'
+	def __init__(self, spectrum):
+		self.spectrum = np.ascontiguousarray(spectrum, dtype=np.float32)
+		self.size = spectrum.size
+		self.num_frames = spectrum.shape[1]
+
+def batch_similarity(spectrograms, counts, reference):
+	'''
+	vectorized sound_similarity of a (N, F, T) stack against the reference,
+	frames past each sound valid frame count are masked, sounds with no frame score 0
+	'''
+	l = min(spectrograms.shape[2], reference.num_frames)
+	diff = spectrograms[:, :, :l] - reference.spectrum[None, :, :l]
+	frame_dist = np.einsum('nft,nft->nt', diff, diff)
+	mask = np.arange(l)[None, :] < counts[:, None]
+	dist = np.sum(frame_dist * mask, axis=1)
+	with np.errstate(divide='ignore'):
+		return np.where(counts > 0, reference.size / dist, 0)
+
+def batch_similarity_from_buffers(buffers, sample_rate, reference, chunk_size=256):
+	'similarity of many rendered sounds, by chunks to bound the spectrograms stack size'
+	similarity = np.zeros(len(buffers))
+	for start in range(0, len(buffers), chunk_size):
+		spectrograms, counts = spectrograms_from_buffers(buffers[start:start+chunk_size], sample_rate)
+		similarity[start:start+chunk_size] = batch_similarity(spectrograms, counts, reference)
+	return similarity
+
+# long sounds are analyzed by blocks of frames read from memory mapped files,
+# the memory an evaluation needs does not grow with their duration
+stream_block = 1024
+
+def open_samples(filename):
+	'memory mapped samples of a wav file and its sample rate, None if it could not be read'
+	try:
+		sample_rate, samples = wavfile.read(filename, mmap=True)
+	except:
+		return None, None
+	return sample_rate, samples
+
+def spectrogram_blocks(samples, sample_rate, block=stream_block):
+	'the spectrogram spectrogram_from_samples computes, by blocks of frames along with their first frame'
+	from scipy import signal
+	count = frame_count(len(samples))
+	for start in range(0, count, block):
+		end = min(start + block, count)
+		_, _, spectrogram = signal.spectrogram(mono_samples(samples[start * win_step:(end - 1) * win_step + win_len]), \
+			sample_rate, nperseg=win_len, nfft=win_len, scaling='spectrum')
+		yield start, spectrogram
+
+def stream_reference(filename, path, block=stream_block):
+	'''
+	write the spectrogram of a wav file to a .npy file block by block, returns the time
+	of its last frame (as spectrogram_from_file) and the reference memory mapped from it
+	'''
+	sample_rate, samples = open_samples(filename)
+	if samples is None or frame_count(len(samples)) == 0:
+		print('failed to read audio file:', filename)
+		return None, None
+	count = frame_count(len(samples))
+	spectrum = np.lib.format.open_memmap(path, mode='w+', dtype=np.float32, shape=(win_len // 2 + 1, count))
+	for start, spectrogram in spectrogram_blocks(samples, sample_rate, block):
+		spectrum[:, start:start + spectrogram.shape[1]] = spectrogram
+	spectrum.flush()
+	del spectrum
+	return ((count - 1) * win_step + win_len / 2) / sample_rate, Reference(np.load(path, mmap_mode='r'))
+
+def streaming_similarity(filename, reference, block=stream_block):
+	'''
+	sound_similarity of a wav file with the reference, the distance is accumulated block by block,
+	an unreadable file or a sound with no frame scores 0, as in batch_similarity
+	'''
+	sample_rate, samples = open_samples(filename)
+	if samples is None:
+		return 0.
+	l = min(frame_count(len(samples)), reference.num_frames)
+	if l == 0:
+		return 0.
+	dist = 0.
+	for start, spectrogram in spectrogram_blocks(samples[:(l - 1) * win_step + win_len], sample_rate, block):
+		diff = spectrogram - reference.spectrum[:, start:start + spectrogram.shape[1]]
+		dist += float(np.einsum('ft,ft->', diff, diff))
+	return reference.size / dist if dist > 0 else float('inf')
+
+class References:
+	'several target spectrograms zero padded to the longest, to score sounds against all of them at once'
+	def __init__(self, spectra):
+		self.count = len(spectra)
+		self.num_frames = np.array([s.shape[1] for s in spectra], dtype=np.int64)
+		self.sizes = np.array([s.size for s in spectra], dtype=np.float64)
+		self.stack = np.zeros((len(spectra), spectra[0].shape[0], max(self.num_frames)), dtype=np.float32)
+		for m, s in enumerate(spectra):
+			self.stack[m, :, :s.shape[1]] = s
+		# squared norm of every target frame
+		self.energy = np.einsum('mft,mft->mt', self.stack, self.stack, dtype=np.float64)
+
+def multi_similarity(spectrograms, counts, references):
+	'''
+	(N, M) similarities of a (N, F, T) stack against every target, each pair is compared over
+	the frames both sounds have as sound_similarity does, the distance of two frames expands
+	to |s|^2 + |r|^2 - 2 s.r so the cross terms of all the pairs are a single matrix product per frame
+	'''
+	l = min(spectrograms.shape[2], references.stack.shape[2])
+	s = spectrograms[:, :, :l].astype(np.float64)
+	energy = np.einsum('nft,nft->nt', s, s)
+	# (T, N, F) @ (T, F, M) gives the (T, N, M) cross terms
+	cross = np.matmul(s.transpose(2, 0, 1), references.stack[:, :, :l].astype(np.float64).transpose(2, 1, 0))
+	frame_dist = energy.T[:, :, None] + references.energy[:, :l].T[:, None, :] - 2 * cross
+	valid = np.minimum(counts[:, None], references.num_frames[None, :])
+	mask = np.arange(l)[:, None, None] < valid[None, :, :]
+	# rounding may leave tiny negative distances between identical frames
+	dist = np.maximum(np.sum(frame_dist * mask, axis=0), 0)
+	with np.errstate(divide='ignore'):
+		return np.where(counts[:, None] > 0, references.sizes[None, :] / dist, 0)
+
+def multi_similarity_from_buffers(buffers, sample_rate, references, chunk_size=64):
+	'(N, M) similarities of many rendered sounds against every target, by chunks'
+	similarity = np.zeros((len(buffers), references.count))
+	for start in range(0, len(buffers), chunk_size):
+		spectrograms, counts = spectrograms_from_buffers(buffers[start:start+chunk_size], sample_rate)
+		similarity[start:start+chunk_size] = multi_similarity(spectrograms, counts, references)
+	return similarity
+
+# coarse to fine scoring: candidates are compared with the reference at increasing resolutions,
+# each level gives a lower bound of the exact distance and only the candidates whose bound is within
+# the k-th best distance go to the next level, all the levels are computed from the samples:
+# - frame energies pooled over a few frames: by parseval the spectrum of a frame sums to
+#   win_len * sum(y^2) / sum(w)^2 (y the detrended windowed frame), no fft needed, and by
+#   cauchy-schwarz the squared distance is at least (pooled difference)^2 / cell size
+# - the exact distance over one frame out of decimation, the others being left out
+# - the exact distance
+
+# relative margin above the threshold before a sound is pruned, as bounds and distances are rounded
+pruning_tolerance = 1e-4
+
+@lru_cache(maxsize=None)
+def analysis_window():
+	'the window signal.spectrogram uses by default'
+	from scipy import signal
+	return signal.get_window(('tukey', .25), win_len).astype(np.float32)
+
+def windowed_frames(samples, decimation=1):
+	'the detrended windowed frames signal.spectrogram transforms, one out of decimation'
+	frames = sliding_window_view(mono_samples(samples), win_len)[::win_step * decimation]
+	return (frames - frames.mean(axis=1, keepdims=True)) * analysis_window()
+
+def frame_energies(samples):
+	'sum over frequencies of each spectrogram frame, computed from the samples'
+	if samples is None or frame_count(len(samples)) == 0:
+		return np.zeros(0)
+	y = windowed_frames(samples)
+	return np.einsum('tj,tj->t', y, y) * (win_len / np.sum(analysis_window(), dtype=np.float64) ** 2)
+
+def decimated_spectrogram(samples, decimation):
+	'one spectrogram frame out of decimation, as signal.spectrogram computes them'
+	spectrum = np.abs(np.fft.rfft(windowed_frames(samples, decimation), axis=1)) ** 2 \
+		/ np.sum(analysis_window(), dtype=np.float64) ** 2
+	# one sided spectrum, all bins but the first and last get the energy of their negative frequency
+	spectrum[:, 1:-1] *= 2
+	return spectrum.T
+
+class Pyramid:
+	'''
+	the reference at decreasing resolutions: the cumulative sum of its frame energies,
+	to pool cells of step frames cut anywhere, and one of its frames out of decimation
+	'''
+	def __init__(self, reference, step=8, decimation=4):
+		self.step = step
+		self.decimation = decimation
+		self.cumulative = np.concatenate(([0.], np.cumsum(reference.spectrum.sum(axis=0, dtype=np.float64))))
+		self.decimated = reference.spectrum[:, ::decimation].astype(np.float64)
+
+def pyramid_of(reference):
+	if getattr(reference, 'pyramid', None) is None:
+		reference.pyramid = Pyramid(reference)
+	return reference.pyramid
+
+def energy_bound(energies, counts, reference):
+	'''
+	lower bounds of the distances sound_similarity computes from the (N, T) frame energies,
+	frames past each sound valid frame count are left out
+	'''
+	pyramid = pyramid_of(reference)
+	l = min(energies.shape[1], reference.num_frames)
+	if l == 0:
+		return np.zeros(len(energies))
+	cuts = np.minimum(counts, l)
+	starts = np.arange(0, l, pyramid.step)
+	cumulative = np.concatenate((np.zeros((len(energies), 1)), np.cumsum(energies[:, :l], axis=1)), axis=1)
+	a = np.minimum(starts[None, :], cuts[:, None])
+	b = np.minimum(np.minimum(starts + pyramid.step, l)[None, :], cuts[:, None])
+	cells = np.take_along_axis(cumulative, b, axis=1) - np.take_along_axis(cumulative, a, axis=1)
+	reference_cells = pyramid.cumulative[b] - pyramid.cumulative[a]
+	sizes = reference.spectrum.shape[0] * (b - a)
+	diff = cells - reference_cells
+	return np.sum(diff * diff / np.maximum(sizes, 1), axis=1)
+
+def decimated_bound(samples, count, reference):
+	'lower bound of the distance sound_similarity computes, over one frame out of decimation'
+	pyramid = pyramid_of(reference)
+	frames = -(-min(count, reference.num_frames) // pyramid.decimation)
+	if frames == 0:
+		return 0.
+	diff = decimated_spectrogram(samples, pyramid.decimation)[:, :frames] - pyramid.decimated[:, :frames]
+	return float(np.sum(diff * diff))
+
+def pruned_similarity_from_buffers(buffers, sample_rate, reference, keep, known=(), chunk_size=256):
+	'''
+	similarities of many rendered sounds when only the keep best matter, along with the known exact
+	similarities of other sounds: the keep sounds with the best coarse bounds are scored exactly and set
+	a threshold, the others are refined level by level as long as their bound is within it,
+	so the cost of spectrograms and exact distances grows with the number of contenders,
+	survivors get the exact similarity batch_similarity_from_buffers computes,
+	pruned sounds an upper bound of it, returns the similarities and the exact mask
+	'''
+	n = len(buffers)
+	lengths = np.array([0 if b is None else len(b) for b in buffers], dtype=np.int64)
+	counts = np.array([frame_count(l) for l in lengths], dtype=np.int64)
+	# spectrograms of a subset are padded as their chunk would be without pruning, so that
+	# exact distances are computed over the same frames in the same order
+	padded = np.zeros(n, dtype=np.int64)
+	for start in range(0, n, chunk_size):
+		padded[start:start+chunk_size] = np.max(lengths[start:start+chunk_size])
+	def score_exactly(indexes):
+		for length in np.unique(padded[indexes]):
+			group = indexes[padded[indexes] == length]
+			for start in range(0, len(group), chunk_size):
+				selected = group[start:start+chunk_size]
+				spectrograms, _ = spectrograms_from_buffers([buffers[k] for k in selected], sample_rate, length)
+				similarity[selected] = batch_similarity(spectrograms, counts[selected], reference)
+		exact[indexes] = True
+	similarity = np.zeros(n)
+	# sounds with no frame score 0, exactly
+	exact = counts == 0
+	candidates = np.flatnonzero(~exact)
+	bound = np.zeros(n)
+	if len(candidates) > 0:
+		energies = np.zeros((len(candidates), max(counts[candidates])))
+		for row, k in enumerate(candidates):
+			energies[row, :counts[k]] = frame_energies(buffers[k])
+		bound[candidates] = energy_bound(energies, counts[candidates], reference)
+	seeds = candidates[np.argsort(bound[candidates], kind='stable')[:keep]]
+	score_exactly(seeds)
+	with np.errstate(divide='ignore'):
+		distances = np.sort(reference.size / np.concatenate((np.array(known, dtype=np.float64), similarity[seeds])))
+	threshold = distances[keep - 1] * (1 + pruning_tolerance) if len(distances) >= keep else float('inf')
+	contenders = np.flatnonzero(~exact & (bound <= threshold))
+	for k in contenders:
+		bound[k] = max(bound[k], decimated_bound(buffers[k], counts[k], reference))
+	score_exactly(contenders[bound[contenders] <= threshold])
+	pruned = ~exact
+	similarity[pruned] = reference.size / bound[pruned]
+	return similarity, exact
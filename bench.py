@@ -0,0 +1,229 @@
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import tempfile
+import tracemalloc
+from contextlib import redirect_stdout
+import numpy as np
+from elements import read_op_set, CompiledOpSet
+from tree import make_dsp_graph, clone_graph, opcode_selection_weight_matrix
+from genetic_operators import mutate_consts, subtree_mutation, mutate_consts_genome, subtree_mutation_genome
+from code_gen import graph_to_csound
+from analysis import spectrogram_from_file, sound_similarity, Reference
+from scheduler import RenderScheduler
+from util import render_command
+from experiment import Individual, Evaluator, Experiment, ExperimentParms, selection, render_individuals
+import fake_csound
+
+# times the parts of a generation separately, across population sizes and tree depths, reports
+# operations per second and the peak memory allocated by python, and compares them with a baseline:
+# python -m cli bench [--quick] [--save] [--csound]
+# renders use a deterministic fake csound unless --csound is given
+
+baseline_path = 'bench_baseline.json'
+default_sizes = (16, 64)
+default_depths = (3, 5)
+terminal_likelyhood = .3
+lerp_factor = .2
+duration = 1.
+# a case is flagged when it gets slower or allocates more than this fraction of its baseline
+tolerance = .25
+
+class Context:
+	'op sets, a working directory and a target sound shared by the cases'
+	def __init__(self, directory, seed=0):
+		self.directory = directory
+		self.seed = seed
+		self.intern, self.term = read_op_set()
+		self.op_set = CompiledOpSet(self.intern, self.term, opcode_selection_weight_matrix)
+		random.seed(seed)
+		self.target = os.path.join(directory, 'target')
+		target = make_dsp_graph(self.intern, self.term, terminal_likelyhood, 4)
+		RenderScheduler().run([render_command(graph_to_csound(target), duration, self.target)])
+		_, _, spectrum = spectrogram_from_file(self.target + '.wav')
+		self.reference = Reference(spectrum)
+		self.renders = dict()
+
+	def trees(self, size, depth):
+		random.seed(self.seed)
+		return [make_dsp_graph(self.intern, self.term, terminal_likelyhood, depth) for _ in range(size)]
+
+	def population(self, size, depth):
+		return [Individual(t) for t in self.trees(size, depth)]
+
+	def rendered(self, size, depth):
+		'a rendered population, rendered once in its own directory as cases run again and again'
+		if (size, depth) not in self.renders:
+			directory = os.path.join(self.directory, 'rendered_%d_%d' % (size, depth))
+			os.makedirs(directory)
+			population = self.population(size, depth)
+			render_individuals(population, duration, directory)
+			self.renders[(size, depth)] = population
+		return self.renders[(size, depth)]
+
+# each case prepares its inputs, untimed, and returns the function to time and its operation count
+
+def bench_make_dsp_graph(context, size, depth):
+	random.seed(context.seed)
+	return lambda: [make_dsp_graph(context.intern, context.term, terminal_likelyhood, depth) for _ in range(size)], size
+
+def bench_clone_graph(context, size, depth):
+	trees = context.trees(size, depth)
+	return lambda: [clone_graph(t) for t in trees], size
+
+def bench_mutate_consts(context, size, depth):
+	trees = context.trees(size, depth)
+	return lambda: [mutate_consts(t, lerp_factor) for t in trees], size
+
+def bench_subtree_mutation(context, size, depth):
+	trees = context.trees(size, depth)
+	return lambda: [subtree_mutation(t, context.intern, context.term, terminal_likelyhood, depth) for t in trees], size
+
+def bench_random_genomes(context, size, depth):
+	rng = np.random.default_rng(context.seed)
+	return lambda: context.op_set.random_genomes(size, terminal_likelyhood, depth, rng), size
+
+def bench_mutate_consts_genome(context, size, depth):
+	genomes = [i.genome for i in context.population(size, depth)]
+	rng = np.random.default_rng(context.seed)
+	return lambda: [mutate_consts_genome(g, lerp_factor, rng) for g in genomes], size
+
+def bench_subtree_mutation_genome(context, size, depth):
+	genomes = [i.genome for i in context.population(size, depth)]
+	rng = np.random.default_rng(context.seed)
+	return lambda: [subtree_mutation_genome(g, context.op_set, terminal_likelyhood, depth, rng) for g in genomes], size
+
+def bench_graph_to_csound(context, size, depth):
+	trees = context.trees(size, depth)
+	return lambda: [graph_to_csound(t) for t in trees], size
+
+def bench_render(context, size, depth):
+	population = context.population(size, depth)
+	return lambda: render_individuals(population, duration, context.directory), size
+
+def bench_spectrogram_from_file(context, size, depth):
+	population = context.rendered(size, depth)
+	return lambda: [spectrogram_from_file(i.filename + '.wav') for i in population], size
+
+def bench_sound_similarity(context, size, depth):
+	spectra = [spectrogram_from_file(i.filename + '.wav')[2] for i in context.rendered(size, depth)]
+	def run():
+		# programs rendered like the target match it exactly
+		with np.errstate(divide='ignore'):
+			return [sound_similarity(s, context.reference.spectrum) for s in spectra]
+	return run, size
+
+def bench_selection(context, size, depth):
+	'selection of already scored individuals, the evaluation is timed by the other cases'
+	population = context.population(size, depth)
+	for k, i in enumerate(population):
+		i.similarity = float(k)
+	evaluator = Evaluator(context.reference, duration, context.directory)
+	return lambda: selection(population, size // 2, 0., evaluator), size
+
+def bench_generation_step(context, size, depth):
+	parms = ExperimentParms(context.target + '.wav', context.intern, context.term, 1, size, size, depth, \
+		terminal_likelyhood, lerp_factor, 0., op_set=context.op_set)
+	experiment = Experiment(parms, context.directory, seed=context.seed)
+	random.seed(context.seed)
+	experiment.initialize()
+	return experiment.generation_step, 1
+
+cases = [
+	('make_dsp_graph', bench_make_dsp_graph),
+	('clone_graph', bench_clone_graph),
+	('mutate_consts', bench_mutate_consts),
+	('subtree_mutation', bench_subtree_mutation),
+	('random_genomes', bench_random_genomes),
+	('mutate_consts_genome', bench_mutate_consts_genome),
+	('subtree_mutation_genome', bench_subtree_mutation_genome),
+	('graph_to_csound', bench_graph_to_csound),
+	('render', bench_render),
+	('spectrogram_from_file', bench_spectrogram_from_file),
+	('sound_similarity', bench_sound_similarity),
+	('selection', bench_selection),
+	('generation_step', bench_generation_step)]
+
+def measure(prepare, repeats, min_time=.2):
+	'''
+	best operations per second over repeats measures, each runs the case again until it timed
+	at least min_time, and the peak memory python allocated during one more run, traced
+	separately as tracing slows everything down
+	'''
+	rates = []
+	for _ in range(repeats):
+		ops, elapsed = 0, 0.
+		while elapsed < min_time:
+			run, count = prepare()
+			start = time.perf_counter()
+			run()
+			elapsed += time.perf_counter() - start
+			ops += count
+		rates.append(ops / elapsed)
+	run, _ = prepare()
+	tracemalloc.start()
+	run()
+	_, peak = tracemalloc.get_traced_memory()
+	tracemalloc.stop()
+	return max(rates), peak
+
+def regressions(result, baseline):
+	'what got worse than the baseline beyond the tolerance'
+	worse = []
+	if result['ops_per_sec'] < baseline['ops_per_sec'] * (1 - tolerance):
+		worse.append('slower')
+	if result['peak_kib'] > baseline['peak_kib'] * (1 + tolerance) + 16:
+		worse.append('more memory')
+	return worse
+
+def run(sizes=default_sizes, depths=default_depths, repeats=3, save=False, use_csound=False, path=baseline_path):
+	'run every case, returns the number of cases that regressed against the baseline'
+	baselines = dict()
+	if os.path.exists(path):
+		with open(path) as f:
+			baselines = json.load(f)
+	directory = tempfile.mkdtemp(prefix='bench_')
+	if not use_csound:
+		fake_csound.install(os.path.join(directory, 'bin'))
+	results = dict()
+	regressed = 0
+	print('%-24s %5s %5s %12s %10s  %s' % ('case', 'size', 'depth', 'ops/s', 'peak KiB', 'vs baseline'))
+	# selection prints every fitness
+	devnull = open(os.devnull, 'w')
+	try:
+		with redirect_stdout(devnull):
+			context = Context(directory)
+		for name, prepare in cases:
+			for size in sizes:
+				for depth in depths:
+					with redirect_stdout(devnull):
+						ops_per_sec, peak = measure(lambda: prepare(context, size, depth), repeats)
+					key = '%s size=%d depth=%d' % (name, size, depth)
+					results[key] = dict(ops_per_sec=ops_per_sec, peak_kib=peak / 1024)
+					comparison = ''
+					if key in baselines:
+						worse = regressions(results[key], baselines[key])
+						regressed += bool(worse)
+						comparison = '%.2fx speed, %.2fx memory' % (ops_per_sec / baselines[key]['ops_per_sec'], \
+							results[key]['peak_kib'] / max(baselines[key]['peak_kib'], 1e-9))
+						comparison += ' REGRESSION: ' + ', '.join(worse) if worse else ''
+					print('%-24s %5d %5d %12.1f %10.1f  %s' % (name, size, depth, ops_per_sec, peak / 1024, comparison))
+	finally:
+		devnull.close()
+		shutil.rmtree(directory)
+	if save:
+		baselines.update(results)
+		with open(path, 'w') as f:
+			json.dump(baselines, f, indent=1, sort_keys=True)
+		print('baseline saved to', path)
+	elif regressed:
+		print(regressed, 'cases regressed')
+	return regressed
+
+# python bench.py [--quick] [--save] [--csound], the same as python -m cli bench
+if __name__ == '__main__':
+	from cli import main
+	main(['bench'] + sys.argv[1:])
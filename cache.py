@@ -0,0 +1,78 @@
+import os
+import sqlite3
+import hashlib
+import numpy as np
+from util import file_hash
+from analysis import spectrogram_from_file
+
+class FitnessCache:
+	'''
+	content addressed similarity cache stored on disk, shared across runs,
+	entries are keyed by program, duration and target and evicted least recently used first
+	'''
+	def __init__(self, path, target_id, max_entries=200000):
+		self.target_id = target_id
+		self.max_entries = max_entries
+		self.db = sqlite3.connect(path)
+		self.db.execute('CREATE TABLE IF NOT EXISTS fitness '
+			'(key TEXT PRIMARY KEY, similarity REAL, last_access INTEGER)')
+		self.db.execute('CREATE INDEX IF NOT EXISTS fitness_access ON fitness (last_access)')
+		# access counter, used for lru eviction
+		self.clock = self.db.execute('SELECT COALESCE(MAX(last_access), 0) FROM fitness').fetchone()[0]
+		self.hits = 0
+		self.misses = 0
+
+	def key(self, genome, duration):
+		ls = [genome.digest(), repr(float(duration)), self.target_id]
+		return hashlib.sha1('/'.join(ls).encode()).hexdigest()
+
+	def tick(self):
+		self.clock = self.clock + 1
+		return self.clock
+
+	def get_many(self, keys):
+		'returns a dict of the cached similarities, missing keys are omitted'
+		found = dict()
+		# stay below sqlite's max number of host parameters
+		for start in range(0, len(keys), 500):
+			chunk = keys[start:start+500]
+			rows = self.db.execute('SELECT key, similarity FROM fitness WHERE key IN (' + \
+				','.join('?' * len(chunk)) + ')', chunk).fetchall()
+			found.update(rows)
+		if found:
+			self.db.executemany('UPDATE fitness SET last_access = ? WHERE key = ?', \
+				[(self.tick(), k) for k in found])
+			self.db.commit()
+		self.hits = self.hits + len(found)
+		self.misses = self.misses + len(keys) - len(found)
+		return found
+
+	def put_many(self, items):
+		'store (key, similarity) pairs, evicting old entries if needed'
+		self.db.executemany('INSERT OR REPLACE INTO fitness VALUES (?, ?, ?)', \
+			[(k, s, self.tick()) for k, s in items])
+		count = self.db.execute('SELECT COUNT(*) FROM fitness').fetchone()[0]
+		if count > self.max_entries:
+			self.db.execute('DELETE FROM fitness WHERE key IN '
+				'(SELECT key FROM fitness ORDER BY last_access LIMIT ?)', (count - self.max_entries,))
+		self.db.commit()
+
+	def close(self):
+		self.db.close()
+
+def cached_spectrogram(filename, directory='reference_cache'):
+	'''
+	duration and spectrogram of a target sound, computed once and stored on disk
+	keyed by the file contents hash, so that a moved or renamed file is not analysed again
+	'''
+	path = os.path.join(directory, file_hash(filename) + '.npz')
+	if os.path.exists(path):
+		with np.load(path) as data:
+			return float(data['duration']), data['spectrum']
+	times, _, spectrum = spectrogram_from_file(filename)
+	if spectrum is None:
+		raise ValueError('failed to analyse target sound: ' + filename)
+	if not os.path.exists(directory):
+		os.makedirs(directory)
+	np.savez(path, duration=times[-1], spectrum=spectrum)
+	return float(times[-1]), spectrum
@@ -0,0 +1,123 @@
+import os
+import sys
+import json
+import argparse
+
+# command line entry point, experiments are described by a json config (see config.json):
+# python -m cli run config.json
+# python -m cli resume config.json
+# python -m cli render-best config.json [output directory]
+# python -m cli bench [--quick] [--save] [--csound]
+# python -m cli bench-costs [--duration seconds] [--output path]
+# modules are imported by the commands using them, so that the cli starts fast
+
+default_checkpoint = 'checkpoint.pkl'
+
+def read_config(path):
+	with open(path) as f:
+		return json.load(f)
+
+def experiment_options(config):
+	'''
+	keyword arguments of Experiment from the config "experiment" section, values are passed
+	as they are except for the options describing an object, which is built here:
+	viz (true), render_pool and coordinator (a number of workers, 0 for one per core),
+	fidelity_levels ("default" or a list of [sample_rate, ksmps, duration_fraction, promote_fraction]),
+	surrogate (true or its arguments) and sandbox (true or the Limits fields)
+	'''
+	options = dict(config.get('experiment', {}))
+	tmp_dir = config.get('tmp_dir', 'tmp')
+	if options.pop('viz', False):
+		from experiment import ExperimentViz
+		options['viz'] = ExperimentViz(tmp_dir)
+	if options.get('render_pool') is not None:
+		from render import RenderPool
+		options['render_pool'] = RenderPool(options['render_pool'] or None)
+	if options.get('coordinator') is not None:
+		from distributed import LocalCluster
+		options['coordinator'] = LocalCluster(options['coordinator'] or None)
+	if options.get('fidelity_levels'):
+		from fidelity import FidelityLevel, default_ladder
+		levels = options['fidelity_levels']
+		options['fidelity_levels'] = default_ladder if levels == 'default' else [FidelityLevel(*l) for l in levels]
+	if options.get('surrogate'):
+		from surrogate import Surrogate
+		surrogate = options['surrogate']
+		options['surrogate'] = Surrogate(**surrogate) if isinstance(surrogate, dict) else Surrogate()
+	if options.get('sandbox'):
+		from sandbox import Sandbox, Limits
+		sandbox = options['sandbox']
+		options['sandbox'] = Sandbox(Limits(**sandbox)) if isinstance(sandbox, dict) else Sandbox()
+	return options
+
+def make_experiment(config):
+	from experiment import Experiment, ExperimentParms
+	from elements import read_op_set
+	intern_op_set, term_op_set = read_op_set()
+	parms = ExperimentParms(intern_op_set=intern_op_set, term_op_set=term_op_set, **config['parms'])
+	return Experiment(parms, config.get('tmp_dir', 'tmp'), **experiment_options(config))
+
+def run(args):
+	config = read_config(args.config)
+	make_experiment(config).run(config.get('checkpoint', default_checkpoint))
+
+def resume(args):
+	config = read_config(args.config)
+	make_experiment(config).resume(config.get('checkpoint', default_checkpoint))
+
+def render_best(args):
+	'render the best program of the last checkpoint'
+	from experiment import read_checkpoint, checkpoint_individual
+	from code_gen import graph_to_csound
+	from scheduler import RenderScheduler
+	from util import render_command
+	config = read_config(args.config)
+	state = read_checkpoint(config.get('checkpoint', default_checkpoint))
+	# the population is sorted by descending fitness
+	best = checkpoint_individual(state['population'][0])
+	if not os.path.exists(args.output):
+		os.makedirs(args.output)
+	filename = os.path.join(args.output, 'best')
+	RenderScheduler().run([render_command(graph_to_csound(best.tree), state['duration'], filename)])
+	print('generation', state['generation'], 'similarity', best.similarity, 'written to', filename + '.wav')
+
+def bench(args):
+	'time the hot paths of a generation and compare them with the baseline, see bench.py'
+	import bench
+	sizes, depths = ((8,), (3,)) if args.quick else (bench.default_sizes, bench.default_depths)
+	if bench.run(sizes, depths, 3, args.save, args.csound, args.baseline):
+		sys.exit(1)
+
+def bench_costs(args):
+	'measure the cost of each opcode, see cost.py'
+	from cost import benchmark
+	benchmark(args.output, args.duration)
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(prog='python -m cli', description='evolve csound programs imitating a sound')
+	commands = parser.add_subparsers(dest='command', required=True)
+	for name, function, description in [
+		('run', run, 'run an experiment, saving a checkpoint after each generation'),
+		('resume', resume, 'continue an experiment from its checkpoint')]:
+		command = commands.add_parser(name, help=description)
+		command.add_argument('config', help='json experiment config')
+		command.set_defaults(function=function)
+	command = commands.add_parser('render-best', help='render the best program of the checkpoint')
+	command.add_argument('config', help='json experiment config')
+	command.add_argument('output', nargs='?', default='output', help='output directory')
+	command.set_defaults(function=render_best)
+	command = commands.add_parser('bench', help='time the hot paths of a generation, exits with 1 on regressions')
+	command.add_argument('--quick', action='store_true', help='a single small population size and depth')
+	command.add_argument('--save', action='store_true', help='save the results as the new baseline')
+	command.add_argument('--csound', action='store_true', help='render with csound instead of the fake renderer')
+	command.add_argument('--baseline', default='bench_baseline.json', help='baseline path')
+	command.set_defaults(function=bench)
+	command = commands.add_parser('bench-costs', help='measure opcode costs for cost budgeted generation')
+	command.add_argument('--duration', type=float, default=10., help='seconds of audio per measure')
+	command.add_argument('--output', default='opcode_costs.json', help='cost table path')
+	command.set_defaults(function=bench_costs)
+	args = parser.parse_args(argv)
+	args.function(args)
+
+if __name__ == '__main__':
+	main(sys.argv[1:])
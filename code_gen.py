@@ -1,4 +1,6 @@
 from elements import OpType
+from csound_reference import OpTag
+from tree import node_signature
 
 # simply to make sure we use unique identifiers
 class LocalRegister:
@@ -15,55 +17,79 @@ class LocalRegister:
 			self.cache[v] = 1
 			return v
 
-def gen_arg(node, statements, local_register, arg):
-	# in case of an opcode we'll have to introduce alocal var
-	# (CSound6 supports a functional syntax 
-	# but we do not restrict oursleves to this new syntax at the moment)
-	if node.value.type_ == OpType.OPCODE:
-		# a local var to be inserted in the parent expression
-		local = arg.type_ + local_register.get_name(arg.name)
-		# parse subtree, assign to local
-		i, s = node_to_code(node, local, local_register)
-		statements.extend(s)
-		statements.append(i)
-		return local
-	else:
-		i, s = node_to_code(node, False, local_register)
-		statements.extend(s)
-		return i
-
-def gen_opcode_call(node, statements, local_register):
-	'generate function call code'
-	args = ', '.join([gen_arg(node[i], statements, local_register, node.value.args[i]) \
-		for i in range(len(node))])
-	return ' '.join([node.value.value, args])
-	
-def node_to_code(node, dst, local_register):
-	'builds an expression from a graph, with standard syntax'
-	ls, statements = [], []
+# opcodes whose output is not only determined by their inputs, never merged
+unmergeable_tags = set([OpTag.RAND])
 
-	if dst:
-		ls.append(dst)
-		if node.value.type_ == OpType.OPCODE:
-			ls.append(' ')
+def subtree_ids(root):
+	'''
+	hash consing: structurally identical subtrees free of unmergeable opcodes share the same id,
+	others get None, computed in post order with an explicit stack
+	'''
+	table, ids = dict(), dict()
+	stack = [(root, False)]
+	while stack:
+		node, visited = stack.pop()
+		if node.value.type_ == OpType.CONST:
+			ids[id(node)] = node_signature(node.value)
+			continue
+		if not visited:
+			stack.append((node, True))
+			stack.extend((c, False) for c in node.children)
+			continue
+		children = tuple(ids[id(c)] for c in node.children)
+		if node.value.tag in unmergeable_tags or None in children:
+			ids[id(node)] = None
 		else:
-			ls.append(' = ')
+			ids[id(node)] = table.setdefault((node_signature(node.value), children), len(table))
+	return ids
 
+def graph_statements(node, dst):
+	'''
+	the statements computing the graph into dst, with standard syntax, an opcode call per node
+	assigned to a local var (CSound6 supports a functional syntax but we do not restrict
+	oursleves to this new syntax at the moment), identical subtrees are computed once
+	'''
 	if node.value.type_ == OpType.CONST:
-		ls.append(str(node.value.value))
-	else:
-		ls.append(gen_opcode_call(node, statements, local_register))
-
-	return ''.join(ls), statements
+		return [dst + ' = ' + str(node.value.value)]
+	ids = subtree_ids(node)
+	local_register = LocalRegister()
+	# local var holding each merged subtree
+	names = dict()
+	statements = []
+	# per opcode being generated: node, destination, next child, arguments code
+	stack = [[node, dst, 0, []]]
+	while stack:
+		frame = stack[-1]
+		current, current_dst, i, args = frame
+		if i == len(current):
+			stack.pop()
+			statements.append(current_dst + ' ' + ' '.join([current.value.value, ', '.join(args)]))
+			continue
+		frame[2] = i + 1
+		child = current[i]
+		if child.value.type_ == OpType.CONST:
+			args.append(str(child.value.value))
+			continue
+		key = ids[id(child)]
+		if key is not None and key in names:
+			args.append(names[key])
+			continue
+		# a local var to be inserted in the parent expression
+		arg = current.value.args[i]
+		local = arg.type_ + local_register.get_name(arg.name)
+		if key is not None:
+			names[key] = local
+		args.append(local)
+		stack.append([child, local, 0, []])
+	return statements
 
-def graph_to_csound(node):
-	i, s = node_to_code(node, 'aout__', LocalRegister())
-	s.append(i)
-	s.append('out aout__')
-	s.insert(0, 'instr 1')
+def graph_to_csound(node, instr_num=1, channel=None):
+	s = graph_statements(node, 'aout__')
+	s.append('out aout__' if channel is None else 'outch ' + str(channel) + ', aout__')
+	s.insert(0, 'instr ' + str(instr_num))
 	s.append('endin')
 	return '\n'.join(s)
 
-
-
-
+def graphs_to_csound(nodes):
+	'a single orchestra holding one instrument per graph, instr k writes to channel k'
+	return '\n'.join([graph_to_csound(n, k, k) for k, n in enumerate(nodes, 1)])
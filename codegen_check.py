@@ -0,0 +1,93 @@
+import sys
+import random
+from elements import read_op_set, OpType
+from tree import make_dsp_graph, clone_graph, Node
+from code_gen import graph_to_csound, subtree_ids, LocalRegister
+from genome import opcode_table
+
+# Check the code generator computing identical subtrees once against the former generator,
+# which emitted every node: on random graphs without identical subtrees both programs are
+# byte-identical, on graphs summing a random graph with a copy of itself the copy costs no
+# statement, and in any case every mergeable subtree is emitted once
+
+def baseline_arg(node, statements, local_register, arg):
+	if node.value.type_ == OpType.OPCODE:
+		local = arg.type_ + local_register.get_name(arg.name)
+		i, s = baseline_code(node, local, local_register)
+		statements.extend(s)
+		statements.append(i)
+		return local
+	i, s = baseline_code(node, False, local_register)
+	statements.extend(s)
+	return i
+
+def baseline_code(node, dst, local_register):
+	'the former recursive generator, an opcode call per node'
+	ls, statements = [], []
+	if dst:
+		ls.append(dst)
+		ls.append(' ' if node.value.type_ == OpType.OPCODE else ' = ')
+	if node.value.type_ == OpType.CONST:
+		ls.append(str(node.value.value))
+	else:
+		args = ', '.join([baseline_arg(node[i], statements, local_register, node.value.args[i]) \
+			for i in range(len(node))])
+		ls.append(' '.join([node.value.value, args]))
+	return ''.join(ls), statements
+
+def baseline_graph_to_csound(node):
+	i, s = baseline_code(node, 'aout__', LocalRegister())
+	return '\n'.join(['instr 1'] + s + [i, 'out aout__', 'endin'])
+
+def opcode_ids(tree):
+	'hash consing ids of the opcode nodes, None for unmergeable ones'
+	ids = subtree_ids(tree)
+	return [ids[id(n)] for n in tree.depth_first() if n.value.type_ == OpType.OPCODE]
+
+def expected_statements(tree):
+	'opcode calls once identical subtrees are merged: one per distinct mergeable subtree, one per other node'
+	ids = opcode_ids(tree)
+	return len(set(k for k in ids if k is not None)) + sum(1 for k in ids if k is None)
+
+def statement_count(program):
+	# instr, out and endin lines
+	return len(program.split('\n')) - 3
+
+def doubled(tree, op):
+	'sum of a graph with a copy of itself'
+	node = Node(op)
+	node.add_child(tree)
+	node.add_child(clone_graph(tree))
+	return node
+
+def check(count=3000, max_depth=5, seed=0):
+	random.seed(seed)
+	intern, term = read_op_set()
+	sum2 = next(op for op in opcode_table if op.value == 'sum' and len(op.args) == 2)
+	identical, merged, failures = 0, 0, []
+	for k in range(count):
+		tree = make_dsp_graph(intern, term, random.random(), max_depth)
+		program = graph_to_csound(tree)
+		if statement_count(program) != expected_statements(tree):
+			failures.append(('statement count', program))
+		ids = [i for i in opcode_ids(tree) if i is not None]
+		if len(ids) == len(set(ids)):
+			identical = identical + 1
+			if program != baseline_graph_to_csound(tree):
+				failures.append(('differs from the baseline', program))
+		# the copy of a graph free of random opcodes is not computed again
+		double = doubled(tree, sum2)
+		if None not in opcode_ids(tree):
+			merged = merged + 1
+			if statement_count(graph_to_csound(double)) != statement_count(program) + 1:
+				failures.append(('copy computed again', graph_to_csound(double)))
+	print('graphs:', count, 'without identical subtrees:', identical, 'doubled and merged:', merged)
+	for reason, program in failures[:5]:
+		print(reason + ':\n' + program)
+	print('failures:', len(failures))
+	return not failures
+
+# python codegen_check.py [graph count]
+if __name__ == '__main__':
+	args = sys.argv[1:]
+	sys.exit(0 if check(int(args[0]) if args else 3000) else 1)
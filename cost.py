@@ -0,0 +1,153 @@
+import os
+import sys
+import json
+import random
+import resource
+import subprocess
+import numpy as np
+from elements import OpType, value_from_spec
+from csound_reference import OpTag
+from genome import opcode_table
+from tree import node_signature
+from util import render_command, clean_dir
+
+# estimated cpu cost of programs, in cpu seconds per second of audio rendered,
+# the cost of a program is the sum of the costs of its opcodes, constants are free
+
+# rough a-rate costs used for the opcodes the benchmark did not measure
+tag_costs = {
+	OpTag.OSC: 2e-4,
+	OpTag.RAND: 1e-4,
+	OpTag.ENV: 1e-4,
+	OpTag.DELAY: 3e-4,
+	OpTag.FILTER: 3e-4,
+	OpTag.REVERB: 3e-3,
+	OpTag.MATH: 1e-4}
+name_costs = {
+	'buzz': 2e-3, 'gbuzz': 2e-3, 'vco': 1e-3, 'vco2': 5e-4,
+	'resony': 1e-3, 'nreverb': 5e-3}
+# a k-rate opcode computes one value per control block instead of ksmps samples,
+# the call itself still costs something
+k_rate_discount = 8.
+
+cost_table_path = 'opcode_costs.json'
+
+class CostModel:
+	'opcode costs by signature, measured ones from the table and default estimates for the others'
+	def __init__(self, table=None):
+		self.table = table or dict()
+		self.by_id = None
+
+	@staticmethod
+	def load(path=cost_table_path):
+		'the model of a benchmark cost table, default estimates only if it does not exist'
+		if not os.path.exists(path):
+			return CostModel()
+		with open(path) as f:
+			return CostModel(json.load(f))
+
+	def save(self, path=cost_table_path):
+		with open(path, 'w') as f:
+			json.dump(self.table, f, indent=1, sort_keys=True)
+
+	def op_cost(self, op):
+		key = node_signature(op)
+		if key in self.table:
+			return self.table[key]
+		cost = name_costs.get(op.value, tag_costs[op.tag])
+		return cost / k_rate_discount if op.return_type == 'k' else cost
+
+	def costs_by_id(self):
+		'cost of each opcode id, as an array to cost genomes at once'
+		if self.by_id is None or len(self.by_id) != len(opcode_table):
+			self.by_id = np.array([self.op_cost(op) for op in opcode_table])
+		return self.by_id
+
+	def genome_cost(self, genome, i=0):
+		'cost of a program, or of its subtree at position i'
+		codes = genome.codes[i:i + genome.sizes[i]]
+		return float(np.sum(self.costs_by_id()[codes[codes >= 0]]))
+
+	def tree_cost(self, node):
+		return sum(self.op_cost(n.value) for n in node.depth_first() if n.value.type_ == OpType.OPCODE)
+
+def benchmark_arg(arg, k):
+	'declaration (or None) and code of an argument of the benchmarked opcode'
+	if arg.type_ == 'i':
+		value = 0.5 if arg.spec is None else value_from_spec(arg.spec)
+		return None, str(value)
+	name = arg.type_ + 'arg' + str(k)
+	if arg.type_ == 'k':
+		value = 0.5 if arg.spec is None else value_from_spec(arg.spec)
+		return name + ' init ' + str(value), name
+	# audio inputs without specification are signals, others constant values
+	if arg.spec is None:
+		return name + ' oscili 0.5, 220, giSine', name
+	return name + ' = ' + str(value_from_spec(arg.spec)), name
+
+def benchmark_instr(op, copies):
+	'''
+	an instrument running copies of the opcode on the same inputs, summed to the output,
+	without copies it only computes the inputs, which we use as a baseline
+	'''
+	declarations, args = [], []
+	for k, arg in enumerate(op.args):
+		declaration, code = benchmark_arg(arg, k)
+		if declaration is not None:
+			declarations.append(declaration)
+		args.append(code)
+	calls = [op.return_type + 'out' + str(c) + ' ' + op.value + ' ' + ', '.join(args) for c in range(copies)]
+	outputs = [op.return_type + 'out' + str(c) for c in range(copies)]
+	return '\n'.join(['instr 1'] + declarations + calls + \
+		['aout__ = ' + (' + '.join(outputs) if outputs else '0'), 'out aout__ * 0.001', 'endin'])
+
+def cpu_time(command, timeout):
+	'cpu seconds used by the command, None if it fails or does not complete in time'
+	before = resource.getrusage(resource.RUSAGE_CHILDREN)
+	try:
+		code = subprocess.call(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, timeout=timeout)
+	except subprocess.TimeoutExpired:
+		return None
+	after = resource.getrusage(resource.RUSAGE_CHILDREN)
+	if code != 0:
+		return None
+	return after.ru_utime + after.ru_stime - before.ru_utime - before.ru_stime
+
+def measure(op, duration, copies, repeats, directory):
+	'cost of the opcode, the smallest of a few measures, None if csound can not run it'
+	filename = os.path.join(directory, 'bench')
+	times = []
+	for instr in (benchmark_instr(op, copies), benchmark_instr(op, 0)):
+		# the same arguments for the measure and its baseline
+		random.seed(0)
+		command = render_command(instr, duration, filename)
+		runs = [cpu_time(command, 20 * duration) for _ in range(repeats)]
+		if None in runs:
+			return None
+		times.append(min(runs))
+	return max(times[0] - times[1], 0.) / (copies * duration)
+
+def benchmark(path=cost_table_path, duration=10., copies=8, repeats=3, directory='tmp_cost'):
+	'measure the cost of every opcode variant of the reference and save the table'
+	if not os.path.exists(directory):
+		os.makedirs(directory)
+	model = CostModel()
+	failed = []
+	for op in opcode_table:
+		cost = measure(op, duration, copies, repeats, directory)
+		if cost is None:
+			failed.append(node_signature(op))
+			continue
+		model.table[node_signature(op)] = cost
+		print('%-40s %.2e' % (node_signature(op), cost))
+	clean_dir(directory)
+	os.rmdir(directory)
+	model.save(path)
+	if failed:
+		print('not measured, default estimates are used:', ', '.join(failed))
+	return model
+
+# python cost.py [duration] [output path]
+if __name__ == '__main__':
+	args = sys.argv[1:]
+	benchmark(args[1] if len(args) > 1 else cost_table_path, float(args[0]) if args else 10.)
@@ -1,10 +1,14 @@
-# note we work with mono sound
-header = '''
-sr = 44100\n
-ksmps = 32\n
-nchnls = 1\n
+# note we work with mono sound, batches of programs are rendered on one channel each
+sample_rate = 44100
+ksmps = 32
+def make_header(nchnls=1, sr=sample_rate, ksmps=ksmps):
+	return '''
+sr = ''' + str(sr) + '''\n
+ksmps = ''' + str(ksmps) + '''\n
+nchnls = ''' + str(nchnls) + '''\n
 0dbfs = 1\n
 '''
+header = make_header()
 
 # http://write.flossmanuals.net/csound/d-function-tables/
 wavetables = ['giSine', 'giSaw', 'giSquare', 'giTri', 'giImp']
@@ -0,0 +1,399 @@
+import os
+import sys
+import json
+import time
+import struct
+import socket
+import selectors
+import tempfile
+import threading
+import subprocess
+from collections import namedtuple, deque
+from multiprocessing import Process
+from csound_reference import sample_rate, ksmps
+
+# an evaluation job: the orchestra code (instrument 1) and how long it should be performed,
+# the id of the target it is compared to, and whether the worker should send back
+# its spectrogram rather than the similarity
+EvalJob = namedtuple('EvalJob', ['instr', 'duration', 'target', 'spectrogram', 'sample_rate', 'ksmps'])
+
+def make_eval_job(instr, duration, target, spectrogram=False, sample_rate=sample_rate, ksmps=ksmps):
+	return EvalJob(instr, duration, target, spectrogram, sample_rate, ksmps)
+
+# messages are framed as: json length and payload length (network order),
+# the json message, then a raw payload (spectrograms are sent as float32 bytes)
+frame_header = struct.Struct('!II')
+
+def send_message(sock, message, payload=b''):
+	data = json.dumps(message).encode('utf-8')
+	sock.sendall(frame_header.pack(len(data), len(payload)) + data + payload)
+
+def recv_exactly(sock, size):
+	chunks = []
+	while size > 0:
+		chunk = sock.recv(min(size, 1 << 20))
+		if not chunk:
+			raise ConnectionError('connection closed')
+		chunks.append(chunk)
+		size = size - len(chunk)
+	return b''.join(chunks)
+
+def recv_message(sock):
+	'blocking read of a message, returns (message, payload)'
+	json_len, payload_len = frame_header.unpack(recv_exactly(sock, frame_header.size))
+	message = json.loads(recv_exactly(sock, json_len).decode('utf-8'))
+	return message, recv_exactly(sock, payload_len)
+
+class MessageReader:
+	'accumulates bytes read from a non blocking socket and splits them into messages'
+	def __init__(self):
+		self.buffer = bytearray()
+
+	def feed(self, data):
+		self.buffer += data
+		messages = []
+		while len(self.buffer) >= frame_header.size:
+			json_len, payload_len = frame_header.unpack_from(self.buffer)
+			end = frame_header.size + json_len + payload_len
+			if len(self.buffer) < end:
+				break
+			message = json.loads(bytes(self.buffer[frame_header.size:frame_header.size + json_len]).decode('utf-8'))
+			messages.append((message, bytes(self.buffer[frame_header.size + json_len:end])))
+			del self.buffer[:end]
+		return messages
+
+def encode_array(array):
+	import numpy as np
+	array = np.ascontiguousarray(array, dtype=np.float32)
+	return list(array.shape), array.tobytes()
+
+def decode_array(shape, payload):
+	import numpy as np
+	return np.frombuffer(payload, dtype=np.float32).reshape(shape)
+
+class Renderer:
+	'''
+	renders orchestras on the worker host, through a long lived csound instance
+	if ctcsound is available, through the csound command otherwise
+	'''
+	def __init__(self, timeout=5):
+		self.timeout = timeout
+		self.instances = dict()
+		self.directory = tempfile.mkdtemp(prefix='csgs_worker_')
+		try:
+			import ctcsound
+			self.use_api = True
+		except ImportError:
+			self.use_api = False
+
+	def render(self, instr, duration, sr, ksmps):
+		'returns the rendered samples or None on failure'
+		if self.use_api:
+			from render import CsoundInstance
+			if (sr, ksmps) not in self.instances:
+				self.instances[(sr, ksmps)] = CsoundInstance(1, sr, ksmps)
+			return self.instances[(sr, ksmps)].perform(instr, duration)
+		from util import render_command
+		from analysis import read_samples
+		filename = os.path.join(self.directory, 'job')
+		try:
+			subprocess.run(render_command(instr, duration, filename, 1, sr, ksmps), \
+				stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, timeout=self.timeout)
+		except subprocess.TimeoutExpired:
+			return None
+		samples = read_samples(filename + '.wav')[1]
+		if os.path.isfile(filename + '.wav'):
+			os.remove(filename + '.wav')
+		return samples
+
+	def cleanup(self):
+		for instance in self.instances.values():
+			instance.cleanup()
+
+def run_worker(host, port, heartbeat_interval=1., name=None):
+	'''
+	worker main loop: connects to the coordinator, renders the jobs it receives one at a time
+	and replies with their similarity (or spectrogram), a thread sends heartbeats meanwhile
+	'''
+	from analysis import batch_similarity_from_buffers, spectrogram_from_samples, Reference
+	sock = socket.create_connection((host, port))
+	sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+	lock = threading.Lock()
+	stop = threading.Event()
+	def heartbeat():
+		while not stop.wait(heartbeat_interval):
+			try:
+				with lock:
+					send_message(sock, {'type': 'heartbeat'})
+			except OSError:
+				return
+	with lock:
+		send_message(sock, {'type': 'hello', 'name': name or socket.gethostname() + ':' + str(os.getpid())})
+	threading.Thread(target=heartbeat, daemon=True).start()
+	renderer = Renderer()
+	targets = dict()
+	try:
+		while True:
+			message, payload = recv_message(sock)
+			if message['type'] == 'stop':
+				break
+			if message['type'] == 'target':
+				targets[message['target']] = Reference(decode_array(message['shape'], payload))
+				continue
+			job = EvalJob(*message['job'])
+			samples = renderer.render(job.instr, job.duration, job.sample_rate, job.ksmps)
+			reply, payload = {'type': 'result', 'id': message['id']}, b''
+			if job.spectrogram:
+				spectrogram = spectrogram_from_samples(samples, job.sample_rate)[2]
+				if spectrogram is None:
+					reply['failed'] = True
+				else:
+					reply['shape'], payload = encode_array(spectrogram)
+			else:
+				reply['similarity'] = float(batch_similarity_from_buffers([samples], job.sample_rate, \
+					targets[job.target])[0])
+			with lock:
+				send_message(sock, reply, payload)
+	except ConnectionError:
+		pass
+	finally:
+		stop.set()
+		renderer.cleanup()
+		sock.close()
+
+class RemoteWorker:
+	'coordinator side state of a connected worker'
+	def __init__(self, sock, address):
+		self.sock = sock
+		self.address = address
+		self.name = str(address)
+		self.reader = MessageReader()
+		self.last_seen = time.monotonic()
+		# (job id, start time) of the job being rendered, or None when idle
+		self.job = None
+		self.completed = 0
+		self.busy_time = 0.
+		self.connected_at = time.monotonic()
+
+class Coordinator:
+	'''
+	dispatches evaluation jobs to workers connected over tcp, one job per worker at a time,
+	jobs of workers that stop sending heartbeats or exceed the job timeout are dispatched again,
+	an evaluation fails once no worker has been connected for worker_timeout seconds
+	'''
+	def __init__(self, host='0.0.0.0', port=0, heartbeat_timeout=10, job_timeout=60, max_attempts=3, \
+		worker_timeout=60):
+		self.server = socket.create_server((host, port))
+		self.server.setblocking(False)
+		self.address = self.server.getsockname()
+		self.heartbeat_timeout = heartbeat_timeout
+		self.job_timeout = job_timeout
+		self.max_attempts = max_attempts
+		self.worker_timeout = worker_timeout
+		self.selector = selectors.DefaultSelector()
+		self.selector.register(self.server, selectors.EVENT_READ)
+		self.workers = dict()
+		# targets are sent once to every worker, including those connecting later
+		self.targets = dict()
+		self.queue = deque()
+		self.jobs = dict()
+		self.attempts = dict()
+		self.next_job_id = 0
+		self.redispatched = 0
+		self.done = []
+
+	def set_target(self, target, spectrum):
+		'register the spectrogram jobs of this target id are compared to'
+		self.targets[target] = encode_array(spectrum)
+		for w in list(self.workers.values()):
+			self.send_target(w, target)
+
+	def send_target(self, worker, target):
+		shape, payload = self.targets[target]
+		self.send(worker, {'type': 'target', 'target': target, 'shape': shape}, payload)
+
+	def send(self, worker, message, payload=b''):
+		# a stalled worker stops reading, do not block on it longer than a heartbeat
+		try:
+			worker.sock.settimeout(self.heartbeat_timeout)
+			send_message(worker.sock, message, payload)
+			worker.sock.setblocking(False)
+		except OSError:
+			self.drop(worker, 'connection lost')
+
+	@property
+	def num_workers(self):
+		return len(self.workers)
+
+	def wait_for_workers(self, count, timeout=None):
+		'block until count workers are connected'
+		deadline = None if timeout is None else time.monotonic() + timeout
+		while len(self.workers) < count:
+			if deadline is not None and time.monotonic() > deadline:
+				raise TimeoutError('only ' + str(len(self.workers)) + ' workers connected')
+			self.poll(0.1)
+
+	def submit(self, job):
+		job_id = self.next_job_id
+		self.next_job_id = self.next_job_id + 1
+		self.jobs[job_id] = job
+		self.attempts[job_id] = 0
+		self.queue.append(job_id)
+		self.dispatch()
+		return job_id
+
+	def dispatch(self):
+		for w in list(self.workers.values()):
+			if not self.queue:
+				return
+			if w.job is None and w.sock in self.workers:
+				job_id = self.queue.popleft()
+				self.attempts[job_id] = self.attempts[job_id] + 1
+				w.job = (job_id, time.monotonic())
+				self.send(w, {'type': 'job', 'id': job_id, 'job': list(self.jobs[job_id])})
+
+	def accept(self):
+		sock, address = self.server.accept()
+		sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+		sock.setblocking(False)
+		worker = RemoteWorker(sock, address)
+		self.workers[sock] = worker
+		self.selector.register(sock, selectors.EVENT_READ)
+		for target in self.targets:
+			self.send_target(worker, target)
+
+	def drop(self, worker, reason):
+		'disconnect a worker, its job goes back to the queue unless it failed too many times'
+		if worker.sock not in self.workers:
+			return
+		print('dropped render worker', worker.name + ':', reason)
+		del self.workers[worker.sock]
+		self.selector.unregister(worker.sock)
+		worker.sock.close()
+		if worker.job is not None:
+			job_id = worker.job[0]
+			worker.job = None
+			if self.attempts[job_id] < self.max_attempts:
+				self.redispatched = self.redispatched + 1
+				self.queue.appendleft(job_id)
+			else:
+				self.finish(job_id, None)
+
+	def finish(self, job_id, result):
+		del self.jobs[job_id]
+		del self.attempts[job_id]
+		self.done.append((job_id, result))
+
+	def receive(self, worker):
+		try:
+			data = worker.sock.recv(1 << 20)
+		except (BlockingIOError, InterruptedError):
+			return
+		except OSError:
+			data = b''
+		if not data:
+			self.drop(worker, 'connection closed')
+			return
+		worker.last_seen = time.monotonic()
+		for message, payload in worker.reader.feed(data):
+			if message['type'] == 'hello':
+				worker.name = message['name']
+			elif message['type'] == 'result':
+				if worker.job is None or worker.job[0] != message['id']:
+					continue
+				worker.busy_time = worker.busy_time + time.monotonic() - worker.job[1]
+				worker.completed = worker.completed + 1
+				worker.job = None
+				if message.get('failed'):
+					result = None
+				elif 'shape' in message:
+					result = decode_array(message['shape'], payload)
+				else:
+					result = message['similarity']
+				self.finish(message['id'], result)
+
+	def poll(self, timeout=None):
+		'''
+		process network events for at most timeout seconds, returns a list of
+		(job id, result), the similarity or the spectrogram as requested, None on failure
+		'''
+		wait_time = self.heartbeat_timeout if timeout is None else timeout
+		for key, _ in self.selector.select(wait_time):
+			if key.fileobj is self.server:
+				self.accept()
+			elif key.fileobj in self.workers:
+				self.receive(self.workers[key.fileobj])
+		now = time.monotonic()
+		for w in list(self.workers.values()):
+			if now - w.last_seen > self.heartbeat_timeout:
+				self.drop(w, 'no heartbeat')
+			elif w.job is not None and now - w.job[1] > self.job_timeout:
+				self.drop(w, 'job timeout')
+		self.dispatch()
+		done, self.done = self.done, []
+		return done
+
+	def evaluate(self, jobs):
+		'evaluate jobs, returns their results (None on failure) in the same order'
+		ids = [self.submit(j) for j in jobs]
+		results = dict()
+		# jobs do not progress without workers, give the dropped ones some time to connect again
+		idle_since = None
+		while len(results) < len(ids):
+			results.update(self.poll(min(self.heartbeat_timeout, self.worker_timeout)))
+			if self.workers or len(results) == len(ids):
+				idle_since = None
+			elif idle_since is None:
+				idle_since = time.monotonic()
+			elif time.monotonic() - idle_since > self.worker_timeout:
+				pending = set(ids) - set(results)
+				self.queue = deque(j for j in self.queue if j not in pending)
+				for j in pending:
+					del self.jobs[j]
+					del self.attempts[j]
+				raise TimeoutError('no render worker connected, ' + str(len(pending)) + ' jobs left')
+		return [results[i] for i in ids]
+
+	def stats(self):
+		'per worker: jobs completed, jobs per second since connection, fraction of time busy'
+		now = time.monotonic()
+		return dict((w.name, {
+			'completed': w.completed,
+			'throughput': w.completed / max(now - w.connected_at, 1e-9),
+			'utilization': w.busy_time / max(now - w.connected_at, 1e-9)}) \
+			for w in self.workers.values())
+
+	def close(self):
+		for w in list(self.workers.values()):
+			self.send(w, {'type': 'stop'})
+			w.sock.close()
+		self.workers = dict()
+		self.selector.close()
+		self.server.close()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *args):
+		self.close()
+
+class LocalCluster(Coordinator):
+	'a coordinator and num_workers worker processes on this host, for testing or a single machine'
+	def __init__(self, num_workers=None, **kwargs):
+		Coordinator.__init__(self, '127.0.0.1', 0, **kwargs)
+		self.processes = [Process(target=run_worker, args=self.address, daemon=True) \
+			for i in range(num_workers or os.cpu_count())]
+		for p in self.processes:
+			p.start()
+		self.wait_for_workers(len(self.processes))
+
+	def close(self):
+		Coordinator.close(self)
+		for p in self.processes:
+			p.join(1)
+			if p.is_alive():
+				p.kill()
+
+# run a worker on a render host: python distributed.py <coordinator host> <port>
+if __name__ == '__main__':
+	run_worker(sys.argv[1], int(sys.argv[2]))
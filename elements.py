@@ -1,7 +1,10 @@
 from collections import namedtuple
 from random import choice, choices, random, normalvariate
-from itertools import product, chain
+from itertools import product, chain, accumulate
+from functools import lru_cache
+from bisect import bisect_right
 from math import exp, pow, log
+import numpy as np
 from util import lerp, clip
 from csound_reference import opcodes, wavetables, OpTag
 
@@ -44,50 +47,173 @@ def distribution(x):
 	c = 0.5 # curve steepness
 	return exp(-pow(log(x) - log(b), 2) * c)
 
+def make_freq_table(size=4096):
+	'''
+	tabulated inverse cdf of the frequency distribution, our former rejection sampling
+	gave up after 64 attempts returning the last rejected sample, the table accounts for it
+	'''
+	grid = [i / size for i in range(size + 1)]
+	pdf = [distribution((i + .5) / size) for i in range(size)]
+	# probability of one rejection sampling attempt to be accepted
+	area = sum(pdf) / size
+	fallback = pow(1 - area, 64)
+	mixture = [(1 - fallback) * p / area + fallback * (1 - p) / (1 - area) for p in pdf]
+	cdf = [0.] + list(accumulate(mixture))
+	return grid, [c / cdf[-1] for c in cdf]
+
+freq_grid, freq_cdf = make_freq_table()
+# np.interp would convert the lists on every call
+freq_grid_array, freq_cdf_array = np.array(freq_grid), np.array(freq_cdf)
+
+def freq_from_uniform(u):
+	'frequency from a uniform sample, through the inverse cdf'
+	i = min(bisect_right(freq_cdf, u), len(freq_cdf) - 1)
+	t = (u - freq_cdf[i - 1]) / max(freq_cdf[i] - freq_cdf[i - 1], 1e-12)
+	return lerp(1, 6000, lerp(freq_grid[i - 1], freq_grid[i], t))
+
 def random_freq():
-	x, i = 0, 0
-	# rejection sampling, with a watchdog
-	while i < 64:
-		# sample a random point
-		x, y = random(), random()
-		# if that point is below the distribution curve, the sample is accepted
-		if (y < distribution(x)):
-			break
-		i = i + 1
-	return lerp(1, 6000, x)
+	return freq_from_uniform(random())
 
-def value_from_spec(arg_spec):
-	'return a generator based on variable specification'
+@lru_cache(maxsize=None)
+def parse_spec(arg_spec):
+	'parse a variable specification once, returns its kind and parameters'
+	if arg_spec is None:
+		return ('uniform',)
 	# interval / range
 	if arg_spec[0] == '[':
 		v = arg_spec[1:-1].split(',')
-		return lerp(float(v[0]), float(v[1]), random())
-	# set
+		return ('range', float(v[0]), float(v[1]))
+	# set, note: we assume sets are composed of ints
 	elif arg_spec[0] == '(':
-		v = arg_spec[1:-1].split(',')
-		# note: we assume sets are composed of ints
-		return int(choice(v))
+		return ('set', tuple(int(x) for x in arg_spec[1:-1].split(',')))
 	# time
 	elif arg_spec[0] == 't':
-		return random_time()
-	# frequency
+		return ('time',)
+	# frequency, with an optional modifier
 	elif arg_spec[0] == 'f':
-		# is there a modifier?
-		if len(arg_spec) > 1:
-			if arg_spec[1] == 'd': # difference
-				return abs(random_freq() - random_freq())
-			elif arg_spec[1] == 'r': # reciprocal
-				return 1. / random_freq()
-			else:
-				# in case we missed something
-				print('Unexpected freq modifier: ' + arg[1])
-				return 0
-		return random_freq()
+		if len(arg_spec) > 1 and arg_spec[1] not in 'dr':
+			# in case we missed something
+			print('Unexpected freq modifier: ' + arg_spec[1])
+			return ('zero',)
+		return ('freq', arg_spec[1:])
 	# wavetable
 	elif arg_spec[0] == 'w':
+		return ('wave',)
+	return ('uniform',)
+
+def value_from_spec(arg_spec):
+	'return a generator based on variable specification'
+	spec = parse_spec(arg_spec)
+	kind = spec[0]
+	if kind == 'range':
+		return lerp(spec[1], spec[2], random())
+	elif kind == 'set':
+		return choice(spec[1])
+	elif kind == 'time':
+		return random_time()
+	elif kind == 'freq':
+		if spec[1] == 'd': # difference
+			return abs(random_freq() - random_freq())
+		elif spec[1] == 'r': # reciprocal
+			return 1. / random_freq()
+		return random_freq()
+	elif kind == 'wave':
 		return choice(wavetables)
+	elif kind == 'zero':
+		return 0
 	return random()
 
+def sample_spec(arg_spec, rng, n):
+	'''
+	n values following a specification drawn from a numpy generator,
+	as floats: set values as their float value and wavetables as their index
+	'''
+	spec = parse_spec(arg_spec)
+	kind = spec[0]
+	if kind == 'range':
+		return spec[1] + (spec[2] - spec[1]) * rng.random(n)
+	elif kind == 'set':
+		return rng.choice(np.array(spec[1], dtype=float), n)
+	elif kind == 'time':
+		return 0.01 + (2 - 0.01) * rng.random(n)
+	elif kind == 'freq':
+		f = 1 + (6000 - 1) * np.interp(rng.random(n), freq_cdf_array, freq_grid_array)
+		if spec[1] == 'd':
+			return np.abs(f - (1 + (6000 - 1) * np.interp(rng.random(n), freq_cdf_array, freq_grid_array)))
+		elif spec[1] == 'r':
+			return 1. / f
+		return f
+	elif kind == 'wave':
+		return rng.integers(len(wavetables), size=n).astype(float)
+	elif kind == 'zero':
+		return np.zeros(n)
+	return rng.random(n)
+
+def is_float_spec(arg_spec):
+	'whether values of this specification are continuous, as opposed to picked from a set'
+	return parse_spec(arg_spec)[0] in ('range', 'time', 'freq', 'uniform')
+
+class CompiledSpecs:
+	'''
+	sampling parameters of a list of specifications as arrays indexed by position in the list,
+	so that values of many constants with different specifications are drawn in one vectorized
+	pass, with the distributions of sample_spec
+	'''
+	def __init__(self, specs):
+		n = len(specs)
+		# range, time and uniform values are scaled uniform samples, zero is the [0, 0] range
+		self.low = np.zeros(n)
+		self.high = np.ones(n)
+		self.freq = np.zeros(n, dtype=bool)
+		self.freq_diff = np.zeros(n, dtype=bool)
+		self.freq_inv = np.zeros(n, dtype=bool)
+		# sets and wavetables pick from a slice of set_values
+		self.set_offset = np.zeros(n, dtype=np.int64)
+		self.set_size = np.zeros(n, dtype=np.int64)
+		set_values = []
+		self.continuous = np.array([is_float_spec(s) for s in specs], dtype=bool)
+		for k, s in enumerate(specs):
+			spec = parse_spec(s)
+			kind = spec[0]
+			if kind == 'range':
+				self.low[k], self.high[k] = spec[1], spec[2]
+			elif kind == 'time':
+				self.low[k], self.high[k] = 0.01, 2
+			elif kind == 'zero':
+				self.high[k] = 0
+			elif kind == 'freq':
+				self.freq[k] = True
+				self.freq_diff[k] = spec[1] == 'd'
+				self.freq_inv[k] = spec[1] == 'r'
+			elif kind in ('set', 'wave'):
+				values = spec[1] if kind == 'set' else range(len(wavetables))
+				self.set_offset[k], self.set_size[k] = len(set_values), len(values)
+				set_values += values
+		self.set_values = np.array(set_values, dtype=float)
+
+	def __len__(self):
+		return len(self.low)
+
+	def sample(self, indices, rng):
+		'a value for each specification index'
+		u = rng.random(len(indices))
+		values = self.low[indices] + (self.high[indices] - self.low[indices]) * u
+		freq = self.freq[indices]
+		if freq.any():
+			f = 1 + (6000 - 1) * np.interp(u[freq], freq_cdf_array, freq_grid_array)
+			diff = self.freq_diff[indices][freq]
+			if diff.any():
+				other = np.interp(rng.random(np.count_nonzero(diff)), freq_cdf_array, freq_grid_array)
+				f[diff] = np.abs(f[diff] - (1 + (6000 - 1) * other))
+			inv = self.freq_inv[indices][freq]
+			f[inv] = 1. / f[inv]
+			values[freq] = f
+		sizes = self.set_size[indices]
+		picked = sizes > 0
+		if picked.any():
+			values[picked] = self.set_values[self.set_offset[indices][picked] + (u[picked] * sizes[picked]).astype(np.int64)]
+		return values
+
 def const_from_arg(arg):
 	if arg.spec is None:
 		return make_const(random(), None)
@@ -152,8 +278,52 @@ def parse_tagged_opcodes(data):
 					v[cat][op.return_type][current_tag].append(op)
 	return v[0], v[1]
 
+class CompiledOpSet:
+	'''
+	the op set with precomputed sampling tables: for terminal or internal opcodes,
+	each return type and parent tag, the matching opcodes and their cumulative selection weights,
+	unpacks as the (internal, terminal) op set dicts, programs generated from it stay within max_cost
+	as estimated by the costs model when it is given
+	'''
+	def __init__(self, intern, term, weight_matrix, costs=None, max_cost=None):
+		self.intern = intern
+		self.term = term
+		self.costs = costs
+		self.max_cost = max_cost
+		self.tables = dict()
+		for terminal, tagged_opcodes in ((False, intern), (True, term)):
+			for return_type, ops_by_tag in tagged_opcodes.items():
+				for parent_tag, weights in enumerate(weight_matrix):
+					self.tables[(terminal, return_type, parent_tag)] = make_table(ops_by_tag, weights)
+
+	def __iter__(self):
+		return iter((self.intern, self.term))
+
+	def pick(self, terminal, return_type, parent_tag, u):
+		'pick an opcode from a uniform sample in [0, 1)'
+		ops, cumulative = self.tables[(terminal, return_type, parent_tag)]
+		return ops[min(bisect_right(cumulative, u * cumulative[-1]), len(ops) - 1)]
+
+	def random_genomes(self, count, terminal_likelyhood, max_depth, rng=None):
+		'generate many random programs from a single numpy generator'
+		from genome import random_genomes
+		return random_genomes(self, count, terminal_likelyhood, max_depth, rng)
+
+def make_table(ops_by_tag, weights):
+	'opcodes and cumulative weights, a tag is picked by weight THEN an opcode uniformly'
+	tags = [t for t in ops_by_tag if len(ops_by_tag[t]) > 0]
+	# unlike random.choices, do not fail when all the allowed tags have a zero weight
+	tag_weights = [weights[t] for t in tags] if sum(weights[t] for t in tags) > 0 else [1] * len(tags)
+	ops, op_weights = [], []
+	for tag, w in zip(tags, tag_weights):
+		ops += ops_by_tag[tag]
+		op_weights += [w / len(ops_by_tag[tag])] * len(ops_by_tag[tag])
+	return ops, list(accumulate(op_weights))
+
 def read_op_set():
-	return parse_tagged_opcodes(opcodes)
+	# imported here as the tree module depends on this one
+	from tree import opcode_selection_weight_matrix
+	return CompiledOpSet(*parse_tagged_opcodes(opcodes), opcode_selection_weight_matrix)
 
 # TODO probabilities could be learned from existing CSound programs
 # by picking a tag THEN an opcode we prevent opcodes with similar role
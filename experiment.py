@@ -1,95 +1,457 @@
 import os
-import shutil
-from subprocess import TimeoutExpired
-import matplotlib.pyplot as plt
+import heapq
+import pickle
+import random
+from math import ceil
+import queue
+from multiprocessing import Process, Queue
 import numpy as np
-import imageio
-
-from code_gen import graph_to_csound 
-from tree import make_dsp_graph, clone_graph
-from elements import read_op_set, make_arg
-from genetic_operators import mutate_consts, subtree_mutation
-from analysis import spectrogram_from_file, sound_similarity
-from util import lerp, render_audio, clean_dir, wait_for_processes_completion
+
+from code_gen import graph_to_csound, graphs_to_csound
+from tree import opcode_selection_weight_matrix
+from elements import CompiledOpSet
+from genetic_operators import mutate_consts_genome, subtree_mutation_genome
+from genome import Genome
+from analysis import spectrogram_from_file, read_samples, batch_similarity_from_buffers, Reference, \
+	References, multi_similarity_from_buffers, pruned_similarity_from_buffers, stream_reference, streaming_similarity
+from util import lerp, render_command, clean_dir, file_hash
 from vizualisation import plot_tree
+from render import RenderPool, make_job, render_in_batches
+from scheduler import RenderScheduler
+from distributed import make_eval_job
+from interpreter import interpret, supports
+from simplify import simplify
+from cost import CostModel
+from sandbox import Outcome, classify
+from pipeline import AnalysisPool
+from cache import FitnessCache, cached_spectrogram
+from csound_reference import sample_rate, ksmps
+from fidelity import level_reference, promoted
 
 class Individual:
-	def __init__(self, tree):
-		self.tree = tree
-		self.total_nodes = tree.total_nodes_count()
+	def __init__(self, genome):
+		# programs are stored as arrays, the linked tree is only built when needed
+		self.genome = genome if isinstance(genome, Genome) else Genome.from_tree(genome)
+		self._tree = None
+		self.total_nodes = len(self.genome)
 		self.filename = None
 		self.similarity = -1
 		self.fitness = -1
+		# index of the fidelity level the similarity was computed at
+		self.fidelity = 0
+		# for the surrogate model: fitness of the parent (-1 if none), features, prediction
+		self.parent_fitness = -1
+		self.features = None
+		self.predicted = None
+		self.learned = False
+		# estimated cpu cost of the program, set by the selection when a cost model is used
+		self.cost = None
+		# similarity with each target of a multi target experiment
+		self.similarities = None
+
+	@property
+	def tree(self):
+		if self._tree is None:
+			self._tree = self.genome.to_tree()
+		return self._tree
 
-def initialize(count, terminal_likelyhood, max_depth, intern_op_set, term_op_set):
+def initialize(count, terminal_likelyhood, max_depth, op_set, rng=None):
 	'generate an initial population of individuals with random programs'
-	return [Individual(make_dsp_graph(intern_op_set, term_op_set, \
-		terminal_likelyhood, max_depth)) \
-		for i in range(count)]
+	return [Individual(g) for g in op_set.random_genomes(count, terminal_likelyhood, max_depth, rng)]
 
-def generate_offsprings(population, lerp_factor, intern_op_set, \
-	term_op_set, terminal_likelyhood, max_depth):
-	'generate offsprings based on the current generation individuals'
+def offspring(genome, parent):
+	child = Individual(genome)
+	child.parent_fitness = parent.fitness
+	return child
+
+def generate_offsprings(population, lerp_factor, op_set, terminal_likelyhood, max_depth, rng=None, \
+	surrogate=None, oversample=1, keep_fraction=1., sandbox=None):
+	'''
+	generate offsprings based on the current generation individuals, with a trained surrogate
+	oversample times more candidates are generated and only the keep_fraction of the usual count
+	with the best predicted similarity is kept, candidates holding a subtree the sandbox
+	quarantined are dropped
+	'''
 	# note we recycle the current generation as is:
 	# you want good solutions to be allowed survival
 	offsprings = population[:]
-	# part of the offsprings are generated through constants mutation
-	offsprings += [Individual(mutate_consts(i.tree, lerp_factor)) for i in population]
-	# part of the offsprings are generated through subtree mutation
-	for i in population:
-		child, success = subtree_mutation(i.tree, intern_op_set, term_op_set, terminal_likelyhood, max_depth) 
-		if success:
-			offsprings.append(Individual(child))
-	# the number of offsprings generated through each method is arbitrary
-	offsprings += initialize(len(population), terminal_likelyhood, max_depth, intern_op_set, term_op_set)
-	return offsprings
-
-def render_individuals(population, duration, directory):
+	rounds = oversample if surrogate is not None and surrogate.trained else 1
+	candidates = []
+	for r in range(rounds):
+		# part of the offsprings are generated through constants mutation
+		candidates += [offspring(mutate_consts_genome(i.genome, lerp_factor, rng), i) for i in population]
+		# part of the offsprings are generated through subtree mutation
+		for i in population:
+			child, success = subtree_mutation_genome(i.genome, op_set, terminal_likelyhood, max_depth, rng)
+			if success:
+				candidates.append(offspring(child, i))
+		# the number of offsprings generated through each method is arbitrary
+		candidates += initialize(len(population), terminal_likelyhood, max_depth, op_set, rng)
+	if sandbox is not None:
+		candidates = [i for i in candidates if not sandbox.quarantined(i.genome)]
+	if rounds > 1:
+		candidates = surrogate.prescreen(candidates, int(ceil(len(candidates) / rounds * keep_fraction)))
+	return offsprings + candidates
+
+def render_individuals(population, duration, directory, pool=None, scheduler=None):
 	# assign filenames
 	count = 0
 	for i in population:
 		i.filename = os.path.join(directory, 'tmp_' + str(count).zfill(5))
 		count = count + 1
-	# launch audio rendering processes using csound, asynchronously
-	processes = [render_audio(graph_to_csound(i.tree), duration, i.filename, False) for i in population]
+	# long lived csound instances, the pool takes care of non responsive workers
+	if pool is not None:
+		return pool.render([make_job(graph_to_csound(i.tree), duration, i.filename) for i in population])
+	# launch audio rendering processes using csound, with a bounded concurrency,
 	# csound may hang randomly, looks like memory allocation issues, not sure yet
 	# happens once in a while but that's enough to compromise an experiment,
-	# so we watch processes and kill those who don't respond (ok that sounds bad)
-	for p in processes:
-		try:
-			outs, errs = p.communicate(timeout=5)
-		except TimeoutExpired:
-			p.kill()
-			outs, errs = p.communicate()
-			print('killed non responsive process: ', outs, errs)
-	return processes
-
-def evaluate_similarity(population, duration, ref_spectrum, directory):
-	# render individuals that need it (no need to render those who are exact copies of their parent)
-	new_individuals = [x for x in population if x.similarity < 0]
-	processes = render_individuals(new_individuals, duration, directory)
-	wait_for_processes_completion(processes)
-	# evaluate per individual similarity with the target sound
-	for i in new_individuals:
-		if os.path.isfile(i.filename + '.wav'):
-			spectr = spectrogram_from_file(i.filename + '.wav')[2]
-			i.similarity = sound_similarity(spectr, ref_spectrum) if spectr is not None else 0
-	
-def selection(population, num_selected, ref_spectrum, duration, complexity_factor, directory):
-	'select the population best candidates based on our fitness function'
-	evaluate_similarity(population, duration, ref_spectrum, directory)
+	# so the scheduler kills processes who don't respond (ok that sounds bad)
+	scheduler = scheduler or RenderScheduler()
+	return scheduler.run([render_command(graph_to_csound(i.tree), duration, i.filename) for i in population])
+
+class Evaluator:
+	'renders individuals and scores their similarity with the target sound'
+	def __init__(self, reference, duration, directory, pool=None, scheduler=None, cache=None, batch_size=1, \
+		early_abort=None, fidelity_levels=(), level_references=(), coordinator=None, interpreter=False, \
+		simplify=False, sandbox=None, analysis=None, pruning=None, streaming=False):
+		self.reference = reference
+		self.duration = duration
+		self.directory = directory
+		self.pool = pool
+		self.scheduler = scheduler or RenderScheduler()
+		self.cache = cache
+		# number of programs rendered by a single csound orchestra
+		self.batch_size = batch_size
+		# number of individuals that need an exact score, others may be abandoned while rendering
+		self.early_abort = early_abort
+		# individuals whose similarity is only an upper bound, as their rendering was abandoned
+		self.abandoned = set()
+		# screening levels and the matching target spectrograms
+		self.fidelity_levels = fidelity_levels
+		self.level_references = level_references
+		# renders and scores on remote workers, targets are registered once per level
+		self.coordinator = coordinator
+		# graphs the numpy interpreter supports are not sent to csound
+		self.interpreter = interpreter
+		self.interpreted = 0
+		# programs are simplified before code generation, silent ones are not rendered
+		self.simplify = simplify
+		self.programs = dict()
+		self.silent = 0
+		# csound processes run under resource limits, their failures are classified
+		self.sandbox = sandbox
+		# processes scoring rendered files while other renders run
+		self.analysis = analysis
+		# number of individuals that need an exact score, others may be pruned by coarse spectral bounds
+		self.pruning = pruning
+		# rendered files are scored block by block instead of being loaded whole
+		self.streaming = streaming
+		if coordinator is not None:
+			coordinator.set_target('full', reference.spectrum)
+			for index, r in enumerate(level_references):
+				coordinator.set_target('level_' + str(index), r.spectrum)
+		if early_abort is not None:
+			if pool is None:
+				raise ValueError('early abort evaluation requires a render pool')
+			pool.set_reference(reference.spectrum)
+
+	def evaluate(self, population):
+		# render individuals that need it (no need to render those who are exact copies of their parent)
+		new_individuals = [x for x in population if x.similarity < 0]
+		# survivors only scored at a screening level are not comparable with full quality scores
+		scored = [x.similarity for x in population if x.similarity >= 0 and x.fidelity == len(self.fidelity_levels)]
+		self.abandoned = set()
+		if self.cache is None:
+			self.score(new_individuals, scored)
+			return
+		# nor those whose program has already been scored, in this run or a previous one
+		keys = dict((id(i), self.cache.key(i.genome, self.duration)) for i in new_individuals)
+		cached = self.cache.get_many(list(set(keys.values())))
+		# identical programs within the population are only rendered once too
+		unique = dict()
+		for i in new_individuals:
+			if keys[id(i)] in cached:
+				i.similarity = cached[keys[id(i)]]
+				i.fidelity = len(self.fidelity_levels)
+			else:
+				unique.setdefault(keys[id(i)], i)
+		self.score(list(unique.values()), scored + list(cached.values()))
+		for i in new_individuals:
+			if i.similarity < 0:
+				i.similarity = unique[keys[id(i)]].similarity
+				i.fidelity = unique[keys[id(i)]].fidelity
+				# a copy of an upper bound is no exact score either
+				if id(unique[keys[id(i)]]) in self.abandoned:
+					self.abandoned.add(id(i))
+		# screening scores and partial scores are not worth caching
+		self.cache.put_many([(k, i.similarity) for k, i in unique.items() if i.similarity >= 0 \
+			and i.fidelity == len(self.fidelity_levels) and id(i) not in self.abandoned])
+
+	def score(self, individuals, scored=()):
+		'render individuals and evaluate their similarity with the target sound, in one vectorized pass'
+		if self.simplify:
+			individuals, scored = self.score_silent(individuals, scored)
+		# cheap screening levels first, only the best make it to full quality rendering,
+		# an individual whose render fails at a level is left unscored instead of keeping
+		# the score of the previous level, and does not move up
+		for index, level in enumerate(self.fidelity_levels):
+			self.score_unscored(individuals, level, self.level_references[index])
+			individuals = [i for i in individuals if i.similarity >= 0]
+			for i in individuals:
+				i.fidelity = index
+			individuals = promoted(individuals, level)
+		self.score_unscored(individuals, None, self.reference, scored)
+		for i in individuals:
+			if i.similarity >= 0:
+				i.fidelity = len(self.fidelity_levels)
+
+	def score_unscored(self, individuals, level, reference, scored=()):
+		'score individuals at a level, those whose render fails get a similarity of -1'
+		for i in individuals:
+			i.similarity = -1
+		if level is None and self.early_abort is not None:
+			if self.interpreter:
+				left = self.score_interpreted(individuals, (self.duration, sample_rate, ksmps), self.reference)
+				left = set(id(i) for i in left)
+				scored = list(scored) + [i.similarity for i in individuals if id(i) not in left]
+				individuals = [i for i in individuals if id(i) in left]
+			self.score_streaming(individuals, scored)
+			return
+		self.score_level(individuals, level, reference, scored)
+
+	def score_level(self, individuals, level, reference, scored=()):
+		'render individuals with the level settings, or at full quality if level is None'
+		if level is None:
+			settings = (self.duration, sample_rate, ksmps)
+		else:
+			settings = (self.duration * level.duration_fraction, level.sample_rate, level.ksmps)
+		if self.interpreter:
+			individuals = self.score_interpreted(individuals, settings, reference)
+		# remote workers and analysis processes know the references by name
+		target = 'full' if level is None else 'level_' + str(self.fidelity_levels.index(level))
+		if self.coordinator is not None:
+			similarities = self.coordinator.evaluate([make_eval_job(graph_to_csound(self.program(i)), settings[0], target, \
+				sample_rate=settings[1], ksmps=settings[2]) for i in individuals])
+			for i, similarity in zip(individuals, similarities):
+				i.similarity = similarity if similarity is not None else 0
+			return
+		if self.analysis is not None and self.batch_size == 1 and self.pool is None:
+			self.score_pipelined(individuals, self.render_commands(individuals, settings), settings, target)
+			return
+		if self.streaming and self.batch_size == 1 and self.pool is None:
+			for i in self.render_files(individuals, settings):
+				i.similarity = streaming_similarity(i.filename + '.wav', reference)
+			return
+		individuals, buffers = self.render(individuals, settings)
+		if level is None and self.pruning is not None:
+			similarities, exact = pruned_similarity_from_buffers(buffers, settings[1], reference, \
+				self.pruning, scored)
+			# like abandoned renders, pruned individuals only get an upper bound of their similarity
+			self.abandoned.update(id(i) for i, e in zip(individuals, exact) if not e)
+		else:
+			similarities = batch_similarity_from_buffers(buffers, settings[1], reference)
+		for i, similarity in zip(individuals, similarities):
+			i.similarity = similarity
+
+	def render(self, individuals, settings):
+		'the individuals rendered successfully and their samples'
+		if self.batch_size > 1:
+			return individuals, render_in_batches(individuals, self.batch_size, \
+				lambda batches: self.render_batches(batches, *settings))
+		if self.pool is not None:
+			# disk free: spectrograms are computed from the rendered buffers
+			return individuals, self.pool.render([make_job(graph_to_csound(self.program(i)), settings[0], \
+				sample_rate=settings[1], ksmps=settings[2]) for i in individuals])
+		individuals = self.render_files(individuals, settings)
+		return individuals, [read_samples(i.filename + '.wav')[1] for i in individuals]
+
+	def render_files(self, individuals, settings):
+		'render each individual to its own file, returns those rendered successfully'
+		commands = self.render_commands(individuals, settings)
+		if self.sandbox is not None:
+			results = self.scheduler.run_sandboxed(commands, self.sandbox.limits)
+			outcomes = [self.classify(result, i.filename, settings) for i, result in zip(individuals, results)]
+			for i, outcome in zip(individuals, outcomes):
+				self.sandbox.record(i.genome, outcome)
+			individuals = [i for i, outcome in zip(individuals, outcomes) if outcome == Outcome.OK]
+		else:
+			codes = self.scheduler.run(commands)
+			individuals = [i for i, code in zip(individuals, codes) if code == 0]
+		# individuals whose rendering failed are left unscored
+		return [i for i in individuals if os.path.isfile(i.filename + '.wav')]
+
+	def render_commands(self, individuals, settings):
+		'assign each individual a file and write its orchestra, returns the csound commands'
+		for count, i in enumerate(individuals):
+			i.filename = os.path.join(self.directory, 'tmp_' + str(count).zfill(5))
+			# every level renders under the same names, a failed render must not leave
+			# the file of the previous level to be read in its place
+			if os.path.isfile(i.filename + '.wav'):
+				os.remove(i.filename + '.wav')
+		return [render_command(graph_to_csound(self.program(i)), settings[0], i.filename, \
+			1, settings[1], settings[2]) for i in individuals]
+
+	def score_pipelined(self, individuals, commands, settings, target):
+		'''
+		each render is handed to the analysis processes as soon as it completes,
+		its similarity is computed while the following ones are still rendering
+		'''
+		futures = dict()
+		def analyze(index, result):
+			i = individuals[index]
+			if self.sandbox is not None:
+				outcome = self.classify(result, i.filename, settings)
+				self.sandbox.record(i.genome, outcome)
+				if outcome != Outcome.OK:
+					return
+			futures[index] = self.analysis.submit(i.filename + '.wav', settings[1], target)
+		if self.sandbox is not None:
+			self.scheduler.run_sandboxed(commands, self.sandbox.limits, analyze)
+		else:
+			self.scheduler.run(commands, analyze)
+		for index, future in futures.items():
+			similarity = future.result()
+			# individuals whose rendering failed are left unscored
+			if similarity is not None:
+				individuals[index].similarity = similarity
+
+	def program(self, i):
+		'the tree sent to code generation'
+		return self.programs[id(i)] if self.simplify else i.tree
+
+	def score_silent(self, individuals, scored):
+		'''
+		simplify the programs, those provably silent get the score of a silent render
+		without being rendered, returns the individuals left and the updated known scores
+		'''
+		self.programs = dict((id(i), simplify(i.tree)) for i in individuals)
+		silent = [i for i in individuals if self.programs[id(i)] is None]
+		if silent:
+			# silence is scored the same whatever the program
+			similarity = batch_similarity_from_buffers([np.zeros(int(ceil(self.duration * sample_rate / ksmps)) * ksmps, \
+				dtype=np.float32)], sample_rate, self.reference)[0]
+			for i in silent:
+				i.similarity = similarity
+				i.fidelity = len(self.fidelity_levels)
+		self.silent = self.silent + len(silent)
+		return [i for i in individuals if self.programs[id(i)] is not None], list(scored) + [i.similarity for i in silent]
+
+	def score_interpreted(self, individuals, settings, reference):
+		'score the individuals the interpreter supports, returns those left to csound'
+		supported = [i for i in individuals if supports(self.program(i))]
+		buffers = [interpret(self.program(i), *settings) for i in supported]
+		# csound -W clips what it writes to 16 bits samples
+		buffers = [np.clip(b, -1., 1.) if b is not None else None for b in buffers]
+		interpreted = [i for i, b in zip(supported, buffers) if b is not None]
+		similarities = batch_similarity_from_buffers([b for b in buffers if b is not None], settings[1], reference)
+		for i, similarity in zip(interpreted, similarities):
+			i.similarity = similarity
+		self.interpreted = self.interpreted + len(interpreted)
+		interpreted = set(id(i) for i in interpreted)
+		return [i for i in individuals if id(i) not in interpreted]
+
+	def score_streaming(self, individuals, scored):
+		'''
+		individuals render through the pool while their spectral distance is accumulated,
+		those whose partial distance exceeds the current k-th best full distance are abandoned,
+		the distance only grows with more frames so they could not have been selected anyway
+		'''
+		size = self.reference.size
+		# max heap (negated distances) of the k best full distances known so far
+		best = []
+		def push(dist):
+			if len(best) < self.early_abort:
+				heapq.heappush(best, -dist)
+			elif dist < -best[0]:
+				heapq.heapreplace(best, -dist)
+			self.pool.threshold.value = -best[0] if len(best) == self.early_abort else float('inf')
+		self.pool.threshold.value = float('inf')
+		for similarity in scored:
+			push(size / similarity if similarity > 0 else float('inf'))
+		jobs = dict((self.pool.submit(make_job(graph_to_csound(self.program(i)), self.duration, streaming=True)), i) \
+			for i in individuals)
+		while jobs:
+			for job_id, result in self.pool.poll():
+				i = jobs.pop(job_id)
+				# failed renders and sounds too short for a single frame score 0
+				if result is None or result[1] == 0:
+					i.similarity = 0
+					continue
+				dist, _, completed = result
+				i.similarity = size / dist if dist > 0 else float('inf')
+				if completed:
+					push(dist)
+				else:
+					self.abandoned.add(id(i))
+
+	def render_batches(self, batches, duration, sr, ksmps):
+		'render each batch of individuals with a single orchestra, returns one column of samples per individual'
+		programs = [[self.program(i) for i in b] for b in batches]
+		if self.pool is not None:
+			return self.pool.render([make_job(graphs_to_csound(p), duration, channels=len(p), \
+				sample_rate=sr, ksmps=ksmps) for p in programs])
+		filenames = [os.path.join(self.directory, 'batch_' + str(k).zfill(5)) for k in range(len(batches))]
+		# failed batches are rendered again split under the same names, a file left by
+		# a previous round must not be read as the output of this one
+		for f in filenames:
+			if os.path.exists(f + '.wav'):
+				os.remove(f + '.wav')
+		commands = [render_command(graphs_to_csound(p), duration, f, len(p), sr, ksmps) \
+			for p, f in zip(programs, filenames)]
+		if self.sandbox is not None:
+			results = self.scheduler.run_sandboxed(commands, self.sandbox.limits)
+			outcomes = [self.classify(result, f, (duration, sr, ksmps)) for f, result in zip(filenames, results)]
+			# a failed batch is split and rendered again, the outcome of a program is known
+			# once it renders fine or fails on its own
+			for b, outcome in zip(batches, outcomes):
+				if outcome == Outcome.OK or len(b) == 1:
+					for i in b:
+						self.sandbox.record(i.genome, outcome)
+			codes = [0 if outcome == Outcome.OK else None for outcome in outcomes]
+		else:
+			codes = self.scheduler.run(commands)
+		outputs = []
+		for b, f, code in zip(batches, filenames, codes):
+			samples = read_samples(f + '.wav')[1] if code == 0 else None
+			if samples is not None:
+				samples = samples.reshape(len(samples), -1)
+			# one channel per program, anything else is a failed render
+			outputs.append(samples if samples is not None and samples.shape[1] == len(b) else None)
+		return outputs
+
+	def classify(self, result, filename, settings):
+		'outcome of a sandboxed render'
+		duration, sr, ksmps = settings
+		returncode, stderr = result
+		return classify(returncode, stderr, filename + '.wav', int(ceil(duration * sr / ksmps)) * ksmps, \
+			self.sandbox.min_fraction)
+
+def selection(population, num_selected, complexity_factor, evaluator, cost_model=None, cost_factor=0.):
+	'''
+	select the population best candidates based on our fitness function,
+	with a cost model, programs more expensive to render than average are penalized by cost_factor
+	'''
+	evaluator.evaluate(population)
 	average_total_nodes = np.mean([i.total_nodes for i in population])
+	if cost_model is not None:
+		for i in population:
+			if i.cost is None:
+				i.cost = cost_model.genome_cost(i.genome)
+		average_cost = max(np.mean([i.cost for i in population]), 1e-12)
 	for i in population:
 		# we reward simple solutions, that is those who have less nodes
 		complexity_deviation = i.total_nodes / average_total_nodes
 		i.fitness = i.similarity# / lerp(1., complexity_deviation, complexity_factor)
+		if cost_model is not None:
+			i.fitness = i.fitness / lerp(1., i.cost / average_cost, cost_factor)
 		print(i.fitness)
-	# sort by descending fitness
-	sorted_population = sorted(population, key=lambda i: i.fitness, reverse=True)
+	# sort by descending fitness, individuals only scored at a screening level come last
+	sorted_population = sorted(population, key=lambda i: (i.fidelity, i.fitness), reverse=True)
 	# only return the fittest individuals
 	return sorted_population[:num_selected]
 
 def plot_fitness(fitness_over_time, save_path=None):
+	import matplotlib.pyplot as plt
 	t = np.arange(0, fitness_over_time.shape[0], 1)
 	fig, ax = plt.subplots()
 	for i in range(fitness_over_time.shape[1]):
@@ -112,7 +474,11 @@ class ExperimentParms:
 				max_depth,
 				terminal_likelyhood,
 				lerp_factor,
-				complexity_factor):
+				complexity_factor,
+				op_set=None,
+				cost_model=None,
+				max_cost=None,
+				cost_factor=0.):
 		self.file = file
 		self.intern_op_set = intern_op_set
 		self.term_op_set = term_op_set
@@ -123,6 +489,16 @@ class ExperimentParms:
 		self.terminal_likelyhood = terminal_likelyhood
 		self.lerp_factor = lerp_factor
 		self.complexity_factor = complexity_factor
+		# estimated cpu cost of programs: generation stays within max_cost,
+		# the fitness penalizes expensive programs by cost_factor
+		if cost_model is None and (max_cost is not None or cost_factor > 0):
+			cost_model = CostModel.load()
+		self.cost_model = cost_model
+		self.max_cost = max_cost
+		self.cost_factor = cost_factor
+		# op set with precomputed sampling tables
+		self.op_set = op_set or CompiledOpSet(intern_op_set, term_op_set, opcode_selection_weight_matrix, \
+			cost_model, max_cost)
 
 
 class ExperimentViz:
@@ -137,6 +513,7 @@ class ExperimentViz:
 			plot_tree(population[0].tree, graph_path)
 			self.frames.append(graph_path)
 	def save(self, path):
+		import imageio
 		images = [imageio.imread(f + '.png') for f in self.frames]
 		s0, s1 = 0, 0
 		# determine max dimensions
@@ -156,38 +533,95 @@ class ExperimentViz:
 		imageio.mimsave(path, padded_images)
 
 class Experiment:
-	def __init__(self, parms, tmp_dir, viz=None):
+	def __init__(self, parms, tmp_dir, viz=None, render_pool=None, scheduler=None, cache_path=None, \
+		batch_size=1, early_abort=False, fidelity_levels=(), seed=None, coordinator=None, interpreter=False, \
+		surrogate=None, oversample=4, keep_fraction=.5, simplify=False, sandbox=None, analysis_workers=None, \
+		coarse_to_fine=False, streaming=False):
 		self.parms = parms
 		self.tmp_dir = tmp_dir
 		self.viz = viz
+		self.render_pool = render_pool
+		self.scheduler = scheduler or RenderScheduler()
+		self.cache_path = cache_path
+		self.cache = None
+		self.batch_size = batch_size
+		self.early_abort = early_abort
+		self.fidelity_levels = fidelity_levels
+		self.coordinator = coordinator
+		self.interpreter = interpreter
+		# learned fitness prediction, only the most promising offsprings are rendered
+		self.surrogate = surrogate
+		self.oversample = oversample
+		self.keep_fraction = keep_fraction
+		self.simplify = simplify
+		# csound renders under resource limits, failing subtrees are not generated again
+		self.sandbox = sandbox
+		# number of processes scoring renders as they complete (0 for one per two cores), None to score
+		# them all once rendered, only for renders of a single program from files
+		self.analysis_workers = analysis_workers
+		self.analysis = None
+		# only the individuals that may make it to the selection are scored exactly
+		self.coarse_to_fine = coarse_to_fine
+		# the target spectrogram is memory mapped and renders are scored block by block, for long targets
+		self.streaming = streaming
+		self.rng = np.random.default_rng(seed)
 
 	def initialize(self):
 		if not os.path.exists(self.tmp_dir):
 			os.makedirs(self.tmp_dir)
-		times, _, self.ref_spectrum = spectrogram_from_file(self.parms.file)
-		self.audio_duration = times[-1]
+		if self.streaming:
+			self.audio_duration, reference = stream_reference(self.parms.file, os.path.join(self.tmp_dir, 'reference.npy'))
+			self.ref_spectrum = reference.spectrum
+		else:
+			times, _, self.ref_spectrum = spectrogram_from_file(self.parms.file)
+			self.audio_duration = times[-1]
+			reference = Reference(self.ref_spectrum)
+		if self.cache_path is not None:
+			self.cache = FitnessCache(self.cache_path, file_hash(self.parms.file))
+		level_references = [level_reference(self.parms.file, l) for l in self.fidelity_levels]
+		if self.analysis_workers is not None:
+			refs = dict([('full', reference)] + [('level_' + str(k), r) for k, r in enumerate(level_references)])
+			self.analysis = AnalysisPool(refs, self.analysis_workers or None)
+		self.evaluator = Evaluator(reference, self.audio_duration, self.tmp_dir, \
+			self.render_pool, self.scheduler, self.cache, self.batch_size, \
+			self.parms.selected_population_size if self.early_abort else None, \
+			self.fidelity_levels, level_references, \
+			self.coordinator, self.interpreter, self.simplify, self.sandbox, self.analysis, \
+			self.parms.selected_population_size if self.coarse_to_fine else None, self.streaming)
 		self.fitness_over_time = np.zeros((self.parms.num_generations, self.parms.selected_population_size))
 		self.population = initialize(
 			self.parms.init_population_size, 
 			self.parms.terminal_likelyhood, 
 			self.parms.max_depth, 
-			self.parms.intern_op_set, 
-			self.parms.term_op_set)
+			self.parms.op_set,
+			self.rng)
 		
 	def generation_step(self):
-		self.population = generate_offsprings(
+		offsprings = generate_offsprings(
 			self.population, 
 			self.parms.lerp_factor, 
-			self.parms.intern_op_set,
-			self.parms.term_op_set, 
+			self.parms.op_set,
 			self.parms.terminal_likelyhood, 
-			self.parms.max_depth)
+			self.parms.max_depth,
+			self.rng,
+			self.surrogate,
+			self.oversample,
+			self.keep_fraction,
+			self.sandbox)
 		self.population = selection(
-			self.population, 
+			offsprings, 
 			self.parms.selected_population_size, 
-			self.ref_spectrum, 
-			self.audio_duration, 
-			self.parms.complexity_factor, self.tmp_dir)
+			self.parms.complexity_factor,
+			self.evaluator,
+			self.parms.cost_model,
+			self.parms.cost_factor)
+		if self.surrogate is not None:
+			self.surrogate.learn(offsprings, len(self.fidelity_levels), self.evaluator.abandoned)
+			accuracy = self.surrogate.accuracy(self.surrogate.generation - 1)
+			if accuracy is not None:
+				print('surrogate rank correlation: %.3f, mean absolute error: %.3f' % accuracy)
+		if self.sandbox is not None:
+			print(self.sandbox.report(self.sandbox.end_generation()))
 		if self.viz is not None:
 			self.viz.update(self.population)
 		return [i.fitness for i in self.population]
@@ -200,39 +634,472 @@ class Experiment:
 			self.viz.save(os.path.join(dir_name, 'anim.gif'))
 		clean_dir(self.tmp_dir)
 		# render best candidate in output folder
-		processes = render_individuals(self.population[:1], self.audio_duration, dir_name)
-		wait_for_processes_completion(processes)
+		render_individuals(self.population[:1], self.audio_duration, dir_name, self.render_pool, self.scheduler)
+		self.close()
 		# plot fitness and save it in output folder
 		plot_fitness(self.fitness_over_time, os.path.join(dir_name, 'fitness_over_time'))
 		# also store a plot of the dsp graph
 		plot_tree(self.population[0].tree, os.path.join(dir_name, 'graph'))
+		# predicted and actual similarities, to check the surrogate accuracy
+		if self.surrogate is not None:
+			self.surrogate.save_log(os.path.join(dir_name, 'surrogate.csv'))
+		# render outcomes of each generation
+		if self.sandbox is not None:
+			self.sandbox.save_history(os.path.join(dir_name, 'render_outcomes.csv'))
 
-	def run(self):
+	def close(self):
+		if self.render_pool is not None:
+			self.render_pool.close()
+		if self.analysis is not None:
+			self.analysis.close()
+		if self.coordinator is not None:
+			for name, s in self.coordinator.stats().items():
+				print('render worker', name, 'jobs:', s['completed'], 'jobs/s: %.2f' % s['throughput'], \
+					'busy: %.0f%%' % (100 * s['utilization']))
+			self.coordinator.close()
+		if self.cache is not None:
+			print('fitness cache hits:', self.cache.hits, 'misses:', self.cache.misses)
+			self.cache.close()
+
+	def emigrants(self, count):
+		'the best programs, serialized to be sent to another population'
+		return [i.genome.to_bytes() for i in self.population[:count]]
+
+	def immigrate(self, programs):
+		'replace the worst individuals by programs from other populations, scored at the next selection'
+		newcomers = [Individual(Genome.from_bytes(p)) for p in programs][:len(self.population)]
+		if newcomers:
+			self.population[-len(newcomers):] = newcomers
+
+	def save_checkpoint(self, path, generation):
+		'the population and random states once generation generations completed, written atomically'
+		state = dict(
+			generation=generation,
+			duration=self.audio_duration,
+			population=[(i.genome.to_bytes(), i.similarity, i.fitness, i.fidelity, i.similarities) \
+				for i in self.population],
+			fitness_over_time=self.fitness_over_time[:generation],
+			rng=self.rng.bit_generator.state,
+			random=random.getstate())
+		with open(path + '.tmp', 'wb') as f:
+			pickle.dump(state, f)
+		os.replace(path + '.tmp', path)
+
+	def load_checkpoint(self, path):
+		'restore the state of a checkpoint, returns the number of generations it completed'
+		state = read_checkpoint(path)
+		self.population = [checkpoint_individual(entry) for entry in state['population']]
+		# the run may have been given more generations since
+		done = state['fitness_over_time'][:self.parms.num_generations]
+		self.fitness_over_time[:len(done)] = done
+		self.rng.bit_generator.state = state['rng']
+		random.setstate(state['random'])
+		return state['generation']
+
+	def run(self, checkpoint_path=None):
+		'with a checkpoint path, the population is saved after each generation so the run can be resumed'
 		self.initialize()
-		for i in range(self.parms.num_generations):
+		self.evolve(0, checkpoint_path)
+
+	def resume(self, checkpoint_path):
+		'''
+		continue a run from its last checkpoint, the surrogate, sandbox quarantine
+		and visualization frames start over
+		'''
+		self.initialize()
+		self.evolve(self.load_checkpoint(checkpoint_path), checkpoint_path)
+
+	def evolve(self, start, checkpoint_path=None):
+		for i in range(start, self.parms.num_generations):
 			fitness = self.generation_step()
 			self.fitness_over_time[i,:] = np.array(fitness)[:self.fitness_over_time.shape[1]]
+			if checkpoint_path is not None:
+				self.save_checkpoint(checkpoint_path, i + 1)
 		self.end()
 
-intern_op_set, term_op_set = read_op_set()
+def read_checkpoint(path):
+	with open(path, 'rb') as f:
+		return pickle.load(f)
+
+def checkpoint_individual(entry):
+	'an individual saved by save_checkpoint, with its scores so it is not rendered again'
+	data, similarity, fitness, fidelity, similarities = entry
+	i = Individual(Genome.from_bytes(data))
+	i.similarity, i.fitness, i.fidelity, i.similarities = similarity, fitness, fidelity, similarities
+	return i
+
+def tournament(population, size, rng):
+	'the fittest of size individuals drawn at random'
+	contestants = rng.choice(len(population), size=min(size, len(population)), replace=False)
+	return population[max(contestants, key=lambda k: population[k].fitness)]
+
+class SteadyStateExperiment(Experiment):
+	'''
+	no generations: the render pool workers continuously take the next offspring, each result
+	replaces a weak individual as soon as it arrives, progress is counted in evaluations,
+	screening levels and early abort do not apply, offsprings are rendered at full quality
+	'''
+	def __init__(self, parms, tmp_dir, render_pool, num_evaluations, tournament_size=3, \
+		replacement='worst', report_every=100, viz=None, cache_path=None):
+		Experiment.__init__(self, parms, tmp_dir, viz, render_pool, cache_path=cache_path)
+		self.num_evaluations = num_evaluations
+		self.tournament_size = tournament_size
+		# 'worst' replaces the worst individual, 'tournament' the worst of a random few
+		self.replacement = replacement
+		# fitness is recorded every report_every evaluations
+		self.report_every = report_every
+		self.evaluations = 0
+
+	def initialize(self):
+		Experiment.initialize(self)
+		self.fitness_over_time = np.zeros((max(1, self.num_evaluations // self.report_every), \
+			self.parms.selected_population_size))
+		self.population = selection(
+			self.population,
+			self.parms.selected_population_size,
+			self.parms.complexity_factor,
+			self.evaluator,
+			self.parms.cost_model,
+			self.parms.cost_factor)
+
+	def make_offspring(self):
+		parent = tournament(self.population, self.tournament_size, self.rng)
+		# same methods as generate_offsprings, with the same odds
+		method = self.rng.integers(3)
+		if method == 0:
+			return Individual(mutate_consts_genome(parent.genome, self.parms.lerp_factor, self.rng))
+		if method == 1:
+			child, success = subtree_mutation_genome(parent.genome, self.parms.op_set, \
+				self.parms.terminal_likelyhood, self.parms.max_depth, self.rng)
+			if success:
+				return Individual(child)
+		return initialize(1, self.parms.terminal_likelyhood, self.parms.max_depth, self.parms.op_set, self.rng)[0]
+
+	def insert(self, individual):
+		'replacement as results arrive, the offspring only enters if it beats the one it replaces'
+		individual.fitness = individual.similarity
+		if self.parms.cost_model is not None:
+			# the penalty is relative to the population cost, as in the selection
+			individual.cost = self.parms.cost_model.genome_cost(individual.genome)
+			average_cost = max(np.mean([i.cost for i in self.population]), 1e-12)
+			individual.fitness = individual.fitness / lerp(1., individual.cost / average_cost, self.parms.cost_factor)
+		if self.replacement == 'tournament':
+			contestants = self.rng.choice(len(self.population), \
+				size=min(self.tournament_size, len(self.population)), replace=False)
+			k = min(contestants, key=lambda k: self.population[k].fitness)
+		else:
+			k = min(range(len(self.population)), key=lambda k: self.population[k].fitness)
+		if individual.fitness > self.population[k].fitness:
+			self.population[k] = individual
+		self.evaluations = self.evaluations + 1
+		if self.evaluations % self.report_every == 0 and \
+			self.evaluations // self.report_every <= self.fitness_over_time.shape[0]:
+			fitness = sorted([i.fitness for i in self.population], reverse=True)
+			self.fitness_over_time[self.evaluations // self.report_every - 1,:] = np.array(fitness)
+			if self.viz is not None:
+				self.viz.update(self.population)
+
+	def run(self):
+		self.initialize()
+		reference = Reference(self.ref_spectrum)
+		# enough jobs queued so that a worker never waits for the main process
+		capacity = 2 * self.render_pool.num_workers
+		jobs = dict()
+		submitted = 0
+		while self.evaluations < self.num_evaluations:
+			while len(jobs) < capacity and submitted < self.num_evaluations:
+				offspring = self.make_offspring()
+				submitted = submitted + 1
+				if self.cache is not None:
+					key = self.cache.key(offspring.genome, self.audio_duration)
+					cached = self.cache.get_many([key])
+					if key in cached:
+						offspring.similarity = cached[key]
+						self.insert(offspring)
+						continue
+				job = make_job(graph_to_csound(offspring.tree), self.audio_duration)
+				jobs[self.render_pool.submit(job)] = offspring
+			for job_id, samples in self.render_pool.poll():
+				offspring = jobs.pop(job_id)
+				offspring.similarity = batch_similarity_from_buffers([samples], sample_rate, reference)[0]
+				if self.cache is not None:
+					self.cache.put_many([(self.cache.key(offspring.genome, self.audio_duration), offspring.similarity)])
+				self.insert(offspring)
+		self.population.sort(key=lambda i: i.fitness, reverse=True)
+		self.end()
+
+class MultiTargetEvaluator(Evaluator):
+	'''
+	renders each individual once and scores it against every target in one vectorized pass,
+	failed renders score 0 against all of them
+	'''
+	def __init__(self, references, duration, directory, pool=None, scheduler=None, batch_size=1, sandbox=None):
+		Evaluator.__init__(self, None, duration, directory, pool, scheduler, batch_size=batch_size, sandbox=sandbox)
+		self.references = references
+
+	def evaluate(self, population):
+		new_individuals = [x for x in population if x.similarities is None]
+		settings = (self.duration, sample_rate, ksmps)
+		rendered, buffers = self.render(new_individuals, settings)
+		for i in new_individuals:
+			i.similarities = np.zeros(self.references.count)
+		for i, similarities in zip(rendered, multi_similarity_from_buffers(buffers, sample_rate, self.references)):
+			i.similarities = similarities
+
+class EliteArchive:
+	'the best distinct programs found for each target over the whole run'
+	def __init__(self, names, size=5):
+		self.names = names
+		self.size = size
+		# per target, (similarity, serialized genome) pairs by decreasing similarity
+		self.elites = [[] for n in names]
+
+	def update(self, population):
+		for m in range(len(self.names)):
+			entries = dict((data, similarity) for similarity, data in self.elites[m])
+			for i in population:
+				data = i.genome.to_bytes()
+				entries[data] = max(entries.get(data, 0), i.similarities[m])
+			self.elites[m] = sorted(((s, d) for d, s in entries.items()), key=lambda e: e[0], reverse=True)[:self.size]
+
+	def best(self):
+		'the best genome of each target'
+		return [Genome.from_bytes(e[0][1]) for e in self.elites]
 
-parms = ExperimentParms(
-	file='clap.wav',
-	intern_op_set=intern_op_set, 
-	term_op_set=term_op_set,
-	num_generations=2,
-	init_population_size=12,
-	selected_population_size=12,
-	max_depth=4,
-	terminal_likelyhood=0.5,
-	lerp_factor=0.2,
-	complexity_factor=0.4)
+	def save(self, directory, duration, scheduler=None):
+		'render the best program of each target as <target name>.wav, list the elites in elites.csv'
+		if not os.path.exists(directory):
+			os.makedirs(directory)
+		commands = [render_command(graph_to_csound(g.to_tree()), duration, os.path.join(directory, name)) \
+			for g, name in zip(self.best(), self.names)]
+		(scheduler or RenderScheduler()).run(commands)
+		with open(os.path.join(directory, 'elites.csv'), 'w') as f:
+			f.write('target,rank,similarity,program\n')
+			for name, elites in zip(self.names, self.elites):
+				for rank, (similarity, data) in enumerate(elites):
+					f.write('%s,%d,%f,%s\n' % (name, rank, similarity, Genome.from_bytes(data).digest()))
+
+def multi_target_selection(population, num_selected, evaluator, archive):
+	'''
+	select the best candidates of a multi target experiment: each target ranks the population
+	and an individual is as good as its best rank, so that the specialists of every target survive,
+	its fitness is its best similarity relative to the best one of the population for that target
+	'''
+	evaluator.evaluate(population)
+	archive.update(population)
+	similarities = np.stack([i.similarities for i in population])
+	ranks = np.argsort(np.argsort(-similarities, axis=0, kind='stable'), axis=0)
+	# a perfect match (infinite similarity) is the best possible
+	with np.errstate(invalid='ignore'):
+		relative = np.where(np.isinf(similarities), 1., similarities / np.maximum(np.max(similarities, axis=0), 1e-12))
+	best_ranks, fitness = ranks.min(axis=1), relative.max(axis=1)
+	for i, f in zip(population, fitness):
+		i.similarity = i.fitness = f
+	order = sorted(range(len(population)), key=lambda k: (best_ranks[k], -fitness[k]))
+	return [population[k] for k in order[:num_selected]]
+
+class MultiTargetExperiment(Experiment):
+	'''
+	a single population evolved against many target sounds, every program is rendered once,
+	long enough for the longest target, and scored against all of them,
+	the best programs of each target are kept in an archive
+	'''
+	def __init__(self, parms, files, tmp_dir, render_pool=None, scheduler=None, batch_size=1, \
+		archive_size=5, seed=None, sandbox=None, reference_cache='reference_cache'):
+		Experiment.__init__(self, parms, tmp_dir, render_pool=render_pool, scheduler=scheduler, \
+			batch_size=batch_size, seed=seed, sandbox=sandbox)
+		self.files = files
+		self.archive_size = archive_size
+		# directory of the target spectrograms, keyed by file contents
+		self.reference_cache = reference_cache
+
+	def initialize(self):
+		if not os.path.exists(self.tmp_dir):
+			os.makedirs(self.tmp_dir)
+		targets = [cached_spectrogram(f, self.reference_cache) for f in self.files]
+		self.audio_duration = max(duration for duration, _ in targets)
+		self.references = References([spectrum for _, spectrum in targets])
+		self.archive = EliteArchive([os.path.splitext(os.path.basename(f))[0] for f in self.files], self.archive_size)
+		self.evaluator = MultiTargetEvaluator(self.references, self.audio_duration, self.tmp_dir, \
+			self.render_pool, self.scheduler, self.batch_size, self.sandbox)
+		self.fitness_over_time = np.zeros((self.parms.num_generations, self.parms.selected_population_size))
+		self.population = initialize(self.parms.init_population_size, self.parms.terminal_likelyhood, \
+			self.parms.max_depth, self.parms.op_set, self.rng)
+
+	def generation_step(self):
+		offsprings = generate_offsprings(self.population, self.parms.lerp_factor, self.parms.op_set, \
+			self.parms.terminal_likelyhood, self.parms.max_depth, self.rng, sandbox=self.sandbox)
+		self.population = multi_target_selection(offsprings, self.parms.selected_population_size, \
+			self.evaluator, self.archive)
+		if self.sandbox is not None:
+			print(self.sandbox.report(self.sandbox.end_generation()))
+		print('best similarity per target:', ', '.join('%s: %.1f' % (n, e[0][0]) \
+			for n, e in zip(self.archive.names, self.archive.elites)))
+		return [i.fitness for i in self.population]
+
+	def end(self):
+		dir_name = 'output'
+		if not os.path.exists(dir_name):
+			os.makedirs(dir_name)
+		clean_dir(self.tmp_dir)
+		self.archive.save(os.path.join(dir_name, 'targets'), self.audio_duration, self.scheduler)
+		self.close()
+		plot_fitness(self.fitness_over_time, os.path.join(dir_name, 'fitness_over_time'))
+
+def ring_topology(num_islands):
+	'each island sends its migrants to the next one'
+	return dict((k, [(k + 1) % num_islands]) for k in range(num_islands))
+
+def fully_connected_topology(num_islands):
+	'each island sends its migrants to all others'
+	return dict((k, [d for d in range(num_islands) if d != k]) for k in range(num_islands))
+
+def run_island(index, parms, tmp_dir, seed, experiment_args, render_workers, use_render_pool, \
+	migration_interval, num_migrants, inbox, destinations, num_sources, migration_timeout, results):
+	'''
+	island process main loop, a regular experiment that every migration_interval generations
+	sends its best programs to its destinations and waits for those of its sources
+	'''
+	# forked islands inherit the same random module state, the operators drawing from it
+	# (those of the linked tree representation) would make the same choices on every island
+	random.seed(int(np.random.default_rng(seed).integers(2**63)))
+	# islands share the cores, each renders with its own share
+	render_pool = RenderPool(render_workers) if use_render_pool else None
+	experiment = Experiment(parms, tmp_dir, render_pool=render_pool, scheduler=RenderScheduler(render_workers), \
+		seed=seed, **experiment_args)
+	experiment.initialize()
+	for g in range(parms.num_generations):
+		fitness = experiment.generation_step()
+		experiment.fitness_over_time[g,:] = np.array(fitness)[:experiment.fitness_over_time.shape[1]]
+		if (g + 1) % migration_interval != 0 or g + 1 == parms.num_generations:
+			continue
+		for d in destinations:
+			d.put(experiment.emigrants(num_migrants))
+		arrivals = []
+		for k in range(num_sources):
+			# do not wait forever for an island that crashed
+			try:
+				arrivals += inbox.get(timeout=migration_timeout)
+			except queue.Empty:
+				break
+		experiment.immigrate(arrivals)
+	experiment.close()
+	# the island directory lives in the experiment tmp directory, which is cleaned of files only
+	clean_dir(tmp_dir)
+	os.rmdir(tmp_dir)
+	results.put((index, [(i.genome.to_bytes(), i.fitness) for i in experiment.population], \
+		experiment.fitness_over_time))
+
+class IslandModel:
+	'''
+	several populations evolving in their own process, with their own seed and possibly
+	their own parameters, the best programs migrate along the topology every few generations
+	'''
+	def __init__(self, parms, tmp_dir, num_islands, migration_interval=5, num_migrants=2, \
+		topology=None, seeds=None, experiment_args=None, use_render_pool=False, migration_timeout=600):
+		# a single ExperimentParms shared by all islands, or one per island
+		self.parms = parms if isinstance(parms, list) else [parms] * num_islands
+		self.tmp_dir = tmp_dir
+		self.num_islands = num_islands
+		self.migration_interval = migration_interval
+		self.num_migrants = num_migrants
+		# island index to the list of islands receiving its migrants
+		self.topology = topology or ring_topology(num_islands)
+		self.seeds = seeds or list(np.random.SeedSequence().spawn(num_islands))
+		# extra Experiment arguments, render pools can not be shared so islands create their own
+		self.experiment_args = experiment_args or dict()
+		self.use_render_pool = use_render_pool
+		self.render_workers = max(1, os.cpu_count() // num_islands)
+		self.migration_timeout = migration_timeout
+
+	def run(self):
+		inboxes = [Queue() for k in range(self.num_islands)]
+		results = Queue()
+		processes = []
+		for k in range(self.num_islands):
+			num_sources = sum(1 for dests in self.topology.values() if k in dests)
+			p = Process(target=run_island, args=(k, self.parms[k], os.path.join(self.tmp_dir, 'island_' + str(k)), \
+				self.seeds[k], self.experiment_args, self.render_workers, self.use_render_pool, self.migration_interval, \
+				self.num_migrants, inboxes[k], [inboxes[d] for d in self.topology.get(k, [])], num_sources, \
+				self.migration_timeout, results))
+			p.start()
+			processes.append(p)
+		# results have to be read before joining, a process can not exit with a queue not flushed
+		self.populations = [None] * self.num_islands
+		self.fitness_over_time = [None] * self.num_islands
+		for k in range(self.num_islands):
+			try:
+				index, population, fitness = results.get(timeout=self.migration_timeout)
+			except queue.Empty:
+				print('an island did not report its results')
+				break
+			self.populations[index] = [(Genome.from_bytes(g), f) for g, f in population]
+			self.fitness_over_time[index] = fitness
+		for p in processes:
+			p.join()
+		self.end()
+
+	def end(self):
+		dir_name = 'output'
+		if not os.path.exists(dir_name):
+			os.makedirs(dir_name)
+		reported = [k for k in range(self.num_islands) if self.populations[k] is not None]
+		if not reported:
+			return
+		# best program over all islands
+		genome, fitness = max((p[0] for p in self.populations if p), key=lambda x: x[1])
+		best = Individual(genome)
+		times, _, _ = spectrogram_from_file(self.parms[0].file)
+		render_individuals([best], times[-1], dir_name)
+		# best fitness of each island over generations
+		plot_fitness(np.stack([self.fitness_over_time[k][:,0] for k in reported], axis=1), \
+			os.path.join(dir_name, 'fitness_over_time'))
+		plot_tree(best.tree, os.path.join(dir_name, 'graph'))
+
+# experiments are run from a json config with the cli (see cli.py and config.json):
+# python -m cli run config.json
+# or from python, most Experiment options below are also keys of the config "experiment" section:
+
+# from elements import read_op_set
+# intern_op_set, term_op_set = read_op_set()
+#
+# parms = ExperimentParms(
+# 	file='clap.wav',
+# 	intern_op_set=intern_op_set,
+# 	term_op_set=term_op_set,
+# 	num_generations=2,
+# 	init_population_size=12,
+# 	selected_population_size=12,
+# 	max_depth=4,
+# 	terminal_likelyhood=0.5,
+# 	lerp_factor=0.2,
+# 	complexity_factor=0.4)
 
 # generate a vizualisation gif:
 # Experiment(parms, 'tmp', ExperimentViz('tmp')).run()
 
 # no viz:
-Experiment(parms, 'tmp').run()
+# Experiment(parms, 'tmp').run()
+
+# save the population after each generation, and continue an interrupted run:
+# Experiment(parms, 'tmp').run('checkpoint.pkl')
+# Experiment(parms, 'tmp').resume('checkpoint.pkl')
+
+# render programs by batches of 16 instruments per csound orchestra:
+# Experiment(parms, 'tmp', batch_size=16).run()
+
+# reuse similarities scored by previous runs against the same target:
+# Experiment(parms, 'tmp', cache_path='fitness_cache.db').run()
+
+# render using long lived csound instances (requires the ctcsound module):
+# Experiment(parms, 'tmp', render_pool=RenderPool()).run()
+
+# screen programs at lower sample rates before rendering the best at full quality:
+# from fidelity import default_ladder
+# Experiment(parms, 'tmp', fidelity_levels=default_ladder).run()
+
+# abandon renders that can no longer make it to the selection (requires a render pool):
+# Experiment(parms, 'tmp', render_pool=RenderPool(), early_abort=True).run()
 
 
 
@@ -246,3 +1113,47 @@ Experiment(parms, 'tmp').run()
 
 
 
+
+# steady state evolution, offsprings replace the worst individuals as their renders complete:
+# SteadyStateExperiment(parms, 'tmp', RenderPool(), num_evaluations=2000).run()
+
+# four islands in their own processes, the two best programs of each migrate every 5 generations:
+# IslandModel(parms, 'tmp', 4, migration_interval=5, num_migrants=2).run()
+
+# render and score on worker processes reached over tcp, start remote workers with
+# python distributed.py <host> <port> once the coordinator listens, or use a local cluster:
+# from distributed import LocalCluster
+# Experiment(parms, 'tmp', coordinator=LocalCluster(8)).run()
+
+# evaluate graphs made of simple opcodes with numpy, others are rendered by csound:
+# Experiment(parms, 'tmp', interpreter=True).run()
+
+# render only the offsprings a k-nn model trained on previous scores predicts to be the most promising:
+# from surrogate import Surrogate
+# Experiment(parms, 'tmp', surrogate=Surrogate(), oversample=4, keep_fraction=.5).run()
+
+# simplify programs before rendering them, provably silent ones are scored without rendering:
+# Experiment(parms, 'tmp', simplify=True).run()
+
+# keep programs cheap to render, costs are measured once with python cost.py and read from opcode_costs.json,
+# generation stays within max_cost cpu seconds per second of audio and the fitness penalizes costly programs:
+# parms = ExperimentParms(..., max_cost=0.01, cost_factor=0.2)
+
+# render under memory, cpu time and file size limits, report failures per generation
+# and stop generating subtrees only found in failing programs:
+# from sandbox import Sandbox, Limits
+# Experiment(parms, 'tmp', sandbox=Sandbox(Limits(1 << 30, 2, 64 << 20))).run()
+
+# score each render in one of 4 analysis processes as soon as it completes, while others still render:
+# Experiment(parms, 'tmp', analysis_workers=4).run()
+
+# compare renders with the target coarsely first, only those that may make it to the selection are scored exactly:
+# Experiment(parms, 'tmp', coarse_to_fine=True).run()
+
+# evolve against a long target with bounded memory, its spectrogram is memory mapped
+# and each render is read and scored block by block:
+# Experiment(parms, 'tmp', streaming=True).run()
+
+# evolve a single population against a library of targets, each program is rendered once and scored
+# against all of them, the best programs of each target are written to output/targets:
+# MultiTargetExperiment(parms, ['clap.wav', 'kick.wav', 'snare.wav'], 'tmp').run()
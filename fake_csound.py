@@ -0,0 +1,50 @@
+import os
+import re
+import sys
+import wave
+import zlib
+import numpy as np
+
+# a deterministic stand-in for the csound command line, so benchmarks run without csound:
+# python fake_csound.py -W -o out.wav prog.orc prog.sco
+# each instrument plays a noisy decaying sine to its channel, its pitch, decay and noise level
+# depend on the hash of its code, different programs score differently but always the same way
+
+def instrument_signal(code, duration, sr):
+	h = zlib.crc32(code.encode())
+	t = np.arange(int(duration * sr)) / sr
+	frequency = 50 + h % 4000
+	decay = 1 + (h >> 12) % 16
+	noise = np.random.default_rng(h).uniform(-1, 1, len(t)) * ((h >> 20) % 8) / 16
+	return (np.sin(2 * np.pi * frequency * t) + noise) * np.exp(-decay * t) * .5
+
+def render(orc, sco, output):
+	sr = int(re.search(r'sr = (\d+)', orc).group(1))
+	channels = int(re.search(r'nchnls = (\d+)', orc).group(1))
+	instruments = dict((int(n), code) for n, code in re.findall(r'instr (\d+)\n(.*?)endin', orc, re.S))
+	durations = dict((int(n), float(d)) for n, _, d in re.findall(r'i(\d+) (\S+) (\S+)', sco))
+	data = np.zeros((int(max(durations.values()) * sr), channels))
+	# instr k writes to channel k, a single instrument to the only channel
+	for n, duration in durations.items():
+		signal = instrument_signal(instruments[n], duration, sr)
+		data[:len(signal), (n - 1) % channels] += signal
+	with wave.open(output, 'wb') as f:
+		f.setnchannels(channels)
+		f.setsampwidth(2)
+		f.setframerate(sr)
+		f.writeframes((np.clip(data, -1, 1) * 32767).astype('<i2').tobytes())
+
+def install(directory):
+	'put a csound command running this script first in the PATH of this process and its children'
+	if not os.path.exists(directory):
+		os.makedirs(directory)
+	path = os.path.join(directory, 'csound')
+	with open(path, 'w') as f:
+		f.write('#!/bin/sh\nexec "%s" "%s" "$@"\n' % (sys.executable, os.path.abspath(__file__)))
+	os.chmod(path, 0o755)
+	os.environ['PATH'] = directory + os.pathsep + os.environ['PATH']
+
+if __name__ == '__main__':
+	args = sys.argv[1:]
+	with open(args[-2]) as orc, open(args[-1]) as sco:
+		render(orc.read(), sco.read(), args[args.index('-o') + 1])
@@ -0,0 +1,26 @@
+from collections import namedtuple
+from math import gcd, ceil
+from analysis import read_samples, spectrogram_from_samples, Reference
+
+# a screening level: programs are rendered at a lower sample rate, with larger control blocks
+# and for a fraction of the target duration, only the best fraction moves up to the next level,
+# the last level always is the full quality rendering
+FidelityLevel = namedtuple('FidelityLevel', ['sample_rate', 'ksmps', 'duration_fraction', 'promote_fraction'])
+
+default_ladder = [
+	FidelityLevel(11025, 128, 0.5, 0.3),
+	FidelityLevel(22050, 64, 1., 0.5)]
+
+def level_reference(filename, level):
+	'the target spectrogram as rendered at a screening level'
+	from scipy import signal
+	rate, samples = read_samples(filename)
+	samples = samples[:int(len(samples) * level.duration_fraction)]
+	d = gcd(level.sample_rate, rate)
+	samples = signal.resample_poly(samples, level.sample_rate // d, rate // d)
+	return Reference(spectrogram_from_samples(samples, level.sample_rate)[2])
+
+def promoted(individuals, level):
+	'the individuals scored best at a level, which move up to the next one'
+	count = int(ceil(len(individuals) * level.promote_fraction))
+	return sorted(individuals, key=lambda i: i.similarity, reverse=True)[:count]
@@ -1,7 +1,9 @@
 from random import choice, random
 from util import lerp
-from tree import clone_graph, continue_dsp_graph 
+from tree import clone_graph, continue_dsp_graph, Budget
+import numpy as np
 from elements import value_from_spec, OpType
+from genome import spec_sampler, generate_genomes
 
 def update_const(const, lerp_factor):
 	new_value = value_from_spec(const.spec)
@@ -17,7 +19,11 @@ def mutate_consts(parent, lerp_factor):
 			node.value = update_const(node.value, lerp_factor)
 	return child
 
-def subtree_mutation(parent, intern_op_set, term_op_set, terminal_likelyhood, max_depth):
+def subtree_mutation(parent, intern_op_set, term_op_set, terminal_likelyhood, max_depth, cost_model=None, max_cost=None):
+	'''
+	replace a subtree with a random one, with a cost model and a maximum cost
+	the new subtree gets what the rest of the program leaves, failing if it still goes over
+	'''
 	child = clone_graph(parent)
 	# we try picking a nide at half depth
 	node = child
@@ -39,7 +45,65 @@ def subtree_mutation(parent, intern_op_set, term_op_set, terminal_likelyhood, ma
 
 	if node.value.type_ == OpType.OPCODE and len(node.value.args) > 0:
 		arg_index = int(len(node.value.args) * random())
+		budget = None
+		if max_cost is not None:
+			budget = Budget(cost_model, max_cost - cost_model.tree_cost(child) + \
+				cost_model.tree_cost(node.children[arg_index]))
 		node.children[arg_index] = continue_dsp_graph(node.value.tag, node.value.args[arg_index], \
-			intern_op_set, term_op_set, terminal_likelyhood, max_depth - depth)
+			intern_op_set, term_op_set, terminal_likelyhood, max_depth - depth, budget)
+		if budget is not None and budget.remaining < 0:
+			return clone_graph(parent), False
 		return child, True
 	return child, False
+
+# the same operators, working on the array representation
+
+def mutate_consts_genome(parent, lerp_factor, rng=None):
+	rng = rng or np.random.default_rng()
+	child = parent.copy()
+	positions = child.const_positions()
+	specs = -1 - child.codes[positions]
+	# all constants are drawn at once, whatever their specification
+	sampler = spec_sampler()
+	new_values = sampler.sample(specs, rng)
+	continuous = sampler.continuous[specs]
+	new_values[continuous] = lerp(new_values[continuous], child.values[positions[continuous]], lerp_factor)
+	child.values[positions] = new_values
+	return child
+
+def subtree_mutation_genome(parent, op_set, terminal_likelyhood, max_depth, rng=None):
+	rng = rng or np.random.default_rng()
+	# we try picking a node at half depth
+	position = 0
+	depth = 0
+	depth_threshold = max_depth * rng.random() * 0.5
+	while parent.arity[position] > 0 and depth <= depth_threshold:
+		# try picking an opcode, use a rejection mehtod
+		children = parent.children(position)
+		next_position = children[0]
+		attempts = 0
+		while attempts < 3:
+			next_position = children[rng.integers(len(children))]
+			if parent.codes[next_position] >= 0:
+				break
+			attempts = attempts + 1
+		position = next_position
+		depth = depth + 1
+
+	assert(max_depth > depth)
+
+	op = parent.value(position)
+	if parent.codes[position] >= 0 and len(op.args) > 0:
+		arg_index = int(rng.integers(len(op.args)))
+		replaced = parent.children(position)[arg_index]
+		budgets = None
+		if op_set.max_cost is not None:
+			# the new subtree gets what the rest of the program leaves
+			budgets = [op_set.max_cost - op_set.costs.genome_cost(parent) + op_set.costs.genome_cost(parent, replaced)]
+		subtree = generate_genomes(op_set, [(op.tag, op.args[arg_index], max_depth - depth)], \
+			terminal_likelyhood, rng, budgets)[0]
+		child = parent.replace_subtree(replaced, subtree)
+		if budgets is not None and op_set.costs.genome_cost(child) > op_set.max_cost:
+			return parent.copy(), False
+		return child, True
+	return parent.copy(), False
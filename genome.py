@@ -0,0 +1,295 @@
+import struct
+import hashlib
+import numpy as np
+from elements import OpType, make_const, make_arg, read_op_set, sample_spec, CompiledSpecs
+from csound_reference import wavetables
+from tree import Node
+
+# every opcode variant gets an id, in the deterministic order of the reference
+opcode_table = []
+opcode_ids = dict()
+# every constant specification gets an id too, constants are stored as their spec id
+spec_table = []
+spec_ids = dict()
+
+def opcode_key(op):
+	return (op.value, op.return_type, op.tag, tuple(op.args))
+
+def opcode_id(op):
+	key = opcode_key(op)
+	if key not in opcode_ids:
+		opcode_ids[key] = len(opcode_table)
+		opcode_table.append(op)
+	return opcode_ids[key]
+
+def spec_id(spec):
+	if spec not in spec_ids:
+		spec_ids[spec] = len(spec_table)
+		spec_table.append(spec)
+	return spec_ids[spec]
+
+def register_op_set(tagged_opcodes):
+	for ops_by_tag in tagged_opcodes.values():
+		for ops in ops_by_tag.values():
+			for op in ops:
+				opcode_id(op)
+				for arg in op.args:
+					spec_id(arg.spec)
+
+spec_id(None)
+for op_set in read_op_set():
+	register_op_set(op_set)
+
+compiled_specs = None
+
+def spec_sampler():
+	'sampling tables of the registered specifications, built again once more are registered'
+	global compiled_specs
+	if compiled_specs is None or len(compiled_specs) != len(spec_table):
+		compiled_specs = CompiledSpecs(spec_table)
+	return compiled_specs
+
+def content_key(value):
+	return np.frombuffer(hashlib.blake2b(repr(value).encode(), digest_size=8).digest(), '<u8')[0]
+
+content_keys = None
+
+def content_key_tables():
+	'''
+	a hash of what each opcode id, spec id and wavetable index stands for, ids follow the order
+	opcodes are registered in, digests must not change when the reference does
+	'''
+	global content_keys
+	if content_keys is None or len(content_keys[0]) != len(opcode_table) or len(content_keys[1]) != len(spec_table):
+		content_keys = (np.array([content_key(opcode_key(op)) for op in opcode_table], dtype='<u8'),
+			np.array([content_key(spec) for spec in spec_table], dtype='<u8'),
+			np.array([content_key(w) for w in wavetables], dtype='<u8'),
+			np.array([spec is not None and spec[0] == 'w' for spec in spec_table]))
+	return content_keys
+
+def encode_const(const):
+	'constants values are stored as floats, wavetables as their index'
+	if const.spec is not None and const.spec[0] == 'w':
+		return float(wavetables.index(const.value))
+	return float(const.value)
+
+def decode_const(code, value):
+	spec = spec_table[-code - 1]
+	if spec is not None and spec[0] == 'w':
+		return make_const(wavetables[int(value)], spec)
+	if spec is not None and spec[0] == '(':
+		return make_const(int(value), spec)
+	return make_const(float(value), spec)
+
+class Genome:
+	'''
+	a program stored in prefix order as parallel arrays: opcode id (or -1 - spec id for constants),
+	constant value, arity and subtree size, so cloning is a copy and subtree replacement a splice
+	'''
+	__slots__ = ('codes', 'values', 'arity', 'sizes')
+
+	def __init__(self, codes, values, arity, sizes):
+		self.codes = codes
+		self.values = values
+		self.arity = arity
+		self.sizes = sizes
+
+	@staticmethod
+	def from_tree(node):
+		codes, values, arity = [], [], []
+		for n in node.depth_first():
+			if n.value.type_ == OpType.CONST:
+				codes.append(-1 - spec_id(n.value.spec))
+				values.append(encode_const(n.value))
+			else:
+				codes.append(opcode_id(n.value))
+				values.append(0.)
+			arity.append(len(n))
+		arity = np.array(arity, dtype=np.int16)
+		return Genome(np.array(codes, dtype=np.int32), np.array(values), arity, subtree_sizes(arity))
+
+	def to_tree(self):
+		'rebuild the linked representation used by code generation and vizualisation'
+		root = None
+		# nodes whose children are not all attached yet, with the count left
+		stack = []
+		for i in range(len(self)):
+			node = Node(self.value(i))
+			if stack:
+				parent, left = stack[-1]
+				parent.add_child(node)
+				if left == 1:
+					stack.pop()
+				else:
+					stack[-1] = (parent, left - 1)
+			else:
+				root = node
+			if self.arity[i] > 0:
+				stack.append((node, self.arity[i]))
+		return root
+
+	def to_bytes(self):
+		'''
+		compact serialized form to exchange programs between processes: node count, then codes,
+		constant values and arities, ids are stable as every process registers the same reference
+		'''
+		return struct.pack('<I', len(self.codes)) + self.codes.astype('<i4').tobytes() + \
+			self.values.astype('<f8').tobytes() + self.arity.astype('<i2').tobytes()
+
+	@staticmethod
+	def from_bytes(data):
+		n = struct.unpack_from('<I', data)[0]
+		codes = np.frombuffer(data, '<i4', n, 4).astype(np.int32)
+		values = np.frombuffer(data, '<f8', n, 4 + 4 * n).astype(np.float64)
+		arity = np.frombuffer(data, '<i2', n, 4 + 12 * n).astype(np.int16)
+		return Genome(codes, values, arity, subtree_sizes(arity))
+
+	def digest(self):
+		'''
+		hash of the program, identical programs share it, arities follow from the codes,
+		opcodes, specifications and wavetables are hashed by content rather than by id
+		'''
+		op_keys, spec_keys, wave_keys, is_wave = content_key_tables()
+		ops = self.codes >= 0
+		specs = np.where(ops, 0, -1 - self.codes)
+		keys = np.where(ops, op_keys[np.where(ops, self.codes, 0)], spec_keys[specs])
+		values = self.values.astype('<f8')
+		waves = ~ops & is_wave[specs]
+		keys[waves] ^= wave_keys[values[waves].astype(np.int64)]
+		values[waves] = 0.
+		return hashlib.blake2b(keys.astype('<u8').tobytes() + values.tobytes(), digest_size=20).hexdigest()
+
+	def value(self, i):
+		'the opcode or constant at position i'
+		code = self.codes[i]
+		return opcode_table[code] if code >= 0 else decode_const(code, self.values[i])
+
+	def copy(self):
+		return Genome(self.codes.copy(), self.values.copy(), self.arity.copy(), self.sizes.copy())
+
+	def __len__(self):
+		return int(self.sizes[0])
+
+	def children(self, i):
+		'positions of the children of the node at position i'
+		ls = []
+		j = i + 1
+		for k in range(self.arity[i]):
+			ls.append(j)
+			j = j + self.sizes[j]
+		return ls
+
+	def const_positions(self):
+		return np.nonzero(self.codes < 0)[0]
+
+	def subtree(self, i):
+		end = i + self.sizes[i]
+		return Genome(self.codes[i:end].copy(), self.values[i:end].copy(), \
+			self.arity[i:end].copy(), self.sizes[i:end].copy())
+
+	def replace_subtree(self, i, other):
+		'returns a genome where the subtree at position i is replaced by other'
+		end = i + self.sizes[i]
+		sizes = np.concatenate((self.sizes[:i], other.sizes, self.sizes[end:]))
+		# ancestors of i span over it, their size changes
+		ancestors = np.nonzero(np.arange(i) + self.sizes[:i] > i)[0]
+		sizes[ancestors] += len(other) - (end - i)
+		return Genome(
+			np.concatenate((self.codes[:i], other.codes, self.codes[end:])),
+			np.concatenate((self.values[:i], other.values, self.values[end:])),
+			np.concatenate((self.arity[:i], other.arity, self.arity[end:])),
+			sizes)
+
+def subtree_sizes(arity):
+	'subtree sizes from prefix order arities, computed backwards with a stack'
+	sizes = np.ones(len(arity), dtype=np.int32)
+	stack = []
+	for i in range(len(arity) - 1, -1, -1):
+		for k in range(arity[i]):
+			sizes[i] += stack.pop()
+		stack.append(sizes[i])
+	return sizes
+
+class UniformStream:
+	'uniform samples drawn by chunks from a numpy generator'
+	def __init__(self, rng, chunk=4096):
+		self.rng = rng
+		self.chunk = chunk
+		self.values = []
+		self.index = 0
+
+	def next(self):
+		if self.index == len(self.values):
+			self.values = self.rng.random(self.chunk).tolist()
+			self.index = 0
+		self.index = self.index + 1
+		return self.values[self.index - 1]
+
+def generate_genomes(op_set, roots, terminal_likelyhood, rng=None, budgets=None):
+	'''
+	generate random programs from roots, (parent tag, destination arg, max depth) tuples,
+	the structure is drawn first, constants are then sampled per specification in one pass,
+	with a cost model in the op set, an internal opcode over the budget of its root is replaced by a terminal
+	'''
+	rng = rng or np.random.default_rng()
+	stream = UniformStream(rng)
+	genomes = []
+	# per constant spec id, where to write sampled values
+	const_slots = dict()
+	if budgets is None and op_set.max_cost is not None:
+		budgets = [op_set.max_cost] * len(roots)
+	costs = op_set.costs.costs_by_id() if budgets is not None else None
+	for r, root in enumerate(roots):
+		codes, arity = [], []
+		remaining = budgets[r] if budgets is not None else None
+		stack = [root]
+		while stack:
+			parent_tag, arg, max_depth = stack.pop()
+			# special case if arg type is 'i', we have to use a const
+			if arg.type_ == 'i':
+				code = -1 - spec_id(arg.spec)
+				const_slots.setdefault(code, []).append((len(genomes), len(codes)))
+				codes.append(code)
+				arity.append(0)
+				continue
+			use_terminal = stream.next() < terminal_likelyhood or max_depth == 0
+			op = op_set.pick(use_terminal, arg.type_, parent_tag, stream.next())
+			code = opcode_id(op)
+			if remaining is not None:
+				if not use_terminal and costs[code] > remaining:
+					op = op_set.pick(True, arg.type_, parent_tag, stream.next())
+					code = opcode_id(op)
+				remaining = remaining - costs[code]
+			codes.append(code)
+			arity.append(len(op.args))
+			# children are pushed in reverse to be popped in prefix order
+			for child_arg in reversed(op.args):
+				stack.append((op.tag, child_arg, max_depth - 1))
+		arity = np.array(arity, dtype=np.int16)
+		genomes.append(Genome(np.array(codes, dtype=np.int32), np.zeros(len(codes)), \
+			arity, subtree_sizes(arity)))
+	for code, slots in const_slots.items():
+		values = sample_spec(spec_table[-code - 1], rng, len(slots))
+		for (g, i), v in zip(slots, values):
+			genomes[g].values[i] = v
+	return genomes
+
+def random_genomes(op_set, count, terminal_likelyhood, max_depth, rng=None, attempts=16):
+	'''
+	many random programs, the genome counterpart of make_dsp_graph, with a maximum cost
+	programs over budget are generated again, the cheapest is kept if none fits after a few attempts
+	'''
+	genomes = generate_genomes(op_set, [(7, make_arg('a'), max_depth)] * count, terminal_likelyhood, rng)
+	if op_set.max_cost is None:
+		return genomes
+	costs = np.array([op_set.costs.genome_cost(g) for g in genomes])
+	for _ in range(attempts - 1):
+		over = np.flatnonzero(costs > op_set.max_cost)
+		if len(over) == 0:
+			break
+		retries = generate_genomes(op_set, [(7, make_arg('a'), max_depth)] * len(over), terminal_likelyhood, rng)
+		for k, g in zip(over, retries):
+			cost = op_set.costs.genome_cost(g)
+			if cost < costs[k]:
+				genomes[k], costs[k] = g, cost
+	return genomes
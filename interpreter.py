@@ -0,0 +1,246 @@
+from functools import lru_cache
+from math import ceil, cos, sqrt, tan, pi
+import numpy as np
+from elements import OpType
+from csound_reference import opcodes, OpTag, sample_rate, ksmps
+
+# evaluates simple dsp graphs with numpy instead of launching csound,
+# a-rate signals are arrays of samples, k-rate signals arrays of control blocks values,
+# i-rate values are floats, results match csound (which works with doubles) within a tolerance
+
+# harmonics amplitudes of the wavetables, as declared with GEN10
+wavetable_harmonics = {
+	'giSine': [1],
+	'giSaw': [1, 1/2, 1/3, 1/4, 1/5, 1/6, 1/7, 1/8, 1/9],
+	'giSquare': [1, 0, 1/3, 0, 1/5, 0, 1/7, 0, 1/9],
+	'giTri': [1, 0, -1/9, 0, 1/25, 0, -1/49, 0, 1/81],
+	'giImp': [1, 1, 1, 1, 1, 1, 1, 1, 1]}
+wavetable_size = 1024
+
+@lru_cache(maxsize=None)
+def wavetable(name):
+	'the table as csound computes it: summed harmonics rescaled to a peak of 1, plus a guard point'
+	phase = 2 * np.pi * np.arange(wavetable_size + 1) / wavetable_size
+	table = sum(a * np.sin((k + 1) * phase) for k, a in enumerate(wavetable_harmonics[name]))
+	return table / np.max(np.abs(table[:-1]))
+
+@lru_cache(maxsize=None)
+def rand_cycle():
+	'''
+	csound 16 bits noise generator: seed .5 * 32768, then x = x * 15625 + 1 on 16 bits,
+	its period is 65536 so we compute the whole cycle once
+	'''
+	values = np.empty(65536)
+	x = 16384
+	for i in range(65536):
+		x = (x * 15625 + 1) & 0xffff
+		values[i] = (x - 65536 if x >= 32768 else x) / 32768.
+	return values
+
+class Context:
+	def __init__(self, duration, sr, ksmps):
+		self.sr = sr
+		self.ksmps = ksmps
+		# csound performs whole control blocks
+		self.num_blocks = int(ceil(duration * sr / ksmps))
+		self.num_samples = self.num_blocks * ksmps
+
+	def at_rate(self, value, rate):
+		'convert a value to a signal at rate, k-rate values are held over their block'
+		if isinstance(value, float):
+			return np.full(self.num_samples if rate == 'a' else self.num_blocks, value)
+		if rate == 'a' and len(value) == self.num_blocks:
+			return np.repeat(value, self.ksmps)
+		if rate == 'k' and len(value) == self.num_samples:
+			return value[::self.ksmps]
+		return value
+
+	def times(self, rate):
+		'time of each sample or control block, in seconds'
+		if rate == 'a':
+			return np.arange(self.num_samples) / self.sr
+		return np.arange(self.num_blocks) * self.ksmps / self.sr
+
+	def step(self, rate):
+		'duration of a sample or control block, in seconds'
+		return 1. / self.sr if rate == 'a' else self.ksmps / self.sr
+
+def phases(context, rate, cps, phase):
+	'phase of an oscillator, which outputs its current phase before incrementing it'
+	increments = context.at_rate(cps, rate) * context.step(rate)
+	return (phase + np.concatenate(([0.], np.cumsum(increments[:-1])))) % 1.
+
+def table_lookup(table, phase, interpolate):
+	position = phase * wavetable_size
+	index = np.minimum(position.astype(np.int64), wavetable_size - 1)
+	if not interpolate:
+		return table[index]
+	frac = position - index
+	return table[index] + (table[index + 1] - table[index]) * frac
+
+def oscillator(interpolate):
+	def evaluate(context, rate, args):
+		amp, cps, table, phase = args
+		return context.at_rate(amp, rate) * table_lookup(wavetable(table), \
+			phases(context, rate, cps, phase), interpolate)
+	return evaluate
+
+def phasor(context, rate, args):
+	cps, phase = args
+	return phases(context, rate, cps, phase)
+
+def rand(context, rate, args):
+	# every instance restarts from the same seed, as in csound
+	count = context.num_samples if rate == 'a' else context.num_blocks
+	noise = np.resize(rand_cycle(), count)
+	return context.at_rate(args[0], rate) * noise
+
+def segments(context, rate, args, exponential):
+	'linseg and expseg, the last value is held once the segments are over'
+	values = np.array(args[0::2])
+	times = np.concatenate(([0.], np.cumsum(args[1::2])))
+	t = context.times(rate)
+	if not exponential:
+		return np.interp(t, times, values)
+	return np.exp(np.interp(t, times, np.log(values)))
+
+def linseg(context, rate, args):
+	return segments(context, rate, args, False)
+
+def expseg(context, rate, args):
+	return segments(context, rate, args, True)
+
+def delay(context, rate, args):
+	signal, time = args
+	# a delay longer than the render only outputs silence
+	count = min(int(time * context.sr + .5), len(signal))
+	return np.concatenate((np.zeros(count), signal[:len(signal) - count]))
+
+def recursive_filter(b, a, signal):
+	from scipy.signal import lfilter
+	return lfilter(b, a, signal)
+
+def tone(context, rate, args):
+	signal, cutoff = args
+	b = 2. - cos(2 * pi * cutoff / context.sr)
+	c2 = b - sqrt(b * b - 1.)
+	return recursive_filter([1. - c2], [1., -c2], signal)
+
+def atone(context, rate, args):
+	signal, cutoff = args
+	b = 2. - cos(2 * pi * cutoff / context.sr)
+	c2 = b - sqrt(b * b - 1.)
+	return recursive_filter([c2, -c2], [1., -c2], signal)
+
+def butterlp(context, rate, args):
+	signal, cutoff = args
+	c = 1. / tan(pi * cutoff / context.sr)
+	a1 = 1. / (1. + sqrt(2.) * c + c * c)
+	return recursive_filter([a1, 2. * a1, a1], [1., 2. * (1. - c * c) * a1, (1. - sqrt(2.) * c + c * c) * a1], signal)
+
+def butterhp(context, rate, args):
+	signal, cutoff = args
+	c = tan(pi * cutoff / context.sr)
+	a1 = 1. / (1. + sqrt(2.) * c + c * c)
+	return recursive_filter([a1, -2. * a1, a1], [1., 2. * (c * c - 1.) * a1, (1. - sqrt(2.) * c + c * c) * a1], signal)
+
+def mac(context, rate, args):
+	return sum(context.at_rate(k, 'a') * a for k, a in zip(args[0::2], args[1::2]))
+
+def maca(context, rate, args):
+	return sum(a * b for a, b in zip(args[0::2], args[1::2]))
+
+def product(context, rate, args):
+	result = args[0]
+	for a in args[1:]:
+		result = result * a
+	return result
+
+def sum_(context, rate, args):
+	return sum(args)
+
+def is_const(node):
+	return node.value.type_ == OpType.CONST
+
+def const_args(nodes):
+	return all(is_const(c) for c in nodes)
+
+# opcode name to (evaluation, return types, structural condition on the node),
+# some opcodes are only supported when csound would behave in a simple way
+interpreted_opcodes = {
+	'oscil': (oscillator(False), 'ak', None),
+	'oscili': (oscillator(True), 'ak', None),
+	'poscil': (oscillator(True), 'ak', None),
+	'phasor': (phasor, 'ak', None),
+	'rand': (rand, 'ak', None),
+	'linseg': (linseg, 'ak', None),
+	# zero or negative values are illegal for exponentials
+	'expseg': (expseg, 'ak', lambda node: all(c.value.value > 0 for c in node[0::2])),
+	# delays shorter than a sample are illegal, we stay clear of it at any sample rate
+	'delay': (delay, 'a', lambda node: node[1].value.value >= 1e-3),
+	# filters coefficients are computed once, cutoffs have to be constant
+	'tone': (tone, 'a', lambda node: const_args(node[1:])),
+	'atone': (atone, 'a', lambda node: const_args(node[1:])),
+	'butterlp': (butterlp, 'a', lambda node: const_args(node[1:])),
+	'butterhp': (butterhp, 'a', lambda node: const_args(node[1:])),
+	'mac': (mac, 'a', None),
+	# samples are multiplied by pairs
+	'maca': (maca, 'a', lambda node: len(node) % 2 == 0),
+	'product': (product, 'a', None),
+	'sum': (sum_, 'a', None)}
+
+def node_supported(node):
+	'whether the opcode of the node (not its children) can be interpreted'
+	if is_const(node):
+		return True
+	op = node.value
+	if op.value not in interpreted_opcodes:
+		return False
+	_, rates, condition = interpreted_opcodes[op.value]
+	return op.return_type in rates and (condition is None or condition(node))
+
+def unsupported_opcodes(node):
+	'names of the opcodes of a graph the interpreter can not evaluate'
+	return set(n.value.value for n in node.depth_first() if not node_supported(n))
+
+def supports(node):
+	return all(node_supported(n) for n in node.depth_first())
+
+def support_report():
+	'''
+	the reference opcodes signatures, whether the interpreter supports them
+	and whether only under some conditions on their arguments
+	'''
+	report = []
+	for op in opcodes:
+		if isinstance(op, OpTag):
+			continue
+		words = op.split()
+		name, rate = words[1], words[0][0]
+		supported = name in interpreted_opcodes and rate in interpreted_opcodes[name][1]
+		report.append((op, supported, supported and interpreted_opcodes[name][2] is not None))
+	return report
+
+def evaluate(node, context):
+	if is_const(node):
+		# wavetables are passed by name
+		return node.value.value if isinstance(node.value.value, str) else float(node.value.value)
+	op = node.value
+	args = [evaluate(node[i], context) for i in range(len(node))]
+	# a-rate arguments are always given as full signals
+	args = [context.at_rate(v, 'a') if arg.type_ == 'a' else v for v, arg in zip(args, op.args)]
+	return interpreted_opcodes[op.value][0](context, op.return_type, args)
+
+def interpret(node, duration, sr=sample_rate, ksmps=ksmps):
+	'''
+	samples of the graph performed for duration, as rendered by csound,
+	returns None if the graph is not supported or produces non finite samples
+	'''
+	if not supports(node):
+		return None
+	context = Context(duration, sr, ksmps)
+	with np.errstate(all='ignore'):
+		samples = context.at_rate(evaluate(node, context), 'a')
+	if not np.all(np.isfinite(samples)):
+		return None
+	return samples.astype(np.float32)
@@ -0,0 +1,85 @@
+import os
+import sys
+import time
+import numpy as np
+from collections import defaultdict
+from elements import read_op_set, CompiledOpSet, OpType, make_const
+from tree import opcode_selection_weight_matrix, Node
+from genome import opcode_table
+from code_gen import graph_to_csound
+from interpreter import interpret, supports, support_report
+from analysis import read_samples
+from util import render_command, clean_dir
+from scheduler import RenderScheduler
+
+# Compare the numpy interpreter output with csound renders of random supported graphs,
+# reports the relative error per opcode and the time spent by both
+
+def relative_error(samples, reference):
+	'rms of the difference relative to the rms of the csound render'
+	l = min(len(samples), len(reference))
+	diff = np.sqrt(np.mean(np.square(samples[:l] - reference[:l])))
+	return diff / max(np.sqrt(np.mean(np.square(reference[:l]))), 1e-6)
+
+def long_delays(trees, duration, count=8):
+	'graphs delayed by the render duration or more, whose output is silent'
+	op = next(op for op in opcode_table if op.value == 'delay')
+	delayed = []
+	for k, t in enumerate(trees[:count]):
+		node = Node(op)
+		node.add_child(t)
+		node.add_child(Node(make_const(duration * (1 + k % 2), op.args[1].spec)))
+		delayed.append(node)
+	return delayed
+
+def conformance(count=200, duration=1., tolerance=1e-2, directory='tmp_conformance', seed=0):
+	if not os.path.exists(directory):
+		os.makedirs(directory)
+	intern, term = read_op_set()
+	op_set = CompiledOpSet(intern, term, opcode_selection_weight_matrix)
+	rng = np.random.default_rng(seed)
+	trees = []
+	while len(trees) < count:
+		trees += [t for t in (g.to_tree() for g in op_set.random_genomes(count, 0.3, 4, rng)) if supports(t)]
+	trees = trees[:count]
+	trees += long_delays(trees, duration)
+
+	start = time.perf_counter()
+	interpreted = [interpret(t, duration) for t in trees]
+	interpreter_time = time.perf_counter() - start
+
+	filenames = [os.path.join(directory, 'graph_' + str(k).zfill(5)) for k in range(len(trees))]
+	start = time.perf_counter()
+	RenderScheduler().run([render_command(graph_to_csound(t), duration, f) for t, f in zip(trees, filenames)])
+	csound_time = time.perf_counter() - start
+	rendered = [read_samples(f + '.wav')[1] for f in filenames]
+	clean_dir(directory)
+
+	errors = defaultdict(list)
+	graph_errors = []
+	failures = 0
+	for t, samples, reference in zip(trees, interpreted, rendered):
+		if samples is None or reference is None:
+			failures = failures + 1
+			continue
+		# csound -W writes 16 bits samples
+		error = relative_error(np.clip(samples, -1., 1.), reference)
+		graph_errors.append(error)
+		for name in set(n.value.value for n in t.depth_first() if n.value.type_ == OpType.OPCODE):
+			errors[name].append(error)
+
+	print('supported reference opcodes:')
+	for signature, supported, conditional in support_report():
+		print('  [' + ('~' if conditional else 'x' if supported else ' ') + '] ' + signature)
+	print('graphs:', len(trees), 'not compared (render failed or non finite):', failures)
+	print('csound: %.3fs, interpreter: %.3fs' % (csound_time, interpreter_time))
+	print('relative error per opcode (graphs using it, within tolerance, median, max):')
+	for name, e in sorted(errors.items()):
+		e = np.array(e)
+		print('  %-10s %5d %6.1f%% %10.2e %10.2e' % (name, len(e), 100 * np.mean(e <= tolerance), np.median(e), np.max(e)))
+	return np.array(graph_errors)
+
+# python interpreter_conformance.py [graph count] [duration]
+if __name__ == '__main__':
+	args = sys.argv[1:]
+	conformance(int(args[0]) if args else 200, float(args[1]) if len(args) > 1 else 1.)
@@ -0,0 +1,40 @@
+import os
+from multiprocessing import get_context
+from concurrent.futures import ProcessPoolExecutor
+from analysis import read_samples, batch_similarity_from_buffers
+
+# renders and analysis overlap: as soon as a csound process completes, its wav file is handed
+# to a pool of analysis processes which compute its similarity while other renders still run
+
+# target spectrograms by key, set in each analysis process when it starts
+references = dict()
+
+def set_references(refs):
+	references.update(refs)
+
+def analyze_file(filename, sample_rate, key):
+	'similarity of a rendered file with a reference, None if the file was not written'
+	if not os.path.isfile(filename):
+		return None
+	# an unreadable file scores 0, as in the batch evaluation
+	return float(batch_similarity_from_buffers([read_samples(filename)[1]], sample_rate, references[key])[0])
+
+class AnalysisPool:
+	'processes scoring rendered files, the references are sent once when they start'
+	def __init__(self, refs, num_workers=None):
+		self.num_workers = num_workers or max(1, os.cpu_count() // 2)
+		self.executor = ProcessPoolExecutor(self.num_workers, mp_context=get_context('fork'), \
+			initializer=set_references, initargs=(refs,))
+
+	def submit(self, filename, sample_rate, key):
+		'returns a future of the similarity'
+		return self.executor.submit(analyze_file, filename, sample_rate, key)
+
+	def close(self):
+		self.executor.shutdown()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *args):
+		self.close()
@@ -0,0 +1,65 @@
+import sys
+import numpy as np
+from elements import read_op_set, CompiledOpSet
+from tree import opcode_selection_weight_matrix
+from interpreter import interpret, supports
+from analysis import spectrogram_from_samples, batch_similarity_from_buffers, pruned_similarity_from_buffers, Reference
+from csound_reference import sample_rate
+
+# Check the coarse to fine scoring against the exact batch scoring, on sounds of random graphs
+# performed by the numpy interpreter (no csound needed): survivors get the exact similarity,
+# pruned sounds a valid upper bound of it, and the keep best sounds, counting those whose
+# similarity is already known, are always among the exactly scored
+
+def random_sounds(count, duration, rng):
+	intern, term = read_op_set()
+	op_set = CompiledOpSet(intern, term, opcode_selection_weight_matrix)
+	sounds = []
+	while len(sounds) < count:
+		trees = [g.to_tree() for g in op_set.random_genomes(count, 0.3, 4, rng)]
+		sounds += [interpret(t, duration) for t in trees if supports(t)]
+	sounds = sounds[:count]
+	# failed renders and sounds too short for a single frame
+	sounds[1] = None
+	sounds[2] = np.zeros(100, dtype=np.float32)
+	return sounds
+
+def check_case(buffers, reference, keep, known):
+	'failures of one pruned scoring'
+	failures = []
+	batch = batch_similarity_from_buffers(buffers, sample_rate, reference)
+	pruned, exact = pruned_similarity_from_buffers(buffers, sample_rate, reference, keep, known)
+	if not np.array_equal(pruned[exact], batch[exact]):
+		failures.append('survivors differ from the batch similarity by up to %.2e' % \
+			np.max(np.abs(pruned[exact] - batch[exact]) / batch[exact]))
+	if np.any(pruned[~exact] < batch[~exact] * (1 - 1e-6)):
+		failures.append('%d pruned sounds with a bound below their similarity' % \
+			np.count_nonzero(pruned[~exact] < batch[~exact] * (1 - 1e-6)))
+	# the keep best of the known and new sounds, the new ones have to be exact
+	ranked = np.argsort(-np.concatenate((np.array(known, dtype=np.float64), batch)), kind='stable')[:keep]
+	best = ranked[ranked >= len(known)] - len(known)
+	if not np.all(exact[best]):
+		failures.append('%d of the %d best were pruned' % (np.count_nonzero(~exact[best]), keep))
+	return failures, np.count_nonzero(exact)
+
+def check(count=300, duration=1., seed=0):
+	rng = np.random.default_rng(seed)
+	sounds = random_sounds(count + 1, duration, rng)
+	reference = Reference(spectrogram_from_samples(sounds[0], sample_rate)[2])
+	buffers = sounds[1:]
+	failed = 0
+	for keep in (1, 4, 16, 64):
+		for known_count in sorted(set(k for k in (0, keep // 2, 2 * keep) if k < len(buffers))):
+			# the known similarities are exact scores of other sounds
+			known = batch_similarity_from_buffers(buffers[:known_count], sample_rate, reference)
+			failures, scored = check_case(buffers[known_count:], reference, keep, list(known))
+			print('keep %3d, known %3d: %3d of %d scored exactly' % (keep, known_count, scored, \
+				len(buffers) - known_count), *failures, sep='  ')
+			failed = failed + bool(failures)
+	print('failures:', failed)
+	return not failed
+
+# python pruning_check.py [sound count] [duration]
+if __name__ == '__main__':
+	args = sys.argv[1:]
+	sys.exit(0 if check(int(args[0]) if args else 300, float(args[1]) if len(args) > 1 else 1.) else 1)
@@ -0,0 +1,279 @@
+import os
+import time
+from collections import namedtuple, deque
+from multiprocessing import Process, Pipe, Value
+from multiprocessing.connection import wait
+from csound_reference import make_header, wavetable_declarations, sample_rate, ksmps
+
+# a render job: the instrument code and how long it should be performed,
+# the wav file is only written if a filename (without extension) is provided,
+# a job renders instruments 1 to channels, each on its own output channel,
+# a streaming job returns its spectral distance with the pool reference instead of samples
+RenderJob = namedtuple('RenderJob', ['instr', 'duration', 'filename', 'channels', 'streaming', \
+	'sample_rate', 'ksmps'])
+
+def make_job(instr, duration, filename=None, channels=1, streaming=False, sample_rate=sample_rate, ksmps=ksmps):
+	return RenderJob(instr, duration, filename, channels, streaming, sample_rate, ksmps)
+
+# how often (in samples) streaming jobs check their partial distance
+stream_check_samples = 4096
+
+def write_wav(filename, samples, sample_rate):
+	'write float samples as a 16 bits wav, matching what csound -W produces'
+	import numpy as np
+	from scipy.io import wavfile
+	pcm = (np.clip(samples, -1., 1.) * 32767).astype(np.int16)
+	wavfile.write(filename, sample_rate, pcm)
+
+class CsoundInstance:
+	'a long lived csound instance, header and wavetables are compiled once'
+	def __init__(self, nchnls=1, sr=sample_rate, ksmps=ksmps):
+		import ctcsound
+		self.cs = ctcsound.Csound()
+		# no audio output, no displays, no messages: we read the output buffer
+		for option in ['-n', '-d', '-m0']:
+			self.cs.setOption(option)
+		if self.cs.compileOrc('\n'.join([make_header(nchnls, sr, ksmps), wavetable_declarations])) != 0:
+			raise RuntimeError('failed to compile csound header')
+		# keep the performance alive forever, notes are scheduled per job
+		self.cs.readScore('f0 z')
+		self.cs.start()
+		self.sr = int(self.cs.sr())
+		self.ksmps = self.cs.ksmps()
+		self.nchnls = nchnls
+
+	def perform(self, instr, duration, channels=1):
+		'''
+		compile instruments 1 to channels and perform them, returns the samples
+		(one column per channel if more than one) or None on failure
+		'''
+		import numpy as np
+		# compiling replaces the previous definition of the instruments
+		if self.cs.compileOrc(instr) != 0:
+			return None
+		self.cs.readScore('\n'.join(['i' + str(k) + ' 0 ' + str(duration) for k in range(1, channels + 1)]))
+		num_blocks = int(np.ceil(duration * self.sr / self.ksmps))
+		samples = np.zeros((num_blocks * self.ksmps, self.nchnls), dtype=np.float32)
+		for i in range(num_blocks):
+			if self.cs.performKsmps() != 0:
+				return None
+			# spout holds interleaved frames
+			samples[i*self.ksmps:(i+1)*self.ksmps] = self.cs.spout().reshape(self.ksmps, self.nchnls)
+		return samples[:, 0] if channels == 1 else samples[:, :channels]
+
+	def perform_streaming(self, instr, duration, reference, threshold):
+		'''
+		perform instr 1 and accumulate its spectral distance with the reference frame by frame,
+		gives up as soon as the partial distance exceeds the threshold since it can only grow,
+		returns (distance, frames compared, completed) or None on failure
+		'''
+		import numpy as np
+		from scipy import signal
+		from analysis import win_len, win_step, frame_count
+		if self.cs.compileOrc(instr) != 0:
+			return None
+		self.cs.readScore('i1 0 ' + str(duration))
+		num_blocks = int(np.ceil(duration * self.sr / self.ksmps))
+		samples = np.zeros(num_blocks * self.ksmps, dtype=np.float32)
+		next_frame, dist, last_check = 0, 0., 0
+		for i in range(num_blocks):
+			if self.cs.performKsmps() != 0:
+				return None
+			end = (i + 1) * self.ksmps
+			samples[i*self.ksmps:end] = self.cs.spout().reshape(self.ksmps, self.nchnls)[:, 0]
+			if end - last_check < stream_check_samples and i < num_blocks - 1:
+				continue
+			last_check = end
+			# compare the frames completed since the last check
+			available = min(frame_count(end), reference.shape[1])
+			if available <= next_frame:
+				continue
+			segment = samples[next_frame*win_step:(available - 1)*win_step + win_len]
+			_, _, spectrogram = signal.spectrogram(
+				segment, self.sr, nperseg=win_len, nfft=win_len, scaling='spectrum')
+			diff = spectrogram - reference[:, next_frame:available]
+			dist = dist + float(np.sum(diff * diff))
+			next_frame = available
+			if dist > threshold.value:
+				# stop the note so that it does not leak into the next job
+				self.cs.killInstance(1, None, 0, False)
+				self.cs.performKsmps()
+				return dist, next_frame, False
+		return dist, next_frame, True
+
+	def cleanup(self):
+		self.cs.stop()
+		self.cs.cleanup()
+
+def render_worker(conn, threshold):
+	'''
+	worker process main loop, renders jobs received through conn,
+	threshold is the shared distance above which streaming jobs are abandoned
+	'''
+	# the header is fixed once csound started, we keep an instance per rendering settings
+	# and power of two channels count, so that batches of varying sizes reuse the same few instances
+	instances = dict()
+	reference = None
+	while True:
+		item = conn.recv()
+		if item is None:
+			break
+		kind, payload = item
+		if kind == 'reference':
+			reference = payload
+			continue
+		job_id, job = payload
+		settings = (1 << (job.channels - 1).bit_length(), job.sample_rate, job.ksmps)
+		if settings not in instances:
+			instances[settings] = CsoundInstance(*settings)
+		instance = instances[settings]
+		if job.streaming:
+			conn.send((job_id, instance.perform_streaming(job.instr, job.duration, reference, threshold)))
+			continue
+		samples = instance.perform(job.instr, job.duration, job.channels)
+		if samples is not None and job.filename is not None:
+			write_wav(job.filename + '.wav', samples, instance.sr)
+		conn.send((job_id, samples))
+	for instance in instances.values():
+		instance.cleanup()
+
+def render_in_batches(items, batch_size, render_batches):
+	'''
+	render items grouped in batches, render_batches takes a list of batches and returns
+	for each either a (samples, len(batch)) array or None on failure,
+	failed batches are split and rendered again so a bad program only loses itself
+	'''
+	results = [None] * len(items)
+	pending = [list(range(s, min(s + batch_size, len(items)))) for s in range(0, len(items), batch_size)]
+	while pending:
+		outputs = render_batches([[items[i] for i in b] for b in pending])
+		retry = []
+		for b, out in zip(pending, outputs):
+			if out is not None:
+				for column, i in enumerate(b):
+					results[i] = out[:, column]
+			elif len(b) > 1:
+				half = len(b) // 2
+				retry += [b[:half], b[half:]]
+		pending = retry
+	return results
+
+class RenderPool:
+	'''
+	a fixed number of long lived worker processes, each holding a csound instance,
+	jobs exceeding the timeout get their worker killed and replaced
+	'''
+	def __init__(self, num_workers=None, timeout=5):
+		# workers import ctcsound, without it they would die and look like stuck renders
+		try:
+			import ctcsound
+		except ImportError:
+			raise ImportError('RenderPool requires the ctcsound module, without render_pool '
+				'programs are rendered through the csound command')
+		self.num_workers = num_workers or os.cpu_count()
+		self.timeout = timeout
+		self.queue = deque()
+		self.next_job_id = 0
+		# shared with the workers for streaming jobs
+		self.threshold = Value('d', float('inf'), lock=False)
+		self.reference = None
+		# per worker: process, connection, (job id, deadline) or None when idle
+		self.workers = [self.spawn_worker() for i in range(self.num_workers)]
+
+	def spawn_worker(self):
+		parent_conn, child_conn = Pipe()
+		process = Process(target=render_worker, args=(child_conn, self.threshold), daemon=True)
+		process.start()
+		if self.reference is not None:
+			parent_conn.send(('reference', self.reference))
+		return [process, parent_conn, None]
+
+	def set_reference(self, spectrum):
+		'the spectrogram streaming jobs are compared to'
+		self.reference = spectrum
+		for w in self.workers:
+			w[1].send(('reference', spectrum))
+
+	@property
+	def pending(self):
+		'number of jobs waiting for a worker'
+		return len(self.queue)
+
+	@property
+	def in_flight(self):
+		'number of jobs currently rendering'
+		return sum(1 for w in self.workers if w[2] is not None)
+
+	def submit(self, job):
+		job_id = self.next_job_id
+		self.next_job_id = self.next_job_id + 1
+		self.queue.append((job_id, job))
+		self.dispatch()
+		return job_id
+
+	def dispatch(self):
+		for w in self.workers:
+			if not self.queue:
+				return
+			if w[2] is None:
+				job_id, job = self.queue.popleft()
+				w[1].send(('job', (job_id, job)))
+				w[2] = (job_id, time.monotonic() + self.timeout)
+
+	def poll(self, timeout=None):
+		'wait for jobs to complete, returns a list of (job id, samples or None)'
+		busy = [w for w in self.workers if w[2] is not None]
+		if not busy:
+			return []
+		now = time.monotonic()
+		deadline = min(w[2][1] for w in busy)
+		wait_time = max(0, deadline - now)
+		if timeout is not None:
+			wait_time = min(wait_time, timeout)
+		ready = wait([w[1] for w in busy] + [w[0].sentinel for w in busy], wait_time)
+		done = []
+		now = time.monotonic()
+		for i, w in enumerate(self.workers):
+			if w[2] is None:
+				continue
+			if w[1] in ready:
+				try:
+					done.append(w[1].recv())
+					w[2] = None
+					continue
+				except EOFError:
+					pass
+			elif w[0].sentinel not in ready and w[2][1] > now:
+				continue
+			# the worker died or hangs, csound may do so randomly
+			print('killed non responsive render worker, job:', w[2][0])
+			done.append((w[2][0], None))
+			w[0].kill()
+			w[0].join()
+			self.workers[i] = self.spawn_worker()
+		self.dispatch()
+		return done
+
+	def render(self, jobs):
+		'render jobs, returns the samples (or None on failure) in the same order'
+		ids = [self.submit(j) for j in jobs]
+		results = dict()
+		while len(results) < len(ids):
+			results.update(self.poll())
+		return [results[i] for i in ids]
+
+	def close(self):
+		for w in self.workers:
+			if w[2] is None:
+				w[1].send(None)
+			else:
+				w[0].kill()
+		for w in self.workers:
+			w[0].join()
+		self.workers = []
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *args):
+		self.close()
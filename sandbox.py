@@ -0,0 +1,131 @@
+import hashlib
+import resource
+import signal
+import wave
+from collections import namedtuple, Counter
+
+# csound renders run as subprocesses under resource limits, each render gets an outcome,
+# subtrees only ever seen in failing programs are quarantined so they are not generated again
+
+# address space (bytes), cpu time (seconds) and written files size (bytes) allowed to a render,
+# a busy hung render is stopped by the cpu limit whatever the load of the machine
+Limits = namedtuple('Limits', ['address_space', 'cpu_seconds', 'file_size'])
+default_limits = Limits(1 << 30, 2, 64 << 20)
+
+def limit_resources(limits):
+	'a function applying the limits, to run in the child process before csound starts'
+	def apply():
+		resource.setrlimit(resource.RLIMIT_AS, (limits.address_space, limits.address_space))
+		# SIGXCPU at the soft limit, SIGKILL a second later if it is ignored
+		resource.setrlimit(resource.RLIMIT_CPU, (limits.cpu_seconds, limits.cpu_seconds + 1))
+		resource.setrlimit(resource.RLIMIT_FSIZE, (limits.file_size, limits.file_size))
+	return apply
+
+class Outcome:
+	OK = 'ok'
+	COMPILE_ERROR = 'compile error'
+	RUNTIME_ERROR = 'runtime error'
+	TIMEOUT = 'timeout'
+	OOM = 'oom'
+	TINY_OUTPUT = 'tiny output'
+
+outcomes = [Outcome.OK, Outcome.COMPILE_ERROR, Outcome.RUNTIME_ERROR, Outcome.TIMEOUT, \
+	Outcome.OOM, Outcome.TINY_OUTPUT]
+
+# csound messages telling what went wrong
+oom_messages = ['memory allocate failure', 'out of memory', 'cannot allocate memory', 'bad_alloc']
+compile_messages = ['syntax error', 'parsing failed', 'parser failure', 'compilation failed', \
+	'unable to find opcode', 'used before defined']
+runtime_messages = ['init error', 'perf error']
+
+def output_frames(path):
+	'number of frames of a wav file, 0 if it is missing or unreadable'
+	try:
+		with wave.open(path, 'rb') as f:
+			return f.getnframes()
+	except (OSError, EOFError, wave.Error):
+		return 0
+
+def classify(returncode, stderr, path, expected_frames, min_fraction=.5):
+	'''
+	outcome of a render from its return code (None if killed on the wall clock),
+	its error output and the wav file it should have written
+	'''
+	message = stderr.lower()
+	if returncode is None or returncode in (-signal.SIGXCPU, -signal.SIGKILL):
+		return Outcome.TIMEOUT
+	if any(m in message for m in oom_messages):
+		return Outcome.OOM
+	if any(m in message for m in compile_messages):
+		return Outcome.COMPILE_ERROR
+	if returncode != 0 or any(m in message for m in runtime_messages):
+		return Outcome.RUNTIME_ERROR
+	if output_frames(path) < expected_frames * min_fraction:
+		return Outcome.TINY_OUTPUT
+	return Outcome.OK
+
+def subtree_hashes(genome):
+	'''
+	canonical hash of every opcode subtree, in prefix order a subtree is a slice of the arrays,
+	structurally identical subtrees with the same constants share their hash
+	'''
+	hashes = []
+	for i in range(len(genome)):
+		if genome.codes[i] < 0:
+			continue
+		end = i + genome.sizes[i]
+		h = hashlib.blake2b(genome.codes[i:end].tobytes(), digest_size=8)
+		h.update(genome.values[i:end].tobytes())
+		hashes.append(h.digest())
+	return hashes
+
+class Sandbox:
+	'''
+	limits of the renders, outcome counts per generation, and the quarantine: subtrees found
+	in at least threshold failing programs and in no successful one
+	'''
+	def __init__(self, limits=default_limits, threshold=2, min_fraction=.5):
+		self.limits = limits
+		self.threshold = threshold
+		# renders shorter than this fraction of the expected duration are failures
+		self.min_fraction = min_fraction
+		self.failures = Counter()
+		self.succeeded = set()
+		self.quarantine = set()
+		self.counts = Counter()
+		# outcome counts of each completed generation
+		self.history = []
+
+	def record(self, genome, outcome):
+		self.counts[outcome] += 1
+		hashes = subtree_hashes(genome)
+		if outcome == Outcome.OK:
+			self.succeeded.update(hashes)
+			self.quarantine.difference_update(hashes)
+			return
+		for h in hashes:
+			self.failures[h] += 1
+			if self.failures[h] >= self.threshold and h not in self.succeeded:
+				self.quarantine.add(h)
+
+	def quarantined(self, genome):
+		'whether the program holds a quarantined subtree'
+		return bool(self.quarantine) and any(h in self.quarantine for h in subtree_hashes(genome))
+
+	def end_generation(self):
+		'outcome counts of the generation, starts counting the next one'
+		counts = self.counts
+		self.history.append(counts)
+		self.counts = Counter()
+		return counts
+
+	def report(self, counts):
+		failed = ', '.join('%s: %d' % (o, counts[o]) for o in outcomes[1:] if counts[o] > 0)
+		return 'renders: %d ok, %s, quarantined subtrees: %d' % \
+			(counts[Outcome.OK], failed or 'no failure', len(self.quarantine))
+
+	def save_history(self, path):
+		with open(path, 'w') as f:
+			f.write('generation,' + ','.join(o.replace(' ', '_') for o in outcomes) + '\n')
+			for g, counts in enumerate(self.history):
+				f.write(str(g) + ',' + ','.join(str(counts[o]) for o in outcomes) + '\n')
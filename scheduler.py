@@ -0,0 +1,76 @@
+import os
+import asyncio
+from sandbox import limit_resources
+
+class RenderScheduler:
+	'''
+	runs csound processes with a bounded concurrency, each process gets its own
+	wall clock deadline and is killed as soon as it is exceeded
+	'''
+	def __init__(self, max_concurrency=None, timeout=5, progress=None):
+		self.max_concurrency = max_concurrency or os.cpu_count()
+		self.timeout = timeout
+		# optional callback, called with the scheduler whenever a job starts or ends
+		self.progress = progress
+		self.queue_depth = 0
+		self.in_flight = 0
+		self.killed = 0
+
+	def notify(self):
+		if self.progress is not None:
+			self.progress(self)
+
+	async def run_job(self, semaphore, args, preexec_fn=None):
+		'''
+		returns the return code, with preexec_fn the process is sandboxed:
+		it runs preexec_fn first and we return its return code and error output
+		'''
+		async with semaphore:
+			self.queue_depth = self.queue_depth - 1
+			self.in_flight = self.in_flight + 1
+			self.notify()
+			if preexec_fn is None:
+				process = await asyncio.create_subprocess_exec(*args)
+			else:
+				process = await asyncio.create_subprocess_exec(*args, stdout=asyncio.subprocess.DEVNULL, \
+					stderr=asyncio.subprocess.PIPE, preexec_fn=preexec_fn)
+			try:
+				if preexec_fn is None:
+					return await asyncio.wait_for(process.wait(), self.timeout)
+				_, stderr = await asyncio.wait_for(process.communicate(), self.timeout)
+				return process.returncode, stderr.decode(errors='replace')
+			except asyncio.TimeoutError:
+				# csound may hang randomly, we reclaim the slot right away
+				process.kill()
+				await process.wait()
+				self.killed = self.killed + 1
+				print('killed non responsive process:', ' '.join(args))
+				return None if preexec_fn is None else (None, '')
+			finally:
+				self.in_flight = self.in_flight - 1
+				self.notify()
+
+	async def run_all(self, commands, preexec_fn=None, on_done=None):
+		semaphore = asyncio.Semaphore(self.max_concurrency)
+		self.queue_depth = len(commands)
+		self.notify()
+		async def run_one(index, args):
+			result = await self.run_job(semaphore, args, preexec_fn)
+			if on_done is not None:
+				on_done(index, result)
+			return result
+		return await asyncio.gather(*[run_one(index, args) for index, args in enumerate(commands)])
+
+	def run(self, commands, on_done=None):
+		'''
+		run commands, returns their return codes in order, None for killed processes,
+		on_done is called with the index and return code of each command as soon as it completes
+		'''
+		return asyncio.run(self.run_all(commands, None, on_done))
+
+	def run_sandboxed(self, commands, limits, on_done=None):
+		'''
+		run commands under resource limits, returns their (return code, error output) in order,
+		the cpu limit stops busy processes, the wall clock timeout still catches blocked ones
+		'''
+		return asyncio.run(self.run_all(commands, limit_resources(limits), on_done))
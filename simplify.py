@@ -0,0 +1,134 @@
+from elements import OpType
+from csound_reference import OpTag
+from genome import opcode_table
+from tree import Node
+
+# programs are simplified before code generation: an upper bound of each signal amplitude
+# is propagated from the leaves, silent operands of MATH opcodes are removed, nested sums
+# and products are flattened, and a program whose output is provably silent is not rendered
+# there is no constant folding: the reference only declares k and a rate MATH arguments,
+# constants are only generated for i rate ones, so MATH operands always are opcode outputs
+# what to expect: amplitude constants are drawn in [0, 1], one below the silence threshold
+# is rare, so random programs are almost never found silent (none of 20000), the pass
+# mostly saves an opcode call by flattening nested MATH opcodes (about 1 program in 40),
+# it pays off on programs evolved towards zero amplitudes, which is why it is optional
+
+# below half the 16 bits quantization step, a signal is written as silence
+silence = .5 / 32768
+
+# bound of the output relative to the amplitude argument bound,
+# for opcodes whose output is proportional to their first argument
+amplitude_gains = {
+	'oscil': 1., 'oscili': 1., 'poscil': 1.,
+	'rand': 1., 'randi': 1., 'randh': 1.,
+	'linen': 1., 'mpulse': 1.,
+	# band limited waveforms overshoot a little
+	'buzz': 2., 'vco': 2., 'vco2': 2.,
+	'gbuzz': float('inf')}
+
+# bound of the output relative to the input signal bound, for linear filters, delays
+# and reverbs (the l1 norm of their impulse response), silent input gives silent output
+input_gains = {
+	'delay': 1., 'delayk': 1.,
+	'tone': 1., 'tonex': 1., 'atone': 2., 'atonex': 2.,
+	'butterlp': 4., 'butterhp': 4., 'butterbp': 4., 'butterbr': 4.,
+	'reson': float('inf'), 'resonx': float('inf'), 'resony': float('inf'),
+	'resonr': float('inf'), 'resonz': float('inf'), 'areson': float('inf'),
+	'reverb': float('inf'), 'nreverb': float('inf')}
+
+# opcodes of the reference by name, return type and argument types, to change their arity
+opcode_variants = dict(((op.value, op.return_type, tuple(a.type_ for a in op.args)), op) for op in opcode_table)
+
+def scaled(bound, gain):
+	# silence stays silence whatever the gain
+	return 0. if bound == 0 else bound * gain
+
+def const_bound(node):
+	return abs(node.value.value) if isinstance(node.value.value, (int, float)) else float('inf')
+
+def variant(op, args):
+	'the same opcode taking args, None if the reference does not declare it'
+	return opcode_variants.get((op.value, op.return_type, tuple(a.value.return_type \
+		if a.value.type_ == OpType.OPCODE else 'i' for a in args)))
+
+def make_node(value, children):
+	node = Node(value)
+	for c in children:
+		node.add_child(c)
+	return node
+
+def simplify_math(op, children, bounds):
+	'''
+	remove silent operands of sums and products, flatten nested ones,
+	returns the simplified node and its bound, the node is None if it is silent
+	'''
+	name = op.value
+	if name == 'product':
+		# a quiet operand only silences the product if the others are bounded,
+		# an unbounded one (resonant filter, reverb) may amplify it back, 0 * inf is inf
+		bound = 1.
+		for b in bounds:
+			bound = float('inf') if float('inf') in (b, bound) else bound * b
+		if bound <= silence:
+			return None, 0.
+		return flatten(op, children), bound
+	# sum operands are single signals, mac and maca ones pairs of signals multiplied together
+	size = 1 if name == 'sum' else 2
+	groups = [(children[k:k+size], scaled(bounds[k], bounds[k+size-1]) if size == 2 else bounds[k]) \
+		for k in range(0, len(children) - size + 1, size)]
+	# an unpaired operand is left as is
+	leftover = children[len(groups) * size:]
+	kept = [(g, b) for g, b in groups if b > silence]
+	if not kept and not leftover:
+		return None, 0.
+	bound = sum(b for _, b in kept) + (float('inf') if leftover else 0.)
+	remaining = [c for g, _ in kept for c in g] + leftover
+	if name == 'sum' and len(remaining) == 1:
+		# the sum of a single signal is the signal
+		return remaining[0], bound
+	reduced = variant(op, remaining) if len(kept) < len(groups) else op
+	if reduced is None:
+		return make_node(op, children), bound
+	return flatten(reduced, remaining) if name == 'sum' else make_node(reduced, remaining), bound
+
+def flatten(op, children):
+	'sum(sum(a, b), c) becomes sum(a, b, c), the same goes for products, as long as the opcode exists'
+	flat = []
+	for c in children:
+		if c.value.type_ == OpType.OPCODE and c.value.value == op.value and c.value.return_type == op.return_type:
+			flat.extend(c.children)
+		else:
+			flat.append(c)
+	flat_op = variant(op, flat) if len(flat) != len(children) else None
+	if flat_op is None:
+		return make_node(op, children)
+	return make_node(flat_op, flat)
+
+def simplify_node(node):
+	'returns the simplified node, or None if it is provably silent, and its amplitude bound'
+	if node.value.type_ == OpType.CONST:
+		return node, const_bound(node)
+	op = node.value
+	results = [simplify_node(c) for c in node]
+	# silent operands are only dropped by MATH opcodes, elsewhere they are kept as they were
+	children = [s if s is not None else c for (s, _), c in zip(results, node)]
+	bounds = [b for _, b in results]
+	if op.tag == OpTag.MATH and op.value in ('sum', 'product', 'mac', 'maca'):
+		return simplify_math(op, children, bounds)
+	if op.value in amplitude_gains:
+		bound = scaled(bounds[0], amplitude_gains[op.value])
+	elif op.value in input_gains:
+		bound = scaled(bounds[0], input_gains[op.value])
+	elif op.value in ('linseg', 'expseg'):
+		bound = max(bounds[0::2])
+	elif op.value in ('phasor', 'adsr', 'madsr'):
+		bound = 1.
+	else:
+		bound = float('inf')
+	if bound <= silence:
+		return None, 0.
+	return make_node(op, children), bound
+
+def simplify(node):
+	'the simplified program, None if its output is provably silent'
+	return simplify_node(node)[0]
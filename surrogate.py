@@ -0,0 +1,130 @@
+import numpy as np
+from genome import opcode_table
+
+def genome_depth(arity):
+	'depth of a prefix order program, the stack holds the ancestors left with children to visit'
+	stack, depth = [], 0
+	for a in arity:
+		depth = max(depth, len(stack))
+		if stack:
+			if stack[-1] == 1:
+				stack.pop()
+			else:
+				stack[-1] = stack[-1] - 1
+		if a > 0:
+			stack.append(a)
+	return depth
+
+def genome_features(genome, parent_fitness):
+	'''
+	opcode histogram, size, depth, summary of the constants magnitudes and the parent fitness,
+	individuals with no parent (random immigrants) are flagged
+	'''
+	codes = genome.codes
+	histogram = np.bincount(codes[codes >= 0], minlength=len(opcode_table))[:len(opcode_table)]
+	consts = np.log1p(np.abs(genome.values[codes < 0]))
+	if len(consts) == 0:
+		consts = np.zeros(1)
+	has_parent = parent_fitness >= 0
+	return np.concatenate((histogram, [
+		len(genome),
+		genome_depth(genome.arity),
+		len(consts) / len(genome),
+		np.mean(consts), np.std(consts), np.min(consts), np.max(consts),
+		np.log1p(max(parent_fitness, 0)),
+		1. if has_parent else 0.])).astype(np.float32)
+
+class Surrogate:
+	'''
+	k nearest neighbours regression of the log similarity, trained online from every scored program,
+	the oldest samples are overwritten once max_samples are stored
+	'''
+	def __init__(self, k=8, max_samples=20000, min_samples=64):
+		self.k = k
+		self.max_samples = max_samples
+		# no prediction until that many programs are known
+		self.min_samples = min_samples
+		self.features = None
+		self.targets = np.zeros(max_samples, dtype=np.float32)
+		self.count = 0
+		# (generation, predicted, actual) log similarities of the programs scored with a prediction
+		self.log = []
+		self.generation = 0
+
+	@property
+	def size(self):
+		return min(self.count, self.max_samples)
+
+	@property
+	def trained(self):
+		return self.size >= self.min_samples
+
+	def add(self, features, similarity):
+		if self.features is None:
+			self.features = np.zeros((self.max_samples, len(features)), dtype=np.float32)
+		index = self.count % self.max_samples
+		self.features[index] = features
+		self.targets[index] = np.log1p(max(similarity, 0))
+		self.count = self.count + 1
+
+	def predict(self, features):
+		'predicted log similarities of a (N, F) features matrix, weighted by inverse distance'
+		known = self.features[:self.size]
+		# features are standardized, otherwise the histogram counts dominate
+		mean, std = known.mean(axis=0), known.std(axis=0) + 1e-6
+		known = (known - mean) / std
+		features = (features - mean) / std
+		dist = np.sum(features * features, axis=1)[:, None] + np.sum(known * known, axis=1)[None, :] \
+			- 2 * features @ known.T
+		k = min(self.k, len(known))
+		nearest = np.argpartition(dist, k - 1, axis=1)[:, :k]
+		weights = 1. / (np.sqrt(np.maximum(np.take_along_axis(dist, nearest, axis=1), 0)) + 1e-3)
+		return np.sum(weights * self.targets[nearest], axis=1) / np.sum(weights, axis=1)
+
+	def features_of(self, individual):
+		if individual.features is None:
+			individual.features = genome_features(individual.genome, individual.parent_fitness)
+		return individual.features
+
+	def prescreen(self, candidates, count):
+		'the count candidates with the best predicted similarity'
+		if not self.trained or count >= len(candidates):
+			return candidates
+		predicted = self.predict(np.stack([self.features_of(i) for i in candidates]))
+		for i, p in zip(candidates, predicted):
+			i.predicted = p
+		order = np.argsort(-predicted)
+		return [candidates[k] for k in order[:count]]
+
+	def learn(self, individuals, full_fidelity, abandoned=()):
+		'''
+		add the programs scored at full quality that are not known yet,
+		logs predicted and actual log similarities for those who had a prediction
+		'''
+		for i in individuals:
+			if i.learned or i.similarity < 0 or i.fidelity != full_fidelity or id(i) in abandoned:
+				continue
+			self.add(self.features_of(i), i.similarity)
+			i.learned = True
+			if i.predicted is not None:
+				self.log.append((self.generation, i.predicted, np.log1p(max(i.similarity, 0))))
+		self.generation = self.generation + 1
+
+	def accuracy(self, generation=None):
+		'''
+		rank correlation and mean absolute error of the predictions,
+		for a generation or overall, None if there was no prediction
+		'''
+		log = [l for l in self.log if generation is None or l[0] == generation]
+		if len(log) < 2:
+			return None
+		predicted, actual = np.array([l[1] for l in log]), np.array([l[2] for l in log])
+		ranks = lambda x: np.argsort(np.argsort(x))
+		correlation = np.corrcoef(ranks(predicted), ranks(actual))[0, 1]
+		return correlation, np.mean(np.abs(predicted - actual))
+
+	def save_log(self, path):
+		with open(path, 'w') as f:
+			f.write('generation,predicted,actual\n')
+			for g, p, a in self.log:
+				f.write('%d,%f,%f\n' % (g, p, a))
@@ -1,6 +1,6 @@
 import os
 from code_gen import graph_to_csound 
-from elements import read_op_set, make_arg
+from elements import read_op_set
 from util import render_audio
 from tree import make_dsp_graph
 from vizualisation import plot_tree, plot_audio_file
@@ -24,8 +24,7 @@ def test_program_gen():
 	duration = 2
 
 	for i in range(32):
-		g = make_dsp_graph(make_arg('a'), intern_op_set, term_op_set, \
-			terminal_likelyhood, max_depth)
+		g = make_dsp_graph(intern_op_set, term_op_set, terminal_likelyhood, max_depth)
 		prg = graph_to_csound(g)
 		print(prg)
 		render_audio(prg, duration, 'tmp')
@@ -1,5 +1,6 @@
+import hashlib
 from random import random, choice
-from elements import const_from_arg, pick_opcode, pick_opcode_weighted, make_arg
+from elements import const_from_arg, pick_opcode, pick_opcode_weighted, make_arg, OpType
 
 class Node:
 	def __init__(self, value):
@@ -19,10 +20,8 @@ class Node:
 		for child in self.children:
 			yield from child.depth_first()
 	def total_nodes_count(self):
-		count = 1 # itself
-		for n in self.depth_first():
-			count = count + 1
-		return count
+		# depth_first yields the node itself first
+		return sum(1 for n in self.depth_first())
 
 def clone_graph(node):
 	v = node.clone()
@@ -31,6 +30,21 @@ def clone_graph(node):
 			v.add_child(clone_graph(child))
 	return v
 
+def node_signature(value):
+	'a string uniquely identifying an opcode variant or a constant'
+	if value.type_ == OpType.CONST:
+		return 'c' + repr(value.value)
+	return 'o' + value.value + value.return_type + ''.join(a.type_ for a in value.args)
+
+def graph_hash(node):
+	'canonical hash of a graph, structurally identical programs share the same hash'
+	# prefix order and known arities make the signature sequence unambiguous
+	h = hashlib.sha1()
+	for n in node.depth_first():
+		h.update(node_signature(n.value).encode())
+		h.update(b'|')
+	return h.hexdigest()
+
 opcode_selection_weight_matrix = [
 #OSC, 	RAND, 	ENV, 	DELAY, 	FILTER, REVERB, MATH
 #---------------------------------------------------
@@ -51,7 +65,19 @@ opcode_selection_weight_matrix = [
 #OUT	
 [1, 	1, 		0, 		2, 		2, 		2, 		2]]
 
-def continue_dsp_graph(parent_tag, dst_arg, intern_op_set, term_op_set, terminal_likelyhood, max_depth):
+class Budget:
+	'what is left of the estimated cost allowed to a program while it is generated'
+	def __init__(self, cost_model, remaining):
+		self.cost_model = cost_model
+		self.remaining = remaining
+
+	def cost(self, op):
+		return self.cost_model.op_cost(op)
+
+	def spend(self, op):
+		self.remaining = self.remaining - self.cost(op)
+
+def continue_dsp_graph(parent_tag, dst_arg, intern_op_set, term_op_set, terminal_likelyhood, max_depth, budget=None):
 	# TMP debug, depth is -1 as we add consts to terminal nodes, should not go below -1
 	assert(max_depth >= -1), 'dst arg:' + str(dst_arg)
 	# special case if dst_arg type is 'i', we have to use a const
@@ -62,15 +88,32 @@ def continue_dsp_graph(parent_tag, dst_arg, intern_op_set, term_op_set, terminal
 	opcode, tag = pick_opcode_weighted( \
 		term_op_set if use_terminal else intern_op_set, dst_arg, \
 		opcode_selection_weight_matrix[parent_tag])
+	# with a cost budget, an internal opcode we can not afford is replaced by a terminal
+	if budget is not None:
+		if not use_terminal and budget.cost(opcode) > budget.remaining:
+			opcode, tag = pick_opcode_weighted(term_op_set, dst_arg, opcode_selection_weight_matrix[parent_tag])
+		budget.spend(opcode)
 	node = Node(opcode)
 	# add children to the node
 	for arg in node.value.args:
 		node.add_child(continue_dsp_graph(tag, arg, \
-			intern_op_set, term_op_set, terminal_likelyhood, max_depth - 1))
+			intern_op_set, term_op_set, terminal_likelyhood, max_depth - 1, budget))
 	return node
 
 # free the user from specifying the tag and arg type when generating a new tree
-def make_dsp_graph(intern_op_set, term_op_set, terminal_likelyhood, max_depth):
-	return continue_dsp_graph(7, make_arg('a'), intern_op_set, term_op_set, terminal_likelyhood, max_depth)
-	
+def make_dsp_graph(intern_op_set, term_op_set, terminal_likelyhood, max_depth, cost_model=None, max_cost=None, attempts=16):
+	'''
+	with a cost model and a maximum cost, programs over budget are generated again,
+	the cheapest is returned if none fits after a few attempts
+	'''
+	if max_cost is None:
+		return continue_dsp_graph(7, make_arg('a'), intern_op_set, term_op_set, terminal_likelyhood, max_depth)
+	candidates = []
+	for _ in range(attempts):
+		budget = Budget(cost_model, max_cost)
+		graph = continue_dsp_graph(7, make_arg('a'), intern_op_set, term_op_set, terminal_likelyhood, max_depth, budget)
+		if budget.remaining >= 0:
+			return graph
+		candidates.append((budget.remaining, graph))
+	return max(candidates, key=lambda c: c[0])[1]
 
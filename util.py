@@ -1,5 +1,5 @@
-import os, subprocess
-from csound_reference import header, wavetable_declarations
+import os, subprocess, hashlib
+from csound_reference import make_header, wavetable_declarations, sample_rate, ksmps
 
 def lerp(a, b, t):
 	return a + (b - a) * t
@@ -12,27 +12,29 @@ def clean_dir(dirpath):
 		filepath = os.path.join(dirpath, filename)
 		os.remove(filepath)
 
-def render_audio(instr, dur, filename, sync=True):
-	# file contents
-	orc = '\n'.join([header, wavetable_declarations, instr])
-	sco = 'i1 0 ' + str(dur)
+def file_hash(filepath):
+	'hash of a file contents, identifies a target sound whatever its path'
+	h = hashlib.sha1()
+	with open(filepath, 'rb') as f:
+		for chunk in iter(lambda: f.read(1 << 16), b''):
+			h.update(chunk)
+	return h.hexdigest()
+
+def render_command(instr, dur, filename, channels=1, sr=sample_rate, ksmps=ksmps):
+	'write the orc and sco files, returns the csound command rendering them'
+	# file contents, one instrument per channel
+	orc = '\n'.join([make_header(channels, sr, ksmps), wavetable_declarations, instr])
+	sco = '\n'.join(['i' + str(k) + ' 0 ' + str(dur) for k in range(1, channels + 1)])
 	# write temporary orc and sco files
 	with open(filename + '.orc', 'w') as f:
 		f.write(orc)
 	with open(filename + '.sco', 'w') as f:
 		f.write(sco)
+	return ['csound', '-W', '-o', filename + '.wav', filename + '.orc', filename + '.sco']
+
+def render_audio(instr, dur, filename, sync=True):
 	# render audio with CSound
-	args = ['csound', '-W', '-o', filename + '.wav', filename + '.orc', filename + '.sco']
+	args = render_command(instr, dur, filename)
 	if sync:
 		return subprocess.call(args)
 	return subprocess.Popen(args)
-
-def wait_for_processes_completion(processes):
-	while True:
-		all_done = True
-		for p in processes:
-			if p.poll() is None:
-				all_done = False
-				break
-		if all_done:
-			return
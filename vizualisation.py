@@ -1,10 +1,11 @@
 import wave
 import numpy as np
-import matplotlib.pyplot as plt
 from itertools import count
-from graphviz import Digraph
+
+# matplotlib and graphviz are only imported when plotting
 
 def plot_audio_file(filename):
+	import matplotlib.pyplot as plt
 	spf = wave.open(filename + '.wav','r')
 	signal = spf.readframes(-1)
 	signal = np.fromstring(signal, 'Int16')
@@ -16,6 +17,7 @@ def plot_audio_file(filename):
 	plt.show()
 
 def plot_tree(tree, filename):
+	from graphviz import Digraph
 	g = Digraph('G', filename=filename, format='png')
 	# assign ids to nodes
 	for i, n in zip(count(), tree.depth_first()):